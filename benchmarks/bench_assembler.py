@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""Assembler throughput benchmark (tokenizer and full assembly, in lines per second)
+
+usage: python benchmarks/bench_assembler.py [MJIL|MJO ...] [-n REPEAT]
+
+.mjo inputs are disassembled to a temporary .mjil file first (with group directive GLOBAL),
+the scan column only tokenizes every line, the assemble column runs MjILAssembler.read().
+"""
+
+import argparse, os, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from mjotool.assembler import MjILAssembler, TokenType
+from mjotool.commands import default_options, read_script, disassemble_script
+
+DEFAULT_INPUT = os.path.join(ROOT, 'data', 'mjs', 'console.mjil')
+
+
+def prepare_inputs(filenames:list, tempdir:str) -> list:
+    options = default_options(False)
+    options.group_directive = 'GLOBAL'
+    inputs = []
+    for filename in filenames:
+        if not filename.lower().endswith('.mjil'):
+            mjilname = os.path.join(tempdir, os.path.splitext(os.path.basename(filename))[0] + '.mjil')
+            disassemble_script(filename, read_script(filename), mjilname, options=options)
+            filename = mjilname
+        inputs.append(filename)
+    return inputs
+
+def scan(filename:str) -> tuple:
+    """Tokenize every line of a file, returns (lines, tokens)
+    """
+    assembler = MjILAssembler(filename)
+    assembler.open()
+    lines = tokens = 0
+    while assembler.next_line():
+        lines += 1
+        while assembler.next_token().type is not TokenType.EOL:
+            tokens += 1
+    assembler.close()
+    return (lines, tokens)
+
+def assemble(filename:str) -> MjILAssembler:
+    assembler = MjILAssembler(filename)
+    assembler.read()
+    return assembler
+
+def timeit(method, filename:str, repeat:int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        method(filename)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main(argv:list=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('inputs', metavar='MJIL', nargs='*', default=[DEFAULT_INPUT])
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        inputs = prepare_inputs(args.inputs, tempdir)
+        print('{:<32} {:>8} {:>9} {:>16} {:>16}'.format('input', 'lines', 'tokens', 'scan', 'assemble'))
+        total_lines = total_scan = total_asm = 0
+        for filename in inputs:
+            lines, tokens = scan(filename)
+            scan_time = timeit(scan, filename, args.repeat)
+            asm_time = timeit(assemble, filename, args.repeat)
+            total_lines += lines
+            total_scan += scan_time
+            total_asm += asm_time
+            print('{:<32} {:>8d} {:>9d} {:>8.0f} lines/s {:>8.0f} lines/s'.format(os.path.basename(filename)[:32], lines, tokens, lines / scan_time, lines / asm_time))
+        if len(inputs) > 1:
+            print('{:<32} {:>8d} {:>9} {:>8.0f} lines/s {:>8.0f} lines/s'.format('total', total_lines, '', total_lines / total_scan, total_lines / total_asm))
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
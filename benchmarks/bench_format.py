@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""Instruction formatting benchmark matrix (compiled templates vs reference formatter)
+
+usage: python benchmarks/bench_format.py [MJO ...] [-n REPEAT] [--combos N] [--seed SEED]
+
+every -H/-A/-F flag is toggled from the default options (with and without color),
+followed by N seeded random combinations of flags, group and resfile directives.
+output of both formatters is checked to be identical before timing.
+"""
+
+import argparse, math, os, random, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from mjotool._util import signed_i, unsigned_I
+from mjotool.flags import MjoScope
+from mjotool.script import Instruction, MjoScript, ILFormat
+from mjotool.analysis import ControlFlowGraph
+from mjotool.assembler import MjILAssembler
+from mjotool.commands import default_options, HASH_FLAGNAMES, ALIAS_FLAGNAMES, FORMAT_FLAGNAMES
+
+DEFAULT_INPUT = os.path.join(ROOT, 'data', 'mjs', 'console.mjil')
+
+
+def load_scripts(filenames:list) -> list:
+    scripts = []
+    for filename in filenames:
+        if filename.lower().endswith('.mjil'):
+            assembler = MjILAssembler(filename)
+            assembler.read()
+            script = assembler.script
+        else:
+            with open(filename, 'rb') as f:
+                script = MjoScript.disassemble_script(f)
+        ControlFlowGraph.build_from_script(script, lazy=False)  # assign jump targets
+        scripts.append(script)
+    return scripts
+
+def format_instruction_uncompiled(instr:Instruction, *, options:ILFormat=ILFormat.DEFAULT, resource_key:str=None) -> str:
+    """Reference formatter, interprets the opcode encoding and options for every call
+
+    Instruction.format_instruction() output must always be identical to this.
+    """
+    colors:dict = options.colors
+    sb:str = ''
+
+    if options.address_labels:
+        address = options.address_fmt(instr.offset)
+        sb += '{BRIGHT}{BLACK}{0}:{RESET_ALL} '.format(address, **colors)
+    if instr.opcode.mnemonic == "line":  # 0x83a
+        sb += '{BRIGHT}{BLACK}{0.opcode.mnemonic}{RESET_ALL}'.format(instr, **colors)
+    else:
+        sb += '{BRIGHT}{WHITE}{0.opcode.mnemonic}{RESET_ALL}'.format(instr, **colors)
+
+    if not instr.opcode.encoding:
+        return sb  # no operands, nothing to add
+
+    # padding after opcode (min 1 space, which is not included in padding option count)
+    sb += ' ' + (' ' * max(0, options.opcode_padding - len(instr.opcode.mnemonic)))
+
+    known_hash_name, known_hash_is_syscall = None, False
+    if options.known_hashes:
+        known_hash_name, known_hash_is_syscall = instr.check_known_hash(options=options)
+
+    operands = []
+    for operand in instr.opcode.encoding:
+        op = None  # if assigned, append to operands at bottom of loop
+
+        if operand == 't':
+            # type list
+            types = ', '.join('{BRIGHT}{CYAN}{}{RESET_ALL}'.format(t.getname(options.typelist_aliases), **colors) for t in instr.type_list)
+            op = '[{}]'.format(types)
+        elif operand == 's':
+            # string data
+            if resource_key is None:
+                op = instr.format_string(instr.string, options=options)
+            elif options.explicit_inline_resource:
+                op = '{BRIGHT}{CYAN}%{{{RESET_ALL}{}{BRIGHT}{CYAN}}}{RESET_ALL}'.format(resource_key, **colors)
+            else:
+                op = '{BRIGHT}{CYAN}%{RESET_ALL}{}'.format(resource_key, **colors)
+        elif operand == 'f':
+            # flags
+            flags = instr.flags
+            keywords:list = []
+            keywords.append(flags.scope.getname(options.scope_aliases))
+            keywords.append(flags.type.getname(options.vartype_aliases))
+            if flags.dimension or options.explicit_dim0:  #NOTE: dim0 is legal, just not required or recommended
+                keywords.append(flags.dimension.getname(options.explicit_dim0))
+            if flags.invert:
+                keywords.append(flags.invert.getname(options.invert_aliases))
+            if flags.modifier:
+                keywords.append(flags.modifier.getname(options.modifier_aliases))
+
+            # push joined flag keywords as one operand, since technically it is only one
+            op = '{BRIGHT}{CYAN}{}{RESET_ALL}'.format(' '.join(keywords), **colors)
+        elif operand == 'h':
+            # hash value
+            if instr.is_syscall:
+                hash_color = '{BRIGHT}{YELLOW}'.format(**colors)
+            elif instr.is_call:
+                hash_color = '{BRIGHT}{BLUE}'.format(**colors)
+            else: #elif instr.is_load or instr.is_store:
+                hash_color = '{BRIGHT}{RED}'.format(**colors)
+            if known_hash_name and options.inline_hash and (options.syscall_inline_hash or not instr.is_syscall):
+                known_hash_name2 = known_hash_name
+                if instr.is_syscall:
+                    known_hash_name2 = known_hash_name.lstrip('$') # requirement for syscall hash lookup syntax
+                if options.needs_explicit_hash(known_hash_name2):
+                    op = '{BRIGHT}{CYAN}${{{RESET_ALL}{}{}{RESET_ALL}{BRIGHT}{CYAN}}}{RESET_ALL}'.format(hash_color, known_hash_name2, **colors)
+                else:
+                    op = '{BRIGHT}{CYAN}${RESET_ALL}{}{}{RESET_ALL}'.format(hash_color, known_hash_name2, **colors)
+            else:
+                op = '${:08x}{RESET_ALL}'.format(instr.hash, **colors)
+        elif operand == 'o':
+            # variable offset
+            #NEW: exclude -1 offsets for non-local variables, because that operand
+            #     isn't used. still output erroneous var offsets (aka anything other than -1)
+            if options.explicit_varoffset or instr.var_offset != -1 or instr.flags.scope is MjoScope.LOCAL:
+                op = '{:d}'.format(instr.var_offset)
+        elif operand == '0':
+            # 4 byte address placeholder
+            pass
+        elif operand == 'i':
+            # integer constant
+            # integer literals will sometimes use hashes for usercall function pointers
+            # this entire if statement tree is terrifying...
+            if known_hash_name is not None:
+                if known_hash_is_syscall:
+                    hash_color = '{BRIGHT}{YELLOW}'.format(**colors)
+                elif known_hash_name[0] == '$':
+                    hash_color = '{BRIGHT}{BLUE}'.format(**colors)
+                else: #elif instr.is_load or instr.is_store:
+                    hash_color = '{BRIGHT}{RED}'.format(**colors)
+
+                if options.inline_hash and options.int_inline_hash and (options.syscall_inline_hash or not known_hash_is_syscall):
+                    known_hash_name2 = known_hash_name
+                    if known_hash_is_syscall:
+                        known_hash_name2 = known_hash_name.lstrip('$') # requirement for syscall hash lookup syntax
+                    if options.needs_explicit_hash(known_hash_name2):
+                        op = '{BRIGHT}{CYAN}${{{RESET_ALL}{}{}{RESET_ALL}{BRIGHT}{CYAN}}}{RESET_ALL}'.format(hash_color, known_hash_name2, **colors)
+                    else:
+                        op = '{BRIGHT}{CYAN}${RESET_ALL}{}{}{RESET_ALL}'.format(hash_color, known_hash_name2, **colors)
+                else:
+                    # print as hex for simplicity (this can also be printed with $XXXXXXXX notation)
+                    op = '0x{:08x}'.format(unsigned_I(instr.int_value))
+            else:
+                op = '{:d}'.format(signed_i(instr.int_value))
+        elif operand == 'r':
+            # float constant
+            if instr.float_value == float('inf'):
+                op = '+Inf'
+            elif instr.float_value == float('-inf'):
+                op = '-Inf'
+            elif math.isnan(instr.float_value):
+                op = 'NaN'
+            else:
+                op = '{:g}'.format(instr.float_value)  # fixed or exponential
+                try:
+                    int(op, 10)  # test if no decimal or exponent
+                    op += '.0'  # append '.0' for all floats that parse to integers
+                except:
+                    pass  # fine just the way it is
+        elif operand == 'a':
+            # argument count
+            op = '({:d})'.format(instr.argument_count)
+        elif operand == 'j':
+            # jump offset
+            if instr.jump_target is not None:
+                op = '{BRIGHT}{MAGENTA}@{}{RESET_ALL}'.format(instr.jump_target.name, **colors)
+            else:
+                op = '{BRIGHT}{MAGENTA}@~{:+04x}{RESET_ALL}'.format(instr.jump_offset, **colors)
+        elif operand == 'l':
+            # line number
+            op = '{BRIGHT}{BLACK}#{:d}{RESET_ALL}'.format(instr.line_number, **colors)
+        elif operand == 'c':
+            # switch case table
+            if instr.switch_targets: # is not None:
+                op = ', '.join('{BRIGHT}{MAGENTA}@{}{RESET_ALL}'.format(t.name, **colors) for t in instr.switch_targets) # pylint: disable=not-an-iterable
+            else:
+                op = ', '.join(', '.join('{BRIGHT}{MAGENTA}@~{:+04x}{RESET_ALL}'.format(o, **colors) for o in instr.switch_cases))
+        else:
+            raise Exception('Unrecognized encoding specifier: {!r}'.format(operand))
+        
+        # append operand (if defined)
+        if op is not None:
+            operands.append(op)
+    
+    if operands: # append space-separated operands
+        sb += ' '.join(operands)
+
+    if known_hash_name is None or not options.annotations:
+        pass  # no hash name comments
+    elif instr.is_syscall: # 0x834, 0x835
+        if not options.inline_hash or not options.syscall_inline_hash:
+            # sb = sb.ljust(ops_offset + 16 + len(colors["BRIGHT"]) + len(colors["YELLOW"]) + len(colors["RESET_ALL"]))
+            sb += '  {BRIGHT}{BLACK}; {DIM}{YELLOW}{}{RESET_ALL}'.format(known_hash_name, **colors)
+        elif options.annotate_hex:
+            sb += '  {BRIGHT}{BLACK}; {DIM}{YELLOW}${:08x}{RESET_ALL}'.format(instr.hash, **colors)
+    elif instr.is_call: # 0x80f, 0x810
+        if not options.inline_hash:
+            # sb = sb.ljust(ops_offset + 16 + len(colors["BRIGHT"]) + len(colors["BLUE"]) + len(colors["RESET_ALL"]))
+            sb += '  {BRIGHT}{BLACK}; {DIM}{BLUE}{}{RESET_ALL}'.format(known_hash_name, **colors)
+        elif options.annotate_hex:
+            sb += '  {BRIGHT}{BLACK}; {DIM}{BLUE}${:08x}{RESET_ALL}'.format(instr.hash, **colors)
+    elif instr.is_load or instr.is_store:
+        if not options.inline_hash:
+            sb += '  {BRIGHT}{BLACK}; {DIM}{RED}{}{RESET_ALL}'.format(known_hash_name, **colors)
+        elif options.annotate_hex:
+            sb += '  {BRIGHT}{BLACK}; {DIM}{RED}${:08x}{RESET_ALL}'.format(instr.hash, **colors)
+    elif instr.opcode.mnemonic == "ldc.i": # 0x800
+        # check for loading function hashes (which are often passed to )
+        if known_hash_is_syscall:
+            hash_color = '{DIM}{YELLOW}'.format(**colors)
+        elif known_hash_name[0] == '$':
+            hash_color = '{DIM}{BLUE}'.format(**colors)
+        else: #elif instr.is_load or instr.is_store:
+            hash_color = '{DIM}{RED}'.format(**colors)
+
+        ## testing reversal of the conditional branching behemoth below:
+        # def test(a,b,c,d): return (not a or not b or (c and not d)) == (a and b and (not c or d))
+        # [tuple(o) for o in combos if test(*o)]
+        if not options.inline_hash or not options.int_inline_hash or (known_hash_is_syscall and not options.syscall_inline_hash):
+            #sb = sb.ljust(ops_offset + 16)
+            sb += '  {BRIGHT}{BLACK}; {RESET_ALL}{}{}{RESET_ALL}'.format(hash_color, known_hash_name, **colors)
+        elif options.annotate_hex:
+            sb += '  {BRIGHT}{BLACK}; {RESET_ALL}{}${:08x}{RESET_ALL}'.format(hash_color, unsigned_I(instr.int_value), **colors)
+    return sb
+
+FLAG_GROUPS:tuple = (('-H', HASH_FLAGNAMES), ('-A', ALIAS_FLAGNAMES), ('-F', FORMAT_FLAGNAMES))
+DIRECTIVE_CHOICES:tuple = ((), ('-G', 'GLOBAL'), ('-r', '*.csv'), ('-G', 'GLOBAL', '-r', '*.csv'))
+
+
+def random_options(rng:random.Random) -> tuple:
+    """Return (name, options) with every flag randomly toggled, and random group/resfile directives and color
+    """
+    color = rng.random() < 0.5
+    options = default_options(color)
+    args = []
+    for prefix,flagnames in FLAG_GROUPS:
+        flags = ''
+        for f,name in flagnames.items():
+            if rng.random() < 0.5:
+                setattr(options, name, not getattr(options, name))
+                flags += f if getattr(options, name) else f.upper()
+        if flags:
+            args.extend((prefix, flags))
+    directives = rng.choice(DIRECTIVE_CHOICES)
+    for i in range(0, len(directives), 2):
+        if directives[i] == '-G':
+            options.group_directive = directives[i+1]
+        else:
+            options.resfile_directive = directives[i+1]
+    args.extend(directives)
+    return (' '.join(args or ['default']) + (' (color)' if color else ''), options)
+
+def option_matrix(combos:int=0, seed:int=0):
+    """Yield (name, options) for the defaults and every single flag toggled, with and without color,
+    followed by random flag combinations
+    """
+    for color in (False, True):
+        suffix = ' (color)' if color else ''
+        yield ('default' + suffix, default_options(color))
+        for prefix,flagnames in FLAG_GROUPS:
+            for f,name in flagnames.items():
+                options = default_options(color)
+                setattr(options, name, not getattr(options, name))
+                flag = f if getattr(options, name) else f.upper()
+                yield ('{} {} ({}={})'.format(prefix, flag, name, 'on' if getattr(options, name) else 'off') + suffix, options)
+        options = default_options(color)
+        options.resfile_directive = '*.csv'
+        options.group_directive = 'GLOBAL'
+        yield ('-r *.csv -G GLOBAL' + suffix, options)
+    rng = random.Random(seed)
+    for _ in range(combos):
+        yield random_options(rng)
+
+def run(scripts:list, options:ILFormat, repeat:int) -> tuple:
+    items = []
+    for script in scripts:
+        keys = script.get_resource_keys(options=options)
+        items.extend((instr, keys.get(instr.offset, None)) for instr in script.instructions)
+
+    for instr,reskey in items:
+        expected = format_instruction_uncompiled(instr, options=options, resource_key=reskey)
+        actual = instr.format_instruction(options=options, resource_key=reskey)
+        if expected != actual:
+            raise Exception('Compiled format mismatch at 0x{:05x}:\n  {!r}\n  {!r}'.format(instr.offset, expected, actual))
+
+    def timeit(method) -> float:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for instr,reskey in items:
+                method(instr, options=options, resource_key=reskey)
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    return (len(items), timeit(format_instruction_uncompiled), timeit(Instruction.format_instruction))
+
+def main(argv:list=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('inputs', metavar='MJO', nargs='*', default=[DEFAULT_INPUT])
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    parser.add_argument('--combos', metavar='N', type=int, default=32, help='random flag combinations to check (default: 32)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of flag combinations (default: 0)')
+    args = parser.parse_args(argv)
+
+    scripts = load_scripts(args.inputs)
+    matrix = list(option_matrix(args.combos, args.seed))
+    width = max(len(name) for name,_ in matrix)
+    print('{:<{}} {:>8} {:>12} {:>12} {:>8}'.format('options', width, 'instrs', 'reference', 'compiled', 'speedup'))
+    for name,options in matrix:
+        count, reference, compiled = run(scripts, options, args.repeat)
+        print('{:<{}} {:>8d} {:>10.1f}ms {:>10.1f}ms {:>7.2f}x'.format(name, width, count, reference * 1000, compiled * 1000, reference / compiled))
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""Round-trip throughput and fidelity benchmark (synthetic .mjo -> .mjil -> .mjo)
+
+usage: python benchmarks/bench_roundtrip.py [-p PROFILE ...] [-c COUNT] [-n REPEAT] [--save] [--tolerance FRAC]
+
+every phase is timed separately (best of REPEAT, over all scripts of a profile):
+  crypt     decrypt the bytecode
+  decode    disassemble the decrypted .mjo into instructions
+  cfg       build the control flow graph (all functions analyzed)
+  format    format the IL lines (-G GLOBAL)
+  tokenize  tokenize every IL line
+  assemble  assemble the IL text
+  encrypt   write the encrypted .mjo from the assembled bytecode
+the re-encrypted output must be byte-identical to the generated script.
+
+--save records the timings as the baseline (benchmarks/baselines/roundtrip.json),
+later runs exit with status 1 when a phase is slower than baseline * (1 + tolerance),
+or when any script fails to round-trip.
+"""
+
+import argparse, io, json, os, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mjotool import crypt
+from mjotool.script import MjoScript
+from mjotool.analysis import ControlFlowGraph
+from mjotool.assembler import MjILAssembler, TokenType
+from mjotool.writer import iter_script_lines
+from mjotool.commands import default_options
+from synth import PROFILES, generate_script, profile_params
+
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baselines', 'roundtrip.json')
+BASELINE_VERSION = 1
+
+PHASES = ('crypt', 'decode', 'cfg', 'format', 'tokenize', 'assemble', 'encrypt')
+
+
+## PHASES ##
+
+def header_size(data:bytes) -> int:
+    function_count = int.from_bytes(data[24:28], 'little')
+    return 16 + 4 * 3 + 8 * function_count + 4
+
+def phase_crypt(data:bytes) -> bytes:
+    size = header_size(data)
+    return MjoScript.SIGNATURE_DECRYPTED + data[16:size] + crypt.crypt32(data[size:])
+
+def phase_decode(decrypted:bytes) -> MjoScript:
+    return MjoScript.disassemble_script(io.BytesIO(decrypted))
+
+def phase_cfg(script:MjoScript) -> ControlFlowGraph:
+    return ControlFlowGraph.build_from_script(script, lazy=False)
+
+def phase_format(script:MjoScript, cfg:ControlFlowGraph) -> str:
+    options = default_options(False)
+    options.group_directive = 'GLOBAL'
+    options.set_address_len(script.bytecode_size)
+    return '\n'.join(iter_script_lines('synth.mjo', script, cfg, options=options)) + '\n'
+
+def phase_tokenize(text:str) -> int:
+    assembler = MjILAssembler(io.StringIO(text))
+    assembler.open()
+    tokens = 0
+    while assembler.next_line():
+        while assembler.next_token().type is not TokenType.EOL:
+            tokens += 1
+    assembler.close()
+    return tokens
+
+def phase_assemble(text:str) -> MjILAssembler:
+    assembler = MjILAssembler(io.StringIO(text))
+    assembler.read()
+    return assembler
+
+def phase_encrypt(assembler:MjILAssembler) -> bytes:
+    script = assembler.script
+    script.signature = MjoScript.SIGNATURE_ENCRYPTED
+    ms = io.BytesIO()
+    script.assemble_script(ms, assembler.bytecode)
+    return ms.getvalue()
+
+def round_trip(data:bytes) -> dict:
+    """Run all phases once, returns {phase: result}
+    """
+    results = {}
+    results['crypt'] = decrypted = phase_crypt(data)
+    results['decode'] = script = phase_decode(decrypted)
+    results['cfg'] = cfg = phase_cfg(script)
+    results['format'] = text = phase_format(script, cfg)
+    results['tokenize'] = phase_tokenize(text)
+    results['assemble'] = assembler = phase_assemble(text)
+    results['encrypt'] = phase_encrypt(assembler)
+    return results
+
+def phase_inputs(results:dict) -> dict:
+    """Return the input of each phase, from a previous round trip's results
+    """
+    return {
+        'crypt':    (results['data'],),
+        'decode':   (results['crypt'],),
+        'cfg':      (results['decode'],),
+        'format':   (results['decode'], results['cfg']),
+        'tokenize': (results['format'],),
+        'assemble': (results['format'],),
+        'encrypt':  (results['assemble'],),
+    }
+
+PHASE_METHODS = {
+    'crypt': phase_crypt, 'decode': phase_decode, 'cfg': phase_cfg, 'format': phase_format,
+    'tokenize': phase_tokenize, 'assemble': phase_assemble, 'encrypt': phase_encrypt,
+}
+
+def first_difference(a:bytes, b:bytes) -> int:
+    for i in range(min(len(a), len(b))):
+        if a[i] != b[i]:
+            return i
+    return min(len(a), len(b))
+
+
+## SUITE ##
+
+def run_profile(profile:str, count:int, repeat:int) -> dict:
+    """Generate and round-trip count scripts, returns the profile's result record
+    """
+    scripts = [generate_script(profile_params(profile, i)) for i in range(count)]
+    inputs = []
+    failures = []
+    for i,data in enumerate(scripts):
+        results = round_trip(data)
+        results['data'] = data
+        if results['encrypt'] != data:
+            failures.append('script {:d}: output differs at byte 0x{:x} ({:d} -> {:d} bytes)'.format(i, first_difference(data, results['encrypt']), len(data), len(results['encrypt'])))
+        inputs.append(phase_inputs(results))
+
+    phases = {}
+    for phase in PHASES:
+        method = PHASE_METHODS[phase]
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for args in inputs:
+                method(*args[phase])
+            best = min(best, time.perf_counter() - start)
+        phases[phase] = best
+    return {
+        'params':   PROFILES[profile].as_dict(),
+        'scripts':  count,
+        'bytes':    sum(len(d) for d in scripts),
+        'phases':   phases,
+        'failures': failures,
+    }
+
+def load_baseline(filename:str) -> dict:
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename, 'rt', encoding='utf-8') as f:
+        data = json.load(f)
+    return data.get('profiles', {}) if data.get('version', None) == BASELINE_VERSION else {}
+
+def save_baseline(filename:str, profiles:dict):
+    existing = load_baseline(filename)
+    for name,record in profiles.items():
+        existing[name] = {k: v for k,v in record.items() if k != 'failures'}
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    with open(filename, 'wt', encoding='utf-8') as f:
+        json.dump({'version': BASELINE_VERSION, 'profiles': existing}, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+def compare(record:dict, baseline:dict, tolerance:float) -> list:
+    """Return the regressed phases of a profile record as (phase, seconds, baseline seconds)
+    """
+    if not baseline or baseline['params'] != record['params'] or baseline['scripts'] != record['scripts']:
+        return []  # not comparable
+    return [(phase, record['phases'][phase], baseline['phases'][phase]) for phase in PHASES
+            if phase in baseline['phases'] and record['phases'][phase] > baseline['phases'][phase] * (1 + tolerance)]
+
+def main(argv:list=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-p', '--profile', dest='profiles', action='append', choices=sorted(PROFILES),
+        help='synthetic script profile (default: small, default, strings, switch)')
+    parser.add_argument('-c', '--count', type=int, default=3, help='scripts per profile')
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    parser.add_argument('-b', '--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save', action='store_true', help='record this run as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown over the baseline (fraction)')
+    args = parser.parse_args(argv)
+
+    baseline = load_baseline(args.baseline)
+    profiles = {}
+    status = 0
+    print('{:<10} {:<9} {:>10} {:>10} {:>10}  {}'.format('profile', 'phase', 'time', 'MB/s', 'baseline', ''))
+    for profile in (args.profiles or ['small', 'default', 'strings', 'switch']):
+        record = profiles[profile] = run_profile(profile, args.count, args.repeat)
+        regressed = {phase: base for phase,_,base in compare(record, baseline.get(profile, None), args.tolerance)}
+        base_phases = baseline.get(profile, {}).get('phases', {})
+        for phase in PHASES:
+            seconds = record['phases'][phase]
+            base = base_phases.get(phase, None)
+            print('{:<10} {:<9} {:>8.1f}ms {:>10.2f} {:>10}  {}'.format(profile, phase, seconds * 1000, record['bytes'] / seconds / 1e6,
+                  '{:.1f}ms'.format(base * 1000) if base is not None else '-', 'REGRESSION' if phase in regressed else ''))
+        for failure in record['failures']:
+            print('{:<10} FIDELITY FAILURE {}'.format(profile, failure))
+        if regressed or record['failures']:
+            status = 1
+    if args.save:
+        save_baseline(args.baseline, profiles)
+        print('baseline saved:', args.baseline)
+    return status
+
+
+if __name__ == '__main__':
+    exit(main())
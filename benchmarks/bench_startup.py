@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""CLI startup time benchmark (python -m mjotool, best of REPEAT, with -X importtime breakdown)
+
+usage: python benchmarks/bench_startup.py [-n REPEAT] [-t TARGET_MS] [--top N] [-- ARGS ...]
+
+ARGS are passed to mjotool (default: --help), time includes interpreter startup,
+`python -c pass` is timed the same way for reference. exits with status 1 when
+the best time is over the target (default 50ms).
+"""
+
+import argparse, os, subprocess, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'src')
+
+
+def run(args:list, env:dict) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *args], cwd=SRC, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+def best_time(args:list, env:dict, repeat:int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(args, env)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def import_times(args:list, env:dict) -> list:
+    """Return [(cumulative us, self us, module)] from -X importtime
+    """
+    times = []
+    for line in run(['-X', 'importtime', *args], env).stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        times.append((int(cumulative_us), int(self_us), module.rstrip()))
+    return times
+
+def main(argv:list=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('args', metavar='ARGS', nargs=argparse.REMAINDER)
+    parser.add_argument('-n', '--repeat', type=int, default=10)
+    parser.add_argument('-t', '--target', type=float, default=50.0, help='target time in milliseconds')
+    parser.add_argument('--top', type=int, default=15, help='number of slowest imports shown')
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ, PYTHONPATH=SRC)
+    tool_args = ['-m', 'mjotool', *([a for a in args.args if a != '--'] or ['--help'])]
+    for module_args in (['-c', 'pass'], tool_args):
+        run(module_args, env)  # warm up (compile .pyc files)
+    baseline = best_time(['-c', 'pass'], env, args.repeat)
+    elapsed = best_time(tool_args, env, args.repeat)
+
+    print('{:>10} {:>10}  {}'.format('cumulative', 'self', 'import'))
+    for cumulative,self_us,module in sorted(import_times(tool_args, env), reverse=True)[:args.top]:
+        print('{:>8.1f}ms {:>8.1f}ms  {}'.format(cumulative / 1000, self_us / 1000, module))
+    print()
+    print('python -c pass {:>8.1f}ms'.format(baseline * 1000))
+    print('python {} {:>8.1f}ms  (target {:.1f}ms){}'.format(' '.join(tool_args[1:]), elapsed * 1000, args.target,
+          '  OVER TARGET' if elapsed * 1000 > args.target else ''))
+    return 1 if elapsed * 1000 > args.target else 0
+
+
+if __name__ == '__main__':
+    exit(main())
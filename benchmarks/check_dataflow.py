@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""Stack dataflow regression check (known-good scripts must analyze without issues)
+
+usage: python benchmarks/check_dataflow.py [MJIL|MJO ...]
+
+exits with status 1 when any stack issue is reported (default input: data/mjs/console.mjil).
+"""
+
+import argparse, os, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from mjotool.script import MjoScript
+from mjotool.assembler import MjILAssembler
+from mjotool.dataflow import StackAnalyzer
+
+DEFAULT_INPUT = os.path.join(ROOT, 'data', 'mjs', 'console.mjil')
+
+
+def load_script(filename:str) -> MjoScript:
+    if filename.lower().endswith('.mjil'):
+        assembler = MjILAssembler(filename)
+        assembler.read()
+        return assembler.script
+    with open(filename, 'rb') as f:
+        return MjoScript.disassemble_script(f)
+
+def main(argv:list=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('inputs', metavar='MJIL', nargs='*', default=[DEFAULT_INPUT])
+    args = parser.parse_args(argv)
+
+    analyzer = StackAnalyzer()
+    total = 0
+    for filename in args.inputs:
+        issues = [issue for result in analyzer.analyze_script(load_script(filename)) for issue in result.issues]
+        for issue in issues:
+            print('{}: {:05x}: {}: {}'.format(os.path.basename(filename), issue.offset, issue.kind, issue.message))
+        print('{}: {} issues'.format(os.path.basename(filename), len(issues)))
+        total += len(issues)
+    return 1 if total else 0
+
+
+if __name__ == '__main__':
+    exit(main())
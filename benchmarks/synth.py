@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""Synthetic .mjo script generator for benchmarks (random but valid bytecode from Opcode.LIST encodings)
+
+usage: python benchmarks/synth.py OUTDIR [-p PROFILE] [-c COUNT] [--seed SEED]
+
+scripts are deterministic for the same parameters and seed, every function is
+argcheck/alloca, then random statements, then `ldc.i 0; ret`. Jumps and switch
+cases only target statement starts later in the same function, so control flow
+analysis and disassembly work the same as on real scripts.
+"""
+
+import argparse, io, os, random, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from mjotool.opcodes import Opcode
+from mjotool.flags import MjoType, MjoScope, MjoInvert, MjoModifier, MjoDimension, MjoFlags
+from mjotool.script import Instruction, FunctionEntry, MjoScript
+
+
+## PARAMETERS ##
+
+class SynthParams:
+    """Size, opcode mix, string density, and switch size of generated scripts
+    """
+    def __init__(self, **kwargs):
+        self.functions:int = 40  # functions per script
+        self.statements:int = 60  # statements per function
+        self.strings:float = 0.2  # fraction of statements that are text/ldstr strings
+        self.switch_cases:int = 8  # cases per switch statement
+        # relative weights of the other statement kinds
+        self.mix:dict = {'expr': 6, 'store': 4, 'call': 3, 'branch': 2, 'switch': 1, 'line': 3}
+        self.seed:int = 1
+        for name,value in kwargs.items():
+            if not hasattr(self, name):
+                raise Exception(f'Unknown synthetic script parameter {name!r}')
+            setattr(self, name, value)
+
+    def as_dict(self) -> dict:
+        return dict(self.__dict__)
+
+# named parameter sets for the benchmark suite
+PROFILES:dict = {
+    'small':   SynthParams(functions=10, statements=40),
+    'default': SynthParams(),
+    'strings': SynthParams(strings=0.7),
+    'switch':  SynthParams(switch_cases=256, mix={'expr': 6, 'store': 4, 'call': 3, 'branch': 2, 'switch': 3, 'line': 3}),
+    'large':   SynthParams(functions=200, statements=120),
+}
+
+
+## GENERATOR ##
+
+# text pieces for string operands (cp932 encodable, including characters that need escaping)
+_WORDS:tuple = ('hello', 'world', 'Majiro', 'こんにちは', '世界', '「はい」', '……', 'ＡＢＣ', '"quoted"', 'back\\slash', 'tab\there', 'new\nline', '%s', '{0}')
+_CTRLS:tuple = ('p', 'n', 'w', 'r', 'v')
+# concrete variable scopes and types (no internal/unknown values)
+_SCOPES:tuple = (MjoScope.PERSISTENT, MjoScope.SAVEFILE, MjoScope.THREAD, MjoScope.LOCAL)
+_TYPES:tuple = (MjoType.INT, MjoType.FLOAT, MjoType.STRING, MjoType.INT_ARRAY, MjoType.FLOAT_ARRAY, MjoType.STRING_ARRAY)
+
+def _opcodes(encoding:str, exclude:tuple=()) -> list:
+    return [o for o in Opcode.LIST if o.encoding == encoding and o.mnemonic not in exclude]
+
+class ScriptGenerator:
+    """Generates random scripts with one random.Random, see SynthParams for the shape
+    """
+    def __init__(self, params:SynthParams):
+        self.params:SynthParams = params
+        self.rng:random.Random = random.Random(params.seed)
+        self.line:int = 0
+        self.operators:list = _opcodes('', ('ret',))
+        self.variables:list = _opcodes('fho')
+        self.jumps:list = _opcodes('j')
+        self.calls:list = _opcodes('h0a')
+        self.syscalls:list = _opcodes('ha')
+        kinds = sorted(params.mix)
+        self.kinds:list = kinds
+        self.weights:list = [params.mix[k] for k in kinds]
+
+    def instr(self, mnemonic:str, **operands) -> Instruction:
+        instr = Instruction(Opcode.fromname(mnemonic), 0)
+        for name,value in operands.items():
+            setattr(instr, name, value)
+        return instr
+
+    def flags(self, opcode:Opcode) -> MjoFlags:
+        rng = self.rng
+        dimensions = list(MjoDimension)
+        if opcode.mnemonic.startswith(('ldelem', 'stelem')):
+            dimensions.remove(MjoDimension.NONE)  # required by the assembler
+        return MjoFlags.fromflags(rng.choice(_SCOPES),
+                                  rng.choice(_TYPES),
+                                  rng.choice(dimensions),
+                                  rng.choice(list(MjoModifier)),
+                                  rng.choice(list(MjoInvert)))
+
+    def variable(self, opcode:Opcode) -> Instruction:
+        instr = Instruction(opcode, 0)
+        instr.flags = self.flags(opcode)
+        instr.hash = self.rng.getrandbits(32)
+        instr.var_offset = self.rng.randrange(16) if instr.flags.scope is MjoScope.LOCAL else -1
+        return instr
+
+    def constant(self) -> Instruction:
+        rng = self.rng
+        if rng.random() < 0.7:
+            return self.instr('ldc.i', int_value=rng.randint(-100000, 100000))
+        return self.instr('ldc.r', float_value=rng.randint(-8000, 8000) / 8)  # exact as float32
+
+    def string(self) -> str:
+        return ''.join(self.rng.choice(_WORDS) for _ in range(self.rng.randint(1, 4)))
+
+    def statement(self, index:int, count:int) -> list:
+        """Return the instructions of one statement, jump targets are stored as statement indices for resolving later
+        """
+        rng = self.rng
+        if rng.random() < self.params.strings:
+            if rng.random() < 0.6:
+                return [self.instr('text', string=self.string()), self.instr('ctrl', string=rng.choice(_CTRLS))]
+            return [self.instr('ldstr', string=self.string()), self.instr('pop')]
+        kind = rng.choices(self.kinds, self.weights)[0]
+        if kind == 'line':
+            self.line += 1
+            return [self.instr('line', line_number=self.line)]
+        if kind == 'expr':
+            return [self.constant(), self.constant(), Instruction(rng.choice(self.operators), 0)]
+        if kind == 'store':
+            return [self.constant(), self.variable(rng.choice(self.variables))]
+        if kind == 'call':
+            args = rng.randrange(4)
+            opcode = rng.choice(self.calls + self.syscalls)
+            call = Instruction(opcode, 0)
+            call.hash = rng.getrandbits(32)
+            call.argument_count = args
+            return [self.constant() for _ in range(args)] + [call]
+        if kind == 'branch':
+            jump = Instruction(rng.choice(self.jumps), 0)
+            jump.jump_offset = rng.randint(index + 1, count)  # target statement, resolved later
+            return [self.constant(), jump]
+        if kind == 'switch':
+            switch = self.instr('switch')
+            switch.switch_cases = [rng.randint(index + 1, count) for _ in range(self.params.switch_cases)]
+            return [self.constant(), switch]
+        raise Exception(f'Unknown synthetic statement kind {kind!r}')
+
+    def function(self, offset:int) -> list:
+        rng = self.rng
+        count = self.params.statements
+        types = [rng.choice(_TYPES) for _ in range(rng.randrange(4))]
+        statements = [[self.instr('argcheck', type_list=types), self.instr('alloca', type_list=types + [MjoType.INT] * rng.randrange(3))]]
+        statements.extend(self.statement(i + 1, count + 1) for i in range(count))
+        statements.append([self.instr('ldc.i', int_value=0), self.instr('ret')])
+        # assign offsets, then resolve statement index targets
+        starts = []
+        for statement in statements:
+            starts.append(offset)
+            for instr in statement:
+                instr.offset = offset
+                instr.size = len(instr.encode())
+                offset += instr.size
+        for statement in statements:
+            for instr in statement:
+                if instr.is_jump:
+                    instr.jump_offset = starts[instr.jump_offset] - (instr.offset + instr.size)
+                elif instr.is_switch:
+                    instr.switch_cases = [starts[t] - (instr.offset + 2 + 2 + (i + 1) * 4) for i,t in enumerate(instr.switch_cases)]
+        return [instr for statement in statements for instr in statement]
+
+    def script(self) -> MjoScript:
+        instructions = []
+        functions = []
+        offset = 0
+        for _ in range(self.params.functions):
+            functions.append(FunctionEntry(self.rng.getrandbits(32), offset))
+            body = self.function(offset)
+            instructions.extend(body)
+            offset = body[-1].offset + body[-1].size
+        main_offset = functions[self.rng.randrange(len(functions))].offset
+        return MjoScript(MjoScript.SIGNATURE_ENCRYPTED, main_offset, self.line, None, offset, functions, instructions)
+
+def generate_script(params:SynthParams) -> bytes:
+    """Return the bytes of an encrypted .mjo script generated from the parameters
+    """
+    script = ScriptGenerator(params).script()
+    script.bytecode_offset = 16 + 4 * 3 + 8 * len(script.functions) + 4
+    ms = io.BytesIO()
+    script.assemble_script(ms)
+    return ms.getvalue()
+
+def profile_params(profile:str, index:int=0, seed:int=None) -> SynthParams:
+    """Return the parameters of a named profile for the index-th script (different seed per script)
+    """
+    base = PROFILES[profile].as_dict()
+    base['seed'] = (base['seed'] if seed is None else seed) * 1000 + index
+    return SynthParams(**base)
+
+
+def main(argv:list=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('outdir', metavar='OUTDIR')
+    parser.add_argument('-p', '--profile', choices=sorted(PROFILES), default='default')
+    parser.add_argument('-c', '--count', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.outdir, exist_ok=True)
+    for i in range(args.count):
+        data = generate_script(profile_params(args.profile, i, args.seed))
+        path = os.path.join(args.outdir, f'synth_{args.profile}_{i:03d}.mjo')
+        with open(path, 'wb') as f:
+            f.write(data)
+        print(path, len(data))
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
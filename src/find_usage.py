@@ -17,6 +17,9 @@ Style = SimpleNamespace(RESET_ALL='\x1b[0m', BRIGHT='\x1b[1m', DIM='\x1b[2m', NO
 
 F, S, S2 = Fore, Style, Style
 
+# hash index occurrence kinds searched for targets
+SYSCALL_KINDS:set = {'syscall'}
+
 # def iter_mjolist(filename:str, commentlvl:int=0, verbose:bool=False) -> Iterator[Tuple[int,str,int]]:
 def iter_mjolist(filename:str, commentlvl:int=0) -> Iterator[Tuple[int,str,int]]:
     """
@@ -64,7 +67,7 @@ def normpath(filepath:str) -> str:
 def normjoin(*args:str) -> str:
     return normpath(os.path.join(*args))
 
-def read_list(lstfile:str, dispname:str, targets:set, instr_range:tuple, loglvl:int, recurse:bool):
+def read_list(lstfile:str, dispname:str, targets:set, instr_range:tuple, loglvl:int, recurse:bool, index:'HashIndex', walk_options:dict=None):
     lstfile = normpath(lstfile)
     # print(f'{S.BRIGHT}{F.YELLOW}List file:{S.RESET_ALL} {S.BRIGHT}{F.MAGENTA}{dispname}{S.RESET_ALL}')
     print(f'{S.RESET_ALL}{S.BRIGHT}{F.MAGENTA}{dispname}/{S.RESET_ALL}')
@@ -72,9 +75,9 @@ def read_list(lstfile:str, dispname:str, targets:set, instr_range:tuple, loglvl:
         if lvl == 0:
             infile = normjoin(os.path.dirname(lstfile), inname)
             if os.path.isdir(infile):
-                read_dir(infile, normjoin(dispname, os.path.basename(infile)), targets, instr_range, loglvl, recurse, is_base=True)
+                read_dir(infile, normjoin(dispname, os.path.basename(infile)), targets, instr_range, loglvl, recurse, index, walk_options)
             else: #if infile.lower().endswith('.mjo'):
-                read_script(infile, normjoin(dispname, os.path.basename(infile)), targets, instr_range, loglvl)
+                read_script(infile, normjoin(dispname, os.path.basename(infile)), targets, instr_range, loglvl, index)
         elif lvl == 1:
             pass
         elif lvl == 2:
@@ -92,89 +95,92 @@ def read_list(lstfile:str, dispname:str, targets:set, instr_range:tuple, loglvl:
         # elif lvl == 3:
         #     print(f'{text}')
 
-def read_dir(dirname:str, dispname:str, targets:set, instr_range:tuple, loglvl:int, recurse:bool, *, is_base:bool=True):
+def read_dir(dirname:str, dispname:str, targets:set, instr_range:tuple, loglvl:int, recurse:bool, index:'HashIndex', walk_options:dict=None):
+    from mjotool.walk import walk_files
     dirname = normpath(dirname)
     # print(f'{S.BRIGHT}{F.YELLOW}Directory:{S.RESET_ALL} {S.DIM}{F.CYAN}{dispname}/{S.RESET_ALL}')
-    if is_base:
-        print(f'{S.RESET_ALL}{S.DIM}{F.CYAN}{dispname}/{S.RESET_ALL}')
-    for inname in os.listdir(dirname):
-        infile = normjoin(dirname, inname)
-        if os.path.isdir(infile):
-            if recurse:
-                read_dir(infile, normjoin(dispname, os.path.basename(infile)), targets, instr_range, loglvl, recurse, is_base=False)
-        elif infile.lower().endswith('.mjo'):
-            read_script(infile, normjoin(dispname, os.path.basename(infile)), targets, instr_range, loglvl)
-        else:
-            pass  # skip, file not of interest
+    print(f'{S.RESET_ALL}{S.DIM}{F.CYAN}{dispname}/{S.RESET_ALL}')
+    for entry in walk_files(dirname, ('.mjo',), recurse=recurse, **(walk_options or {})):
+        read_script(normpath(entry.path), normjoin(dispname, entry.relpath), targets, instr_range, loglvl, index)
+
 
 
+_OPTIONS:'ILFormat' = None
 
-def read_script(mjofile:str, dispname:str, targets:set, instr_range:tuple, loglvl:int):
+def script_options() -> 'ILFormat':
+    """Return the format options shared by all scripts (shares known hash resolver cache)
+    """
+    global _OPTIONS
+    if _OPTIONS is None:
+        from mjotool.script import ILFormat
+        options = ILFormat()
+        options.color = True
+        options.inline_hash = True
+        options.int_inline_hash = True
+        options.syscall_inline_hash = True
+        options.annotate_hex = False
+        options.modifier_aliases = True
+        options.typelist_aliases = True
+        options.vartype_aliases = True
+        options.functype_aliases = True
+        options.scope_aliases = True
+        options.implicit_local_groups = True
+        options.braces = False
+        _OPTIONS = options
+    return _OPTIONS
+
+def read_script(mjofile:str, dispname:str, targets:set, instr_range:tuple, loglvl:int, index:'HashIndex'):
     mjofile = normpath(mjofile)
-    from mjotool.script import MjoScript, ILFormat, Function, FunctionEntry
+    from mjotool.script import MjoScript, Function
+    from mjotool.analysis import ControlFlowGraph
     from mjotool import known_hashes
-    options = ILFormat()
-    with open(mjofile, 'rb') as file:
-        script = MjoScript.disassemble_script(file)
+    # only files with indexed target occurrences are decoded (reusing the script decoded by a stale index record)
+    script = index.refresh(mjofile)
+    hits = index.occurrences_in(mjofile, targets, SYSCALL_KINDS)
+    if not hits:
+        return
+    options = script_options()
+    if script is None:
+        with open(mjofile, 'rb') as file:
+            script = MjoScript.disassemble_script(file)
+    # lazy analysis: only functions containing a target are analyzed
+    cfg = ControlFlowGraph.build_from_script(script)
     options.set_address_len(script.bytecode_size)
-    options.color = True
-    options.inline_hash = True
-    options.int_inline_hash = True
-    options.syscall_inline_hash = True
-    options.annotate_hex = False
-    options.modifier_aliases = True
-    options.typelist_aliases = True
-    options.vartype_aliases = True
-    options.functype_aliases = True
-    options.scope_aliases = True
-    options.implicit_local_groups = True
-    options.braces = False
 
+    options.group_directive = None
     for fn in script.functions:
         if fn.offset == script.main_offset:
             options.group_directive = known_hashes.GROUPS.get(fn.name_hash)
             break
     
     instructions = script.instructions
-    functions = script.functions
+    index_lookup = ControlFlowGraph.instruction_index_lookup(script)
     first:bool = True
-    fn_idx:int = -1
-    fn_cur:FunctionEntry = functions[0]
-    fn_next:FunctionEntry = None
     
     function:Function = None
     end_print_idx = -1000
-    for i,instr in enumerate(instructions):
-        if instr.is_syscall and instr.hash in targets:
-            is_first = first
-            if first:
-                first = False
-                # print(f'{S.BRIGHT}{F.YELLOW}{mjofile}:{S.RESET_ALL}')
-                print(f'{S.BRIGHT}{F.YELLOW}{dispname}:{S.RESET_ALL}')
-            if fn_cur is None or (fn_next is not None and instr.offset >= fn_next.offset):
-                fn_cur = fn_next
-                fn_idx += 1
-                fn_next = functions[fn_idx] if (fn_idx < len(functions)) else None
-                #
-                function = Function(script, fn_cur.offset)
-                func_instr_idx = script.instruction_index_from_offset(fn_cur.offset)
-                for j in range(func_instr_idx, min(len(instructions), func_instr_idx + 4)):
-                    if instructions[j].opcode.mnemonic == 'argcheck':
-                        function.parameter_types = instructions[j].type_list
-                        break
-                
-                fn_name = known_hashes.FUNCTIONS.get(fn_cur.name_hash, f'${fn_cur.name_hash:08x}')
-                if function.parameter_types is None:
-                    raise Exception(f'Could not find parameter type list of function {fn_name}')
-                # if fn_name
-                # print(f'{S.BRIGHT}{F.BLUE}{mjofile}')
-                function.print_function(options=options)
-            idx_range = (max(0, i - instr_range[0], end_print_idx), min(len(instructions), i + instr_range[1] + 1))
-            end_print_idx = idx_range[1]
-            if (idx_range[0] > end_print_idx) and not is_first:
-                print(f'{S.BRIGHT}{F.BLACK}// ...{S.RESET_ALL}')
-            for k in range(*idx_range):
-                instructions[k].print_instruction(options=options)
+    for hit in hits:
+        i = index_lookup[hit.offset]
+        is_first = first
+        if first:
+            first = False
+            # print(f'{S.BRIGHT}{F.YELLOW}{mjofile}:{S.RESET_ALL}')
+            print(f'{S.BRIGHT}{F.YELLOW}{dispname}:{S.RESET_ALL}')
+        if function is None or function.name_hash != hit.function:
+            function = cfg.function_from_offset(hit.offset)
+            
+            fn_name = options.resolver.resolve(function.name_hash, 'call').name or f'${function.name_hash:08x}'
+            if function.parameter_types is None:
+                raise Exception(f'Could not find parameter type list of function {fn_name}')
+            # if fn_name
+            # print(f'{S.BRIGHT}{F.BLUE}{mjofile}')
+            function.print_function(options=options)
+        idx_range = (max(0, i - instr_range[0], end_print_idx), min(len(instructions), i + instr_range[1] + 1))
+        end_print_idx = idx_range[1]
+        if (idx_range[0] > end_print_idx) and not is_first:
+            print(f'{S.BRIGHT}{F.BLACK}// ...{S.RESET_ALL}')
+        for k in range(*idx_range):
+            instructions[k].print_instruction(options=options)
     if not first:
         print()
 
@@ -189,6 +195,10 @@ def main(argv:list=None) -> int:
     parser.add_argument('-r','--recurse', dest='recurse', action='store_true', default=False)
     parser.add_argument('-t','--targets', metavar='HASH',  type=lambda v: int(v, 16), nargs='+', required=True)
     parser.add_argument('-R','--range', metavar=('BACK','FWD'), type=int, nargs=2, default=(4,1))
+    parser.add_argument('-I','--include', metavar='GLOB', action='append', default=None, help='only search directory files matching glob (repeatable)')
+    parser.add_argument('-X','--exclude', metavar='GLOB', action='append', default=None, help='skip directory files and subdirectories matching glob (repeatable)')
+    parser.add_argument('--symlinks', metavar='POLICY', choices=('skip', 'files', 'follow'), default='files', help='symbolic links in directories: skip, files (default), follow')
+    parser.add_argument('-i','--index', metavar='INDEX', default=None, help='hash occurrence index file (created/updated as needed)')
     # parser.add_argument('-v','--verbose', dest='verbose', action='store_true', default=False)
     # parser.add_argument('-q','--quiet', dest='verbose', action='store_false')
 
@@ -202,16 +212,20 @@ def main(argv:list=None) -> int:
     recurse = args.recurse
     instr_range = tuple(args.range)
     targets = set(args.targets)
+    walk_options = dict(include=args.include, exclude=args.exclude, symlinks=args.symlinks)
+
+    from mjotool.xref import HashIndex
+    index = HashIndex.load(args.index) if args.index is not None else HashIndex()
 
     for inname in args.inputs:
         infile = normpath(inname)
         if os.path.isdir(infile):
-            read_dir(infile, os.path.basename(infile), targets, instr_range, loglvl, recurse, is_base=True)
+            read_dir(infile, os.path.basename(infile), targets, instr_range, loglvl, recurse, index, walk_options)
         elif os.path.isfile(infile):
             if infile.lower().endswith('.mjo'):
-                read_script(infile, os.path.basename(infile), targets, instr_range, loglvl)
+                read_script(infile, os.path.basename(infile), targets, instr_range, loglvl, index)
             else:
-                read_list(infile, os.path.basename(infile), targets, instr_range, loglvl, recurse)
+                read_list(infile, os.path.basename(infile), targets, instr_range, loglvl, recurse, index, walk_options)
         else:
             raise Exception('Input file {infile!r} not found!')
         # for num,text,lvl in iter_mjolist(infile, args.loglvl):#, args.verbose):
@@ -226,6 +240,9 @@ def main(argv:list=None) -> int:
 
         # list(iter_mjolist(infile, args.loglvl, args.verbose))
 
+    if args.index is not None:
+        index.save(args.index)
+
     return 0
 
 
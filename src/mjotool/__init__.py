@@ -12,13 +12,35 @@ Converted to Python library by Robert Jordan - 2021
 
 #######################################################################################
 
-from .opcodes import Opcode
-from .script import Instruction, MjoScript
-from .analysis import ControlFlowGraph
-
-from . import crypt
-from . import flags
-from . import opcodes
-from . import script
-from . import analysis
+## LAZY IMPORTS ##
+#
+# submodules and their exports are only imported on first attribute access (PEP 562),
+#  so `python -m mjotool` and `import mjotool.crypt` don't import the whole library.
+
+import importlib
+
+# exported name -> submodule
+_LAZY_EXPORTS:dict = {
+    'Opcode':           'opcodes',
+    'Instruction':      'script',
+    'MjoScript':        'script',
+    'ControlFlowGraph': 'analysis',
+}
+_LAZY_MODULES:tuple = ('crypt', 'flags', 'opcodes', 'script', 'analysis')
+
+__all__ = list(_LAZY_EXPORTS) + list(_LAZY_MODULES)
+
+def __getattr__(name:str):
+    module = _LAZY_EXPORTS.get(name, None)
+    if module is not None:
+        value = getattr(importlib.import_module('.' + module, __name__), name)
+    elif name in _LAZY_MODULES:
+        value = importlib.import_module('.' + name, __name__)
+    else:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    globals()[name] = value  # only resolved once
+    return value
+
+def __dir__() -> list:
+    return sorted(set(globals()) | set(__all__))
 
@@ -12,126 +12,39 @@ Converted to Python library by Robert Jordan - 2021
 
 #######################################################################################
 
-import copy, csv, os
-from ._util import DummyColors, Colors
-from .script import MjoScript, ILFormat
-from .analysis import ControlFlowGraph
-from .assembler import MjILAssembler
-from . import known_hashes
+## STARTUP ##
+#
+# only the argument parser is defined here, so `--help` and argument errors don't import the library,
+#  commands (and everything they need) are imported from .commands after the arguments are parsed.
+#  names of .commands are still available from this module for existing imports (PEP 562).
+#
+# measure with: python -X importtime -m mjotool --help
 
+import argparse, re, sys
+from importlib.util import find_spec
+from .walk import SYMLINK_POLICIES
 
-## READ / ANALYZE SCRIPT ##
 
-def read_script(filename:str) -> MjoScript:
-    """Read and return a MjoScript from file
-    """
-    with open(filename, 'rb') as f:
-        return MjoScript.disassemble_script(f)
-
-def analyze_script(script:MjoScript) -> ControlFlowGraph:
-    """Return the analysis of a script's control flow, blocks, functions, etc.
-
-    argument can also be a filename
-    """
-    if isinstance(script, str):  # is argument filename?
-        script = read_script(script)
-    return ControlFlowGraph.build_from_script(script)
-
-def parse_script(filename:str) -> MjILAssembler:
-    """Returns an assembler after parsing an .mjil assembler language file
-    """
-    return MjILAssembler(filename)
+## ARGUMENT TYPES ##
 
-## PRINT SCRIPT ##
+SIZE_UNITS:dict = {'': 1, 'b': 1, 'k': 1024, 'kb': 1024, 'kib': 1024, 'm': 1024**2, 'mb': 1024**2, 'mib': 1024**2, 'g': 1024**3, 'gb': 1024**3, 'gib': 1024**3}
 
-def print_script(filename:str, script:MjoScript, *, options:ILFormat=ILFormat.DEFAULT):
-    """Print analyzed script IL instructions and blocks to console (PRINTS A LOT OF LINE)
+def parse_size(value:str) -> int:
+    """Parse a size in bytes with an optional K/M/G suffix (binary units), i.e. '512M'
     """
-    cfg:ControlFlowGraph = analyze_script(script)
-    options.set_address_len(script.bytecode_size)
-    colors = options.colors
+    m = re.match(r'^\s*(\d+(?:\.\d*)?)\s*([A-Za-z]*)\s*$', value)
+    if m is None or m[2].lower() not in SIZE_UNITS:
+        raise argparse.ArgumentTypeError(f'invalid size {value!r}')
+    return int(float(m[1]) * SIZE_UNITS[m[2].lower()])
 
-    # include extra indentation formatting for an easier time reading
-    print('{BRIGHT}{WHITE}/// {}{RESET_ALL}'.format(os.path.basename(filename), **colors))
-    script.print_readmark(options=options)
-    # print()
 
-    for function in cfg.functions:
-        print()
-        function.print_function(options=options)
-        for i,basic_block in enumerate(function.basic_blocks):
-            print(' ', end='')
-            basic_block.print_basic_block(options=options)
-            for instruction in basic_block.instructions:
-                reskey = script.get_resource_key(instruction, options=options)
-                print('  ', end='')
-                instruction.print_instruction(options=options, resource_key=reskey)
-            if i + 1 < len(function.basic_blocks):
-                print(' ')
-        function.print_function_close(options=options)
-        # print()
+## ARGUMENT PARSER ##
 
+def build_parser(argv:list=None):
+    """Return the argparse.ArgumentParser of the command line tool
 
-## WRITE SCRIPT ##
-
-def disassemble_script(filename:str, script:MjoScript, outfilename:str, *, options:ILFormat=ILFormat.DEFAULT):
-    """Write analyzed script IL instructions and blocks to .mjil file
-    """
-    options.color = False
-    options.set_address_len(script.bytecode_size)
-    cfg:ControlFlowGraph = analyze_script(script)
-
-    resfile = reswriter = None
-    with open(outfilename, 'wt+', encoding='utf-8') as writer:
-      try:
-        if options.resfile_directive is not None:
-            #respath = os.path.join(os.path.dirname(filename), options.resfile_directive)
-            res_f = open(options._resfile_path or options.resfile_directive, 'wt+', encoding='utf-8')
-            # sigh, no way to force quotes for one line
-            # lineterminator='\n' is required to stop double-line termination caused by default behavior of "\r\n" on Windows
-            reswriter = csv.writer(res_f, quoting=csv.QUOTE_MINIMAL, delimiter=',', quotechar='"', lineterminator='\n')
-            reswriter.writerow(['Key','Value'])
-        # include extra indentation formatting for language grammar VSCode extension
-        writer.write('/// {}\n'.format(os.path.basename(filename)))
-        writer.write(script.format_readmark(options=options) + '\n')
-        # writer.write('\n')
-
-        for function in cfg.functions:
-            writer.write('\n')
-            writer.write(function.format_function(options=options) + '\n')
-            for i,basic_block in enumerate(function.basic_blocks):
-                writer.write(' ' + basic_block.format_basic_block(options=options) + '\n')
-                for instruction in basic_block.instructions:
-                    reskey = script.get_resource_key(instruction, options=options) if reswriter is not None else None
-                    if reskey is not None:
-                        reswriter.writerow([reskey, instruction.string])
-                    writer.write('  ' + instruction.format_instruction(options=options, resource_key=reskey) + '\n')
-                if i + 1 < len(function.basic_blocks):
-                    writer.write(' \n')
-            writer.write(function.format_function_close(options=options) + '\n')
-            # writer.write('\n')
-        writer.flush()
-        if resfile is not None:
-            resfile.flush()
-      finally:
-        if resfile is not None:
-            reswriter = None
-            #reswriter.close()
-            resfile.close()
-
-def assemble_script(script:MjoScript, outfilename:str):
-    """Write script to .mjo file
+    the research module (-R) is only imported when requested, so its custom arguments require -R to be passed.
     """
-    with open(outfilename, 'wb+') as writer:
-        script.signature = MjoScript.SIGNATURE_DECRYPTED
-        script.assemble_script(writer)
-
-
-## MAIN FUNCTION ##
-
-def main(argv:list=None) -> int:
-    import argparse
-
     parser = argparse.ArgumentParser(prog='python -m mjotool',
         description='Majiro script IL disassembler and assembler tool',
         add_help=True,
@@ -184,7 +97,13 @@ on|off [-F|--format] formatting options
     parser.add_argument('-d','--disasm', metavar=('MJO','MJIL'), nargs='+', action=NArgs1or2AppendAction,
         help='disassemble mjo script file/directory to output file/directory')
     parser.add_argument('-a','--asm', metavar=('MJIL','MJO'), nargs='+', action=NArgs1or2AppendAction,
-        help='assemble mjil script file/directory to output file/directory')
+        help='assemble mjil script file/directory (\'-\' for stdin) to output file/directory')
+    parser.add_argument('-b','--binary', metavar=('IN','OUT'), nargs=2, action='append',
+        help='convert mjo/mjil script file to binary IL (.mjb), or .mjb to mjo/mjil')
+    parser.add_argument('--jsonl', metavar=('MJO','JSONL'), nargs=2, action='append',
+        help='export one JSON record per instruction of mjo script file/directory to file (\'-\' for stdout)')
+    parser.add_argument('-x','--xref', metavar=('MJODIR','XREF'), nargs=2, action='append',
+        help='update cross-reference index file for mjo directory (incremental),\nprints callers/callees of --function filters')
 
     parser.add_argument('-r', '--resfile', metavar='MJRESFILE', dest='resfile', action='store', default=None,
         required=False, help='output resfile directive option (\'*\' expands to mjil name, no ext)')
@@ -200,281 +119,64 @@ on|off [-F|--format] formatting options
         required=False, help='formatting disassembler options')
     parser.add_argument('-C', '--no-color', dest='color', action='store_false', default=True,
         required=False, help='disable color printing')
-
-    HASH_FLAGNAMES:dict = {
-        'a': 'annotations',
-        'k': 'known_hashes',
-        'i': 'inline_hash',
-        'e': 'explicit_inline_hash',
-        's': 'syscall_inline_hash',
-        'l': 'int_inline_hash',
-        'h': 'annotate_hex',
-        'g': 'implicit_local_groups',
-    }
-    ALIAS_FLAGNAMES:dict = {
-        'v': 'explicit_varoffset',
-        'm': 'modifier_aliases',
-        's': 'scope_aliases',
-        't': 'vartype_aliases',
-        'l': 'typelist_aliases',
-        'f': 'functype_aliases',
-        'd': 'explicit_dim0',
-    }
-    FORMAT_FLAGNAMES:dict = {
-        'a': 'address_labels',
-        'r': 'explicit_inline_resource',
-    }
-
-    HASH_FLAGNAME_LEN:int = max(len(n) for n in HASH_FLAGNAMES.values())
-    ALIAS_FLAGNAME_LEN:int = max(len(n) for n in ALIAS_FLAGNAMES.values())
-    FORMAT_FLAGNAME_LEN:int = max(len(n) for n in FORMAT_FLAGNAMES.values())
-    FLAGNAME_LEN:int = max(HASH_FLAGNAME_LEN, ALIAS_FLAGNAME_LEN, FORMAT_FLAGNAME_LEN)
-    
-    try:  # try adding research module
-        from ._research import _init_parser, _init_args, do_research
+    parser.add_argument('-f', '--function', metavar='HASH|NAME', dest='functions', action='append', default=None,
+        required=False, help='only print/disassemble functions matching $hash or name (repeatable)')
+    parser.add_argument('--no-cache', dest='cache', action='store_false', default=True,
+        required=False, help='disable the decoded script analysis cache and assembled function cache')
+    parser.add_argument('--cache-dir', metavar='DIR', dest='cache_dir', action='store', default=None,
+        required=False, help='analysis and function cache directory (default: ~/.cache/mjotool)')
+    parser.add_argument('--recursive', dest='recursive', action='store_true', default=False,
+        required=False, help='include subdirectories of directory inputs (outputs mirror the input tree)')
+    parser.add_argument('--include', metavar='GLOB', dest='include', action='append', default=None,
+        required=False, help='only process directory files matching glob (relative path or name, repeatable)')
+    parser.add_argument('--exclude', metavar='GLOB', dest='exclude', action='append', default=None,
+        required=False, help='skip directory files and subdirectories matching glob (relative path or name, repeatable)')
+    parser.add_argument('--symlinks', metavar='POLICY', dest='symlinks', choices=SYMLINK_POLICIES, default='files',
+        required=False, help='symbolic links in directory inputs: skip, files (default), follow')
+    parser.add_argument('--force', dest='force', action='store_true', default=False,
+        required=False, help='rebuild all directory --disasm/--asm files, ignoring the build manifest')
+    parser.add_argument('-j', '--jobs', metavar='N', dest='jobs', type=int, action='store', default=1,
+        required=False, help='number of processes for directory print/disasm/asm (0 = cpu count)')
+    parser.add_argument('--stats', metavar='FORMAT', dest='stats', nargs='?', choices=('text', 'json'), const='text', default=None,
+        required=False, help='report per-file phase times and counters of print/disasm/asm: text (default), json')
+    parser.add_argument('--stats-file', metavar='PATH', dest='stats_file', action='store', default=None,
+        required=False, help='write the --stats report to a file instead of the console')
+    parser.add_argument('--profile', metavar='DIR', dest='profile_dir', action='store', default=None,
+        required=False, help='write cProfile output per phase to DIR/PHASE.PID.prof (implies --stats)')
+    parser.add_argument('--memprofile', dest='memprofile', action='store_true', default=False,
+        required=False, help='trace memory per file with tracemalloc: peak, top allocation sites, peak RSS (implies --stats)')
+    parser.add_argument('--mem-budget', metavar='SIZE', dest='mem_budget', type=parse_size, default=None,
+        required=False, help='fail files whose memory growth exceeds SIZE, i.e. 256M (implies --memprofile)')
+
+    if find_spec('._research', __package__) is not None:  # try adding research module
         parser.add_argument('-R', '--research', action='store_true', default=False,
         required=False, help='run custom research functions that are not intended for use')
-        _init_parser(parser)  # add any custom arguments needed for research
-    except ImportError:
-        pass  # no _research.py, no problem
-
-    args = parser.parse_args(argv)
-
-    # print(args)
-    # return 0
-
-    options:ILFormat = ILFormat()
-
-    ###########################################################################
-
-    options.color  = args.color  # color, disabled by __main__.disassemble_script() when outputting to file
-    options.braces = True  # function braces
-    options.annotations  = True  # annotations that describe either known hash names, or original hashed values
-    options.known_hashes = True  # check for known hash values
-    options.inline_hash  = True  # inline hash function $name / ${name} for known hash values
-    options.syscall_inline_hash  = True
-    options.int_inline_hash      = True   # ldc.i with a known hash value will use inline hash
-    options.explicit_inline_hash = False  # always use ${name} over $name
-    options.annotate_hex         = True  # hex annotations when inline hash is used
-    options.implicit_local_groups= True  # always exclude empty group name from known local names
+        if argv is None:
+            argv = sys.argv[1:]
+        if '-R' in argv or '--research' in argv:
+            from ._research import _init_parser
+            _init_parser(parser)  # add any custom arguments needed for research
+    return parser
 
-    options.explicit_varoffset   = False  # exclude -1 offset for non-locals
-    options.modifier_aliases     = False  # inc.x, dec.x, x.inc...
-    options.invert_aliases       = False  # (there are no aliases)
-    options.scope_aliases        = False  # persist, save (shorthands)
-    options.vartype_aliases      = False  # i, r, s, iarr... for variable type flags
-    options.functype_aliases     = False  # i, r, s, iarr... for function signatures
-    options.typelist_aliases     = False  # i, r, s, iarr... for type list operands
-    options.explicit_dim0        = False  # a useless feature (but it's legal)
 
-    options.address_labels       = True   # print bytecode address offset labels before opcodes
-    options.opcode_padding       = 13     # number of absolute padding added from start of opcode (always adds one space after)
-    
-    options.explicit_inline_resource = True  # always use %{name} over %name
-    options.resfile_directive    = None   # output all `text` opcode string operands to csv resource file
-    options.group_directive      = None   # removes @GROUP for that matching this setting (DO NOT INCLUDE "@" in NAME)
-    # options.group_directive      = "CONSOLE"
-    ###########################################################################
-    
-    colors = Colors if args.color else DummyColors
-
-    if args.group is not None:
-        if '@' in args.group:
-            raise argparse.ArgumentError('--group', f'"@" character cannot be present in name : {args.group!r}')
-        if args.group == 'GROUP':  # special warning just for me :)
-            print('{DIM}{YELLOW}[WARNING]{RESET_ALL} {BRIGHT}{RED}specified group name {DIM}{GREEN}{!r}{BRIGHT}{RED}, did you mean {DIM}{GREEN}{!r}{BRIGHT}{RED}?{RESET_ALL}'.format(args.group, 'GLOBAL', **colors))
-        options.group_directive = args.group
-        print('{DIM}{CYAN}group name:{RESET_ALL}'.format(**colors), '{DIM}{GREEN}{!r}{RESET_ALL}'.format(args.group, **colors))
-
-    if args.resfile is not None:
-        if not args.resfile:
-            raise argparse.ArgumentError('--resfile', f'resfile name is empty : {args.resfile!r}')
-        options.resfile_directive = args.resfile
-        resfile_fmt = repr(args.resfile).replace('*', '{BRIGHT}{CYAN}*{DIM}{GREEN}'.format(**colors))
-        print('{DIM}{CYAN}rsrc  file:{RESET_ALL}'.format(**colors), '{DIM}{GREEN}{}{RESET_ALL}'.format(resfile_fmt, **colors))
-
-    if args.opcode_pad is not None:
-        if args.opcode_pad < 0:
-            raise argparse.ArgumentError('--opcode-pad', f'padding less than zero : {args.opcode_pad!r}')
-        options.opcode_padding = args.opcode_pad
-        print('{DIM}{CYAN}opcode pad:{RESET_ALL}'.format(**colors), '{BRIGHT}{WHITE}{!r}{RESET_ALL}'.format(args.opcode_pad, **colors))
-    
-    CONSUMED_HASH_FLAGS:set = set()
-    CONSUMED_ALIAS_FLAGS:set = set()
-    CONSUMED_FORMAT_FLAGS:set = set()
-
-    # visual names for flag on/off modes
-    ONOFF:dict = {
-        False: '{BRIGHT}{RED}off{RESET_ALL}'.format(**colors),
-        True:  '{BRIGHT}{GREEN}on{RESET_ALL}'.format(**colors),
-    }
-
-    for f in args.hash_flags:
-        if f.lower() not in HASH_FLAGNAMES:
-            raise argparse.ArgumentError('--hash', f'unknown flag {f!r}')
-        if f.lower() in CONSUMED_HASH_FLAGS:
-            raise argparse.ArgumentError('--hash', f'flag {f!r} already used')
-        CONSUMED_HASH_FLAGS.add(f.lower())
-        opt_name = HASH_FLAGNAMES[f.lower()]
-        opt_on = f == f.lower()
-        setattr(options, opt_name, opt_on)  # lower=True
-        print('{BRIGHT}{YELLOW}hash   opt:{RESET_ALL}'.format(**colors), opt_name.ljust(FLAGNAME_LEN), '=', ONOFF[opt_on])
-
-    for f in args.alias_flags:
-        if f.lower() not in ALIAS_FLAGNAMES:
-            raise argparse.ArgumentError('--alias', f'unknown flag {f!r}')
-        if f.lower() in CONSUMED_ALIAS_FLAGS:
-            raise argparse.ArgumentError('--alias', f'flag {f!r} already used')
-        CONSUMED_ALIAS_FLAGS.add(f.lower())
-        opt_name = ALIAS_FLAGNAMES[f.lower()]
-        opt_on = f == f.lower()
-        setattr(options, opt_name, opt_on)  # lower=True
-        print('{BRIGHT}{BLUE}alias  opt:{RESET_ALL}'.format(**colors), opt_name.ljust(FLAGNAME_LEN), '=', ONOFF[opt_on])
-
-    for f in args.format_flags:
-        if f.lower() not in FORMAT_FLAGNAMES:
-            raise argparse.ArgumentError('--format', f'unknown flag {f!r}')
-        if f.lower() in CONSUMED_FORMAT_FLAGS:
-            raise argparse.ArgumentError('--format', f'flag {f!r} already used')
-        CONSUMED_FORMAT_FLAGS.add(f.lower())
-        opt_name = FORMAT_FLAGNAMES[f.lower()]
-        opt_on = f == f.lower()
-        setattr(options, opt_name, opt_on)  # lower=True
-        print('{BRIGHT}{MAGENTA}format opt:{RESET_ALL}'.format(**colors), opt_name.ljust(FLAGNAME_LEN), '=', ONOFF[opt_on])
-
-
-    research:bool = getattr(args, 'research', False)
-    if research:
-        _init_args(args)  # research one-time setup
-
-    base_options = options
-
-    def prepare_options(base_options, filename:str=None, *, color:bool=...):
-        new_options = copy.copy(base_options)
-        if color is not Ellipsis:
-            new_options.color = color
-        if new_options.resfile_directive and filename is not None:
-            new_options.resfile_directive = new_options.resfile_directive.replace('*', os.path.splitext(os.path.basename(filename))[0])
-            new_options._resfile_path = os.path.join(os.path.dirname(filename), new_options.resfile_directive)
-        return new_options
-
-
-    # [--print]  loop through input files/directories
-    for infile in (args.print or []):
-        options = prepare_options(base_options, infile)
-        if not research:
-            print('Printing:', infile)
-        if os.path.isdir(infile):  # directory of .mjo files
-            for name in os.listdir(infile):
-                path = os.path.join(infile, name)
-                if not os.path.isfile(path) or not os.path.splitext(path)[1].lower() == '.mjo':
-                    continue
-                
-                if research:
-                    do_research(args, path, options=options)
-                else:
-                    script = read_script(path)
-                    print_script(path, script, options=options)
-        else:  # single file
-            if research:
-                do_research(args, infile, options=options)
-            else:
-                script = read_script(infile)
-                print_script(infile, script, options=options)
-        if not research:
-            print()
-
-    # [--disasm]  loop through input files/directories
-    for infile,outfile in (args.disasm or []):
-        if not research:
-            print('Disassembling:', infile)
-        if os.path.isdir(infile):  # directory of .mjo files
-            if outfile is None:
-                outfile = infile
-            elif os.path.isfile(outfile):
-                raise Exception('Cannot use output "{!s}" because it is not a directory'.format(outfile))
-            elif not os.path.exists(outfile):
-                raise Exception('Output directory "{!s}" does not exist'.format(outfile))
-
-            last_name = ''
-            for name in os.listdir(infile):
-                options = prepare_options(base_options, name)
-
-                path = os.path.join(infile, name)
-                if not os.path.isfile(path) or not os.path.splitext(path)[1].lower() == '.mjo':
-                    continue
-                print('Disassembling:', name.ljust(len(last_name)*2), end='\r')  #HACK: *2 to handle double-width CJK
-                last_name = name
-
-                outpath = os.path.join(outfile, os.path.splitext(name)[0] + '.mjil')
-                script = read_script(path)
-                disassemble_script(path, script, outpath, options=options)
-            print('Done'.ljust(len(f'Disassembling: ') + len(last_name)*2))  #HACK: *2 to handle double-width CJK
-        else:  # single file
-            options = prepare_options(base_options, outfile)
-
-            outpath = outfile
-            if outfile is None:
-                if os.path.splitext(infile)[1].lower() == '.mjil':  # avoid overwriting input file by accident
-                    raise Exception(f'--disasm file {infile!r} has \'.mjil\' extension, with no output file passed')
-                outpath = os.path.splitext(infile)[0] + '.mjil'
-            elif os.path.isdir(outfile):  # write to outfile/infilename.mjil
-                name = os.path.basename(infile)
-                outpath = os.path.join(outfile, os.path.splitext(name)[0] + '.mjil')
-            script = read_script(infile)
-            disassemble_script(infile, script, outpath, options=options)
-        if not research:
-            print()
-
-    # [--asm]  loop through input files/directories
-    for infile,outfile in (args.asm or []):
-        if not research:
-            print('Assembling:', infile)
-        if os.path.isdir(infile):  # directory of .mjil files
-            if outfile is None:
-                outfile = infile
-            elif os.path.isfile(outfile):
-                raise Exception('Cannot use output "{!s}" because it is not a directory'.format(outfile))
-            elif not os.path.exists(outfile):
-                raise Exception('Output directory "{!s}" does not exist'.format(outfile))
-
-            last_name = ''
-            for name in os.listdir(infile):
-                options = prepare_options(base_options, name)
+## MAIN FUNCTION ##
 
-                path = os.path.join(infile, name)
-                if not os.path.isfile(path) or not os.path.splitext(path)[1].lower() == '.mjil':
-                    continue
-                print('Assembling:', name.ljust(len(last_name)*2), end='\r')  #HACK: *2 to handle double-width CJK
-                last_name = name
-                
-                outpath = os.path.join(outfile, os.path.splitext(name)[0] + '.mjo')
-                assembler = parse_script(path)
-                assembler.read()
-                assemble_script(assembler.script, outpath)
-            print('Done'.ljust(len('Assembling: ') + len(last_name)*2))  #HACK: *2 to handle double-width CJK
-        else:  # single file
-            options = prepare_options(base_options, infile)
+def main(argv:list=None) -> int:
+    args = build_parser(argv).parse_args(argv)
 
-            outpath = outfile
-            if outfile is None:
-                if os.path.splitext(infile)[1].lower() == '.mjo':  # avoid overwriting input file by accident
-                    raise Exception(f'--asm file {infile!r} has \'.mjo\' extension, with no output file passed')
-                outpath = os.path.splitext(infile)[0] + '.mjo'
-            elif os.path.isdir(outfile):  # write to outfile/infilename.mjil
-                name = os.path.basename(infile)
-                outpath = os.path.join(outfile, os.path.splitext(name)[0] + '.mjo')
-            assembler = parse_script(infile)
-            assembler.read()
-            assemble_script(assembler.script, outpath)
-        if not research:
-            print()
+    from .commands import run
+    return run(args)
 
-    return 0
+def __getattr__(name:str):
+    # names of .commands (read_script, default_options, ...) for `from mjotool.__main__ import ...`
+    from . import commands
+    try:
+        return getattr(commands, name)
+    except AttributeError:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}') from None
 
 
 ## MAIN CONDITION ##
 
 if __name__ == '__main__':
     exit(main())
-
@@ -13,6 +13,7 @@ __all__ = ['StructIO', 'Colors', 'DummyColors', 'hd_span', 'print_hexdump']
 
 import io, re, struct
 from collections import namedtuple
+from functools import lru_cache
 from struct import calcsize, pack, unpack
 from types import SimpleNamespace
 from typing import Any, List, Match, NoReturn, Union
@@ -195,6 +196,37 @@ def doublequote(string:str, is_repr:bool=False) -> str:
     string = re.sub(r'''(?<!\\)((?:\\\\)*)(?:("))''', r'\1\\\2', string)
     return f'"{string}"'
 
+class _EscapeTable(dict):
+    """str.translate table from ordinal to double-quoted literal escape, filled in on first use
+    """
+    __slots__ = ('highlight',)
+    def __init__(self, highlight:str=None):
+        super().__init__()
+        self.highlight:str = highlight
+    def __missing__(self, ordinal:int) -> str:
+        c = chr(ordinal)
+        if   c == '\'': escape = c
+        elif c == '\"': escape = '\\"'
+        else:           escape = repr(c)[1:-1]  # same escapes as repr(string)
+        if self.highlight is not None and escape[0] == '\\' and len(escape) > 1:
+            escape = self.highlight
+        self[ordinal] = escape
+        return escape
+
+_ESCAPE_TABLES:dict = {}
+
+@lru_cache(maxsize=4096)
+def escape_literal(string:str, highlight:str=None) -> str:
+    r"""Single-pass equivalent of doublequote(string)[1:-1], cached for repeated literals
+
+    when highlight is not None, every escape sequence is replaced by it
+    (matching re.sub(<escape pattern>, highlight, doublequote(string)[1:-1]) for a replacement without group references).
+    """
+    table = _ESCAPE_TABLES.get(highlight, None)
+    if table is None:
+        table = _ESCAPE_TABLES[highlight] = _EscapeTable(highlight)
+    return string.translate(table)
+
 def sub_escapes(repl:str, string:str, useless_escapes:bool=False, count:int=0) -> str:
     r"""Regex substitution for all (Python) string escapes
     \0 matches the full esacpe
@@ -233,6 +265,8 @@ def unescape(string:str, useless_escapes:bool=False) -> str:
 
     useless_escapes will match any character pattern \.
     """
+    if '\\' not in string: # fast path: no escapes
+        return string
     # \xXX, \uXXXX, \UXXXXXXXX, \ooo{1,3}, \\, \', \", \a, \b, \f, \n, \r, \t, \v
     # match no '\', ( hex with prefix char | octal | literal | invalid )
     PATTERN = r'''\\((x[0-9A-Fa-f]{2}|u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8})|([0-7]{1,3})|([\\\'\"abfnrtv])|(.|$))'''
@@ -10,50 +10,135 @@ __credits__ = '''Original C# implementation by AtomCrafty - 2021
 Converted to Python library by Robert Jordan - 2021
 '''
 
-__all__ = ['ControlFlowGraph']
+__all__ = ['ControlFlowGraph', 'FunctionFlow', 'NaturalLoop']
 
 #######################################################################################
 
-from typing import Iterator, List, NoReturn, Set  # for hinting in declarations
+from collections import OrderedDict
+from typing import Dict, Iterator, List, NoReturn, Optional, Set  # for hinting in declarations
 
 from ._util import DummyColors, Colors
+from .flags import MjoType
 from .script import Instruction, MjoScript, BasicBlock, Function
+from . import stats
 
 
 class ControlFlowGraph:
-    def __init__(self, functions:List[Function]):
+    def __init__(self, functions:List[Function], script:MjoScript=None):
         self.functions:List[Function] = functions
+        self.script:MjoScript = script
+        self._hash_lookup:Dict[int, Function] = None    # built on first use of function_by_hash
+        self._offset_lookup:Dict[int, Function] = None  # built on first use of function_by_offset
+        self._revision:int = script.revision if script is not None else 0
+        self._flow_cache:Dict[Function, 'FunctionFlow'] = {}
+
+    @property
+    def is_stale(self) -> bool:
+        """True if the script has been modified since this graph was built
+        """
+        return self.script is not None and self.script.revision != self._revision
+
+    def refresh(self) -> bool:
+        """Rebuild functions (lazily) if the script has been modified, returns True if rebuilt
+        """
+        if not self.is_stale:
+            return False
+        cfg = self.build_from_script(self.script, lazy=True)
+        self.functions = cfg.functions
+        self._hash_lookup = self._offset_lookup = None
+        self._revision = self.script.revision
+        self._flow_cache.clear()
+        return True
+
+    def flow(self, function:Function) -> 'FunctionFlow':
+        """Return cached dominator, post-dominator, loop, and ordering analysis for a function
+
+        analysis is computed once per function, and recomputed if the script has been modified
+        """
+        if self.refresh():
+            function = self.function_by_hash(function.name_hash)
+        flow = self._flow_cache.get(function, None)
+        if flow is None:
+            flow = self._flow_cache[function] = FunctionFlow(function)
+        return flow
+
+    def function_by_hash(self, name_hash:int) -> Optional[Function]:
+        """Return the function with the given name hash, or None
+        """
+        if self._hash_lookup is None:
+            self._hash_lookup = dict((fn.name_hash, fn) for fn in self.functions)
+        return self._hash_lookup.get(name_hash, None)
+
+    def function_by_offset(self, offset:int) -> Optional[Function]:
+        """Return the function starting at the given bytecode offset, or None
+        """
+        if self._offset_lookup is None:
+            self._offset_lookup = dict((fn.start_offset, fn) for fn in self.functions)
+        return self._offset_lookup.get(offset, None)
+
+    def function_from_offset(self, offset:int) -> Optional[Function]:
+        """Return the function containing the given bytecode offset, or None
+        """
+        for function in self.functions:
+            start = function.start_offset
+            last = self.script.instructions[function.last_instruction_index]
+            if start <= offset < last.offset + last.size:
+                return function
+        return None
+
+    def analyze_all(self) -> NoReturn:
+        """Force analysis of all functions that have not been analyzed yet
+        """
+        for function in self.functions:
+            function.analyze()
     
     @classmethod
-    def build_from_script(cls, script:MjoScript) -> 'ControlFlowGraph':
-        start_indices:Set[int] = set()
-        functions:List[Function] = []
+    def build_from_script(cls, script:MjoScript, *, lazy:bool=True) -> 'ControlFlowGraph':
+        """Find function boundaries in the script, and build the control flow graph
 
-        # mark function start indices
-        for function_entry in script.functions:
-            offset:int = function_entry.offset
-            index:int = script.instruction_index_from_offset(offset)
-            if index < 0: raise Exception('No instruction found at offset 0x{:08x}'.format(offset))
+        when lazy is True, each function's basic blocks are only analyzed the first time they're accessed
+        """
+        with stats.phase('cfg'):
+            functions:List[Function] = []
+            instructions:List[Instruction] = script.instructions
+            index_lookup:Dict[int, int] = cls.instruction_index_lookup(script)
 
-            function:Function = Function(script, function_entry.name_hash)
-            function.first_instruction_index = index
-            functions.append(function)
-            start_indices.add(index)
+            # mark function start indices
+            for function_entry in script.functions:
+                offset:int = function_entry.offset
+                index:int = index_lookup.get(offset, -1)
+                if index < 0: raise Exception('No instruction found at offset 0x{:08x}'.format(offset))
+
+                function:Function = Function(script, function_entry.name_hash)
+                function.first_instruction_index = index
+                functions.append(function)
         
-        # find function ends
-        for function in functions:
-            for i in range(function.first_instruction_index, len(script.instructions)):
-                if i + 1 == len(script.instructions) or (i + 1) in start_indices:
-                    function.last_instruction_index = i
-                    break
+            # find function ends (the instruction before the next function start, or last instruction)
+            start_indices:List[int] = sorted(set(fn.first_instruction_index for fn in functions))
+            next_starts:Dict[int, int] = dict(zip(start_indices, start_indices[1:] + [len(instructions)]))
+            for function in functions:
+                function.last_instruction_index = next_starts[function.first_instruction_index] - 1
             
-            if function.last_instruction_index == -1:
-                raise Exception('Unable to find last instruction of function ${.name_hash:08x}'.format(function))
+                if function.last_instruction_index < function.first_instruction_index:
+                    raise Exception('Unable to find last instruction of function ${.name_hash:08x}'.format(function))
         
+        def analyze_deferred(function:Function):
+            with stats.phase('cfg'):
+                cls.analyze_function(function, index_lookup)
+
         for function in functions:
-            cls.analyze_function(function)
+            if lazy:
+                function._pending_analysis = analyze_deferred
+            else:
+                analyze_deferred(function)
         
-        return ControlFlowGraph(functions)
+        return ControlFlowGraph(functions, script)
+
+    @classmethod
+    def instruction_index_lookup(cls, script:MjoScript) -> Dict[int, int]:
+        """Return a lookup of instruction offsets to instruction indices in the script
+        """
+        return dict((instr.offset, i) for i,instr in enumerate(script.instructions))
 
     @classmethod
     def possible_next_instruction_offsets(cls, instruction:Instruction) -> Iterator[int]:
@@ -71,21 +156,27 @@ class ControlFlowGraph:
                 yield instruction.offset + 2 + 2 + (i + 1)*4 + case_offset
 
     @classmethod
-    def analyze_function(cls, function:Function) -> NoReturn:
+    def analyze_function(cls, function:Function, index_lookup:Dict[int, int]=None) -> NoReturn:
+        cls.restore_function(function, cls.scan_function(function, index_lookup))
+        stats.add('blocks_built', len(function.basic_blocks))
+
+    @classmethod
+    def scan_function(cls, function:Function, index_lookup:Dict[int, int]=None) -> tuple:
+        """Find a function's basic block boundaries from its jump targets, without building blocks
+
+        returns the same boundary tuple as function_boundaries()
+        """
         script:MjoScript = function.script
         instructions:List[Instruction] = script.instructions
-
-        entry_block:BasicBlock = BasicBlock(function)
-        entry_block.first_instruction_index = function.first_instruction_index
-        entry_block.is_entry_block = True
-        function.entry_block = entry_block
-        function.exit_blocks = []  # BasicBlock[]
+        if index_lookup is None:
+            index_lookup = cls.instruction_index_lookup(script)
 
         start_indices:Set[int] = {function.first_instruction_index}
-        basic_blocks:List[BasicBlock] = [entry_block]
+        dtor_indices:Set[int] = set()
+        parameter_types:Optional[tuple] = None
 
         def mark_basic_block_start(offset:int, origin:Instruction=None):
-            index = script.instruction_index_from_offset(offset)
+            index = index_lookup.get(offset, -1)
             if index == -1:
                 function.print_function(color=True)
                 # print('{BRIGHT}{BLUE}func ${.name_hash:08x}({!s}){RESET_ALL}'.format(function, ', '.join(t.name for t in function.parameter_types), **Colors))
@@ -105,11 +196,8 @@ class ControlFlowGraph:
             set_len = len(start_indices)
             start_indices.add(index)
             if len(start_indices) != set_len: # new block
-                basic_block:BasicBlock = BasicBlock(function)
                 if offset != origin.offset + origin.size and origin.opcode.mnemonic == "bsel.5":  # 0x847
-                    basic_block.is_dtor_block = True
-                basic_block.first_instruction_index = index
-                basic_blocks.append(basic_block)
+                    dtor_indices.add(index)
         
         # mark basic block boundaries
         #TODO: should this: " < function.last_instruction_index " be "<=" ? ( + 1)
@@ -120,24 +208,84 @@ class ControlFlowGraph:
                 for offset in cls.possible_next_instruction_offsets(instruction):
                     mark_basic_block_start(offset, instruction)
             elif instruction.is_argcheck:
-                function.parameter_types = instruction.type_list
+                parameter_types = tuple(t.value for t in instruction.type_list)
 
-        # find basic block ends
-        for basic_block in basic_blocks:
-            for i in range(basic_block.first_instruction_index, function.last_instruction_index + 1):
-                if i == function.last_instruction_index or (i + 1) in start_indices:
-                    basic_block.last_instruction_index = i
-                    break
-            
-            if basic_block.last_instruction_index == -1:
-                raise Exception('Unable to find last instruction')
-        
+        return (function.name_hash, function.first_instruction_index, function.last_instruction_index,
+                tuple(sorted(start_indices)), tuple(sorted(dtor_indices)), parameter_types)
+
+    @classmethod
+    def scan_boundaries(cls, script:MjoScript) -> List[tuple]:
+        """Return scan_function() boundaries of every function in the script (cheaper than building all blocks)
+        """
+        cfg:ControlFlowGraph = cls.build_from_script(script, lazy=True)
+        with stats.phase('cfg'):
+            index_lookup:Dict[int, int] = cls.instruction_index_lookup(script)
+            return [cls.scan_function(fn, index_lookup) for fn in cfg.functions]
+
+    @classmethod
+    def link_basic_blocks(cls, function:Function, basic_blocks:List[BasicBlock]) -> NoReturn:
+        """Assign sorted basic blocks to a function, and analyze their edges and jump targets
+        """
         basic_blocks.sort(key=lambda b: b.first_instruction_index)
+        for i,basic_block in enumerate(basic_blocks):
+            basic_block.index = i
         function.basic_blocks = basic_blocks
 
         for basic_block in basic_blocks:
             cls.analyze_basic_block(basic_block)
 
+    #region ## BLOCK BOUNDARIES ##
+
+    @classmethod
+    def function_boundaries(cls, function:Function) -> tuple:
+        """Return the minimal analysis of a function needed by restore_function (for caching)
+
+        (name_hash, first_index, last_index, block_starts, dtor_starts, parameter_types)
+        """
+        blocks:List[BasicBlock] = function.basic_blocks
+        parameter_types = function.parameter_types
+        return (function.name_hash, function.first_instruction_index, function.last_instruction_index,
+                tuple(b.first_instruction_index for b in blocks),
+                tuple(b.first_instruction_index for b in blocks if b.is_dtor_block),
+                (tuple(t.value for t in parameter_types) if parameter_types is not None else None))
+
+    @classmethod
+    def build_from_boundaries(cls, script:MjoScript, boundaries:List[tuple], *, lazy:bool=True) -> 'ControlFlowGraph':
+        """Rebuild the control flow graph from function_boundaries() without searching for jump targets
+        """
+        functions:List[Function] = []
+        for boundary in boundaries:
+            function:Function = Function(script, boundary[0])
+            function.first_instruction_index, function.last_instruction_index = boundary[1], boundary[2]
+            functions.append(function)
+
+        for function,boundary in zip(functions, boundaries):
+            if lazy:
+                function._pending_analysis = lambda fn, b=boundary: cls.restore_function(fn, b)
+            else:
+                cls.restore_function(function, boundary)
+
+        return ControlFlowGraph(functions, script)
+
+    @classmethod
+    def restore_function(cls, function:Function, boundary:tuple) -> NoReturn:
+        _, _, last_index, block_starts, dtor_starts, parameter_types = boundary
+        function.exit_blocks = []
+        function.parameter_types = [MjoType(t) for t in parameter_types] if parameter_types is not None else None
+        basic_blocks:List[BasicBlock] = []
+        for i,first_index in enumerate(block_starts):
+            basic_block:BasicBlock = BasicBlock(function)
+            basic_block.first_instruction_index = first_index
+            basic_block.last_instruction_index = (block_starts[i + 1] - 1) if (i + 1 < len(block_starts)) else last_index
+            basic_block.is_dtor_block = first_index in dtor_starts
+            basic_blocks.append(basic_block)
+        # entry block is always the function start
+        basic_blocks[0].is_entry_block = True
+        function.entry_block = basic_blocks[0]
+        cls.link_basic_blocks(function, basic_blocks)
+
+    #endregion
+
     @classmethod
     def analyze_basic_block(cls, basic_block:BasicBlock) -> NoReturn:
         function:Function = basic_block.function
@@ -171,4 +319,209 @@ class ControlFlowGraph:
                 last_instruction.switch_targets[i] = function.basic_block_from_offset(target)
 
 
-del Iterator, NoReturn  # cleanup declaration-only imports
+class NaturalLoop:
+    """Natural loop of basic block indices identified by a back edge to its header
+    """
+    def __init__(self, header:int, body:Set[int], latches:List[int]):
+        self.header:int = header  # block index of loop header (dominates all blocks in body)
+        self.body:Set[int] = body  # block indices in the loop, including the header
+        self.latches:List[int] = latches  # block indices with back edges to the header
+        self.parent:Optional['NaturalLoop'] = None  # innermost enclosing loop
+        self.depth:int = 1  # nesting depth, outermost loops are 1
+    def __contains__(self, index:int) -> bool:
+        return index in self.body
+    def __len__(self) -> int:
+        return len(self.body)
+    def __repr__(self) -> str:
+        return '<{0.__class__.__name__}: header={0.header} blocks={1} depth={0.depth}>'.format(self, len(self.body))
+
+
+class FunctionFlow:
+    """Dominator tree, post-dominator tree, natural loops and orderings for a function's basic blocks
+
+    all lists are indexed by BasicBlock.index, unreachable blocks are given -1 where applicable.
+    dominators are computed with the Cooper-Harvey-Kennedy iterative algorithm.
+    """
+    def __init__(self, function:Function):
+        self.function:Function = function
+        self.blocks:List[BasicBlock] = function.basic_blocks
+        count:int = len(self.blocks)
+
+        # edges (duplicate edges are removed, i.e. a branch to the next instruction)
+        self.successors:List[List[int]] = [list(OrderedDict.fromkeys(b.index for b in block.successors)) for block in self.blocks]
+        self.predecessors:List[List[int]] = [[] for _ in range(count)]
+        for i,succs in enumerate(self.successors):
+            for j in succs:
+                self.predecessors[j].append(i)
+
+        entry:int = function.entry_block.index
+        # forward ordering and dominators
+        self.postorder:List[int] = self._postorder([entry], self.successors)
+        self.reverse_postorder:List[int] = self.postorder[::-1]
+        self.rpo_number:List[int] = [-1] * count
+        for n,i in enumerate(self.reverse_postorder):
+            self.rpo_number[i] = n
+        self.reachable:List[bool] = [n != -1 for n in self.rpo_number]
+        self.idom:List[int] = self._dominators(count, self.postorder, self.predecessors)
+
+        # post-dominators: reverse graph with a virtual exit node (index == count)
+        #  connected to all exit blocks and blocks without successors
+        exits:List[int] = [i for i,block in enumerate(self.blocks) if block.is_exit_block or not self.successors[i]]
+        rsuccessors:List[List[int]] = self.predecessors + [exits]
+        rpredecessors:List[List[int]] = [list(s) for s in self.successors] + [[]]
+        for i in exits:
+            rpredecessors[i].append(count)
+        rpostorder:List[int] = self._postorder([count], rsuccessors)
+        ipdom:List[int] = self._dominators(count + 1, rpostorder, rpredecessors)
+        # the virtual exit is not exposed, blocks only post-dominated by it become -1
+        self.ipdom:List[int] = [(d if d != count else -1) for d in ipdom[:count]]
+
+        # dominator tree children and pre/post numbering for O(1) dominance queries
+        self.dom_children:List[List[int]] = [[] for _ in range(count)]
+        for i,d in enumerate(self.idom):
+            if d != -1:
+                self.dom_children[d].append(i)
+        self._dom_pre:List[int] = [-1] * count
+        self._dom_post:List[int] = [-1] * count
+        self._number_tree(entry, self.dom_children, self._dom_pre, self._dom_post)
+
+        # natural loops and nesting
+        self.loops:List[NaturalLoop] = self._find_loops(count)
+        self.loop_header:List[int] = [-1] * count  # innermost loop header containing each block
+        self.loop_depth:List[int] = [0] * count
+        for loop in sorted(self.loops, key=len, reverse=True):  # outermost first, inner loops overwrite
+            for i in loop.body:
+                self.loop_header[i] = loop.header
+                self.loop_depth[i] = loop.depth
+
+    #region # queries:
+    def dominates(self, a:int, b:int) -> bool:
+        """True if block index a dominates block index b (a block dominates itself)
+        """
+        if self._dom_pre[a] == -1 or self._dom_pre[b] == -1:
+            return False
+        return self._dom_pre[a] <= self._dom_pre[b] and self._dom_post[b] <= self._dom_post[a]
+    def post_dominates(self, a:int, b:int) -> bool:
+        """True if block index a post-dominates block index b (a block post-dominates itself)
+        """
+        while b != -1:
+            if a == b:
+                return True
+            b = self.ipdom[b]
+        return False
+    def is_back_edge(self, source:int, target:int) -> bool:
+        return target in self.successors[source] and self.dominates(target, source)
+    @property
+    def unreachable_blocks(self) -> List[BasicBlock]:
+        return [b for b,r in zip(self.blocks, self.reachable) if not r]
+    #endregion
+
+    #region # algorithms:
+    @classmethod
+    def _postorder(cls, roots:List[int], successors:List[List[int]]) -> List[int]:
+        # iterative DFS, avoids recursion limits with large functions
+        visited:Set[int] = set(roots)
+        order:List[int] = []
+        for root in roots:
+            stack = [(root, iter(successors[root]))]
+            while stack:
+                node, children = stack[-1]
+                for child in children:
+                    if child not in visited:
+                        visited.add(child)
+                        stack.append((child, iter(successors[child])))
+                        break
+                else:
+                    stack.pop()
+                    order.append(node)
+        return order
+
+    @classmethod
+    def _dominators(cls, count:int, postorder:List[int], predecessors:List[List[int]]) -> List[int]:
+        # Cooper, Harvey, Kennedy: "A Simple, Fast Dominance Algorithm"
+        po_number:List[int] = [-1] * count
+        for n,i in enumerate(postorder):
+            po_number[i] = n
+        idom:List[int] = [-1] * count
+        if not postorder:
+            return idom
+        root:int = postorder[-1]
+        idom[root] = root
+
+        def intersect(a:int, b:int) -> int:
+            while a != b:
+                while po_number[a] < po_number[b]:
+                    a = idom[a]
+                while po_number[b] < po_number[a]:
+                    b = idom[b]
+            return a
+
+        rpo:List[int] = postorder[-2::-1]  # reverse postorder, excluding root
+        changed:bool = True
+        while changed:
+            changed = False
+            for i in rpo:
+                new_idom:int = -1
+                for p in predecessors[i]:
+                    if idom[p] != -1:
+                        new_idom = p if new_idom == -1 else intersect(p, new_idom)
+                if idom[i] != new_idom:
+                    idom[i] = new_idom
+                    changed = True
+        idom[root] = -1  # root has no immediate dominator
+        return idom
+
+    @classmethod
+    def _number_tree(cls, root:int, children:List[List[int]], pre:List[int], post:List[int]) -> NoReturn:
+        counter:int = 0
+        stack = [(root, iter(children[root]))]
+        pre[root] = counter
+        while stack:
+            node, it = stack[-1]
+            for child in it:
+                counter += 1
+                pre[child] = counter
+                stack.append((child, iter(children[child])))
+                break
+            else:
+                stack.pop()
+                counter += 1
+                post[node] = counter
+
+    def _find_loops(self, count:int) -> List[NaturalLoop]:
+        # collect back edges per header, in reverse postorder for deterministic results
+        latches:Dict[int, List[int]] = OrderedDict()
+        for source in self.reverse_postorder:
+            for target in self.successors[source]:
+                if self.dominates(target, source):
+                    latches.setdefault(target, []).append(source)
+        
+        loops:List[NaturalLoop] = []
+        for header,sources in latches.items():
+            body:Set[int] = {header}
+            stack:List[int] = [s for s in sources if s != header]
+            body.update(stack)
+            while stack:
+                for p in self.predecessors[stack.pop()]:
+                    if p not in body and self.reachable[p]:
+                        body.add(p)
+                        stack.append(p)
+            loops.append(NaturalLoop(header, body, sources))
+
+        # nesting: parent is the smallest loop that contains this loop's header (other than itself)
+        by_size = sorted(loops, key=len)
+        for loop in loops:
+            for other in by_size:
+                if other is not loop and len(other) > len(loop) and loop.body <= other.body:
+                    loop.parent = other
+                    break
+        for loop in loops:
+            parent = loop.parent
+            while parent is not None:
+                loop.depth += 1
+                parent = parent.parent
+        return loops
+    #endregion
+
+
+del Dict, Iterator, NoReturn, Optional  # cleanup declaration-only imports
@@ -11,16 +11,16 @@ __all__ = ['MjILAssembler']
 
 #######################################################################################
 
-import csv, enum, io, math, os, re, struct  # math used for isnan()
+import enum, hashlib, io, math, os, re, struct  # math used for isnan()
 from abc import abstractproperty
-from collections import namedtuple, OrderedDict
-from typing import Any, Callable, Dict, Iterable, Iterator, List, NoReturn, Optional, Set, Tuple, Union  # for hinting in declarations
+from collections import deque, namedtuple, OrderedDict
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, NoReturn, Optional, Set, TextIO, Tuple, Union  # for hinting in declarations
 #source: <https://stackoverflow.com/a/38935153/7517185>
 from typing import Match, Pattern  # for regex type hinting
 from enum import auto
-from struct import calcsize
+from struct import calcsize, pack_into
 
-from ._util import StructIO, DummyColors, Colors, signed_i, unsigned_I, doublequote, sub_escapes, strip_ansi, len_ansi, repl_tabs, len_tabs, escape_ignorequotes, unescape
+from ._util import StructIO, DummyColors, Colors, signed_i, unsigned_I, doublequote, sub_escapes, strip_ansi, len_ansi, repl_tabs, len_tabs
 from .flags import MjoType, MjoScope, MjoInvert, MjoModifier, MjoDimension, MjoFlags
 from .opcodes import Opcode
 from . import crypt
@@ -29,6 +29,8 @@ from . import known_hashes
 
 from .script import Instruction, FunctionEntry, MjoScript, BasicBlock, Function
 from .analysis import ControlFlowGraph
+from .resources import ResourceLoader, ResourceTable, RESOURCE_LOADER
+from . import stats
 
 
 #region ## PARSER EXCEPTIONS ##
@@ -177,6 +179,60 @@ KEYWORD_KIND_MAP:Dict[TokenKind,dict] = OrderedDict({
     TokenKind.DIRECTIVE_ARG: DIRECTIVE_ARG_KEYWORDS,
 })
 
+def lookup_keyword(name:str) -> Optional[Tuple[TokenKind, Any]]:
+    """Return the (kind, value) of a keyword name, or None if unknown (slow path, see KEYWORD_TABLE)
+    """
+    # types implementing function: cls.fromname(name:str, default=...)
+    for kind,namecls in FROMNAME_KIND_MAP.items():
+        nameval = namecls.fromname(name, None)
+        if nameval is not None:
+            # if kind is TokenKind.INVERT: and name in Opcode.ALIASES:
+            if kind is TokenKind.INVERT:
+                # handle context dependent keywords: notl, not
+                opcode = Opcode.fromname(name, None)
+                if opcode is not None:
+                    # flags and opcodes will need to handle this awkward scenario
+                    return (TokenKind.OPCODE_INVERT, (Opcode.ALIASES[name], nameval))
+            return (kind, nameval)
+
+    # dictionaries of known keywords:
+    # func|void, directives, directive arguments:
+    for kind,kwddict in KEYWORD_KIND_MAP.items():
+        kwdval = kwddict.get(name, None)
+        if kwdval is not None:
+            return (kind, kwdval)
+    return None
+
+def build_keyword_table() -> Dict[str, Tuple[TokenKind, Any]]:
+    """Precompute (kind, value) for every name accepted by lookup_keyword
+    """
+    names:Set[str] = set()
+    for namecls in FROMNAME_KIND_MAP.values():
+        if namecls is not Opcode:
+            names.update(namecls._LOOKUP)
+    names.update(Opcode.ALIASES)
+    for value in Opcode.BYVALUE:
+        names.update(('op.{:03x}'.format(value), 'nop.{:03x}'.format(value)))
+    for kwddict in KEYWORD_KIND_MAP.values():
+        names.update(kwddict)
+    table:Dict[str, Tuple[TokenKind, Any]] = {}
+    for name in sorted(names):
+        entry = lookup_keyword(name)
+        if entry is not None:
+            table[name] = entry
+    return table
+
+# name -> (kind, value), one dict lookup per keyword token
+#  (empty until the first assembler is created, building it is most of the import time of this module)
+KEYWORD_TABLE:Dict[str, Tuple[TokenKind, Any]] = {}
+
+def load_keyword_table() -> Dict[str, Tuple[TokenKind, Any]]:
+    """Build KEYWORD_TABLE if it hasn't been built yet, and return it
+    """
+    if not KEYWORD_TABLE:
+        KEYWORD_TABLE.update(build_keyword_table())
+    return KEYWORD_TABLE
+
 #endregion
 
 #region ## TOKEN REGEX ##
@@ -186,18 +242,18 @@ RE_EOL = re.compile(r"^\s*((?:\/\/|;).*)?$")
 RE_WHITESPACE = re.compile(r"^[ \t]+") #ALT?: r"\s+"
 
 # label, (address | name)
-RE_LABEL       = re.compile(r"^((?P<address>[0-9A-Fa-f]+)|(?P<name>[0-9A-Za-z_]+)):")
+RE_LABEL       = re.compile(r"^((?P<label_address>[0-9A-Fa-f]+)|(?P<label_name>[0-9A-Za-z_]+)):")
 # target, (offset no '~' | address | name)
-RE_TARGET      = re.compile(r"^@(~(?P<offset>[-+]?[0-9A-Fa-f]+)|(?P<address>[0-9A-Fa-f]+)|(?P<name>[0-9A-Za-z_]+))\b")
+RE_TARGET      = re.compile(r"^@(~(?P<target_offset>[-+]?[0-9A-Fa-f]+)|(?P<target_address>[0-9A-Fa-f]+)|(?P<target_name>[0-9A-Za-z_]+))\b")
 # number
-RE_LINE_NUMBER = re.compile(r"^#([0-9]+)\b")
+RE_LINE_NUMBER = re.compile(r"^#(?P<line_number>[0-9]+)\b")
 
 #NOTE: allow uppercase, but no keyword accepts it, used to throw errors
 # keyword
 RE_KEYWORD = re.compile(r"^([A-Za-z_](?:[0-9A-Za-z_.]*[0-9A-Za-z_])?)\b")
 
 # quoted, (unquoted)
-RE_LITERAL_STRING = re.compile(r"^(\"(?P<value>(?:\\.|[^\"])*)\")")
+RE_LITERAL_STRING = re.compile(r"^(\"(?P<string>(?:\\.|[^\"])*)\")")
 #FIXME: [DISCUSSION] decided on specification for legal NAN/INF, currently all case-mixing is legal
 #NOTE: regex case-insensitivity (?i:) is Python 3.6+
 # value, (fixed | exponent | (+-)inf | nan)
@@ -207,7 +263,7 @@ RE_LITERAL_FLOAT = re.compile(r"^(([+-]?[0-9]*\.[0-9]+)|([+-]?\d*\.\d+[Ee][+-]?\
 RE_LITERAL_INT = re.compile(r"^((?P<hex>[+-]?0[Xx][0-9A-Fa-f]+)|(?P<dec>[+-]?[0-9]+))\b(?!\.)")
 
 # no-$-prefix hash, (hex | implicit name | explicit name w/o {})
-RE_ANY_HASH = re.compile(r'^\$(([0-9A-Fa-f]{8})|([_%@#$0-9A-Za-z]+)|\{([^}]+)\})(?=$|\s|[\/;(){}\[\],])')
+RE_ANY_HASH = re.compile(r'^\$((?P<hash_value>[0-9A-Fa-f]{8})|(?P<hash_name>[_%@#$0-9A-Za-z]+)|\{(?P<hash_explicit>[^}]+)\})(?=$|\s|[\/;(){}\[\],])')
 # RE_LITERAL_HASH = re.compile(r'^\$(?P<value>[0-9A-Fa-f]{8})\b')
 # # name
 # RE_INLINE_HASH_IMPLICIT = re.compile(r'^\$(?P<name>[_%@#$0-9A-Za-z]+)(?=$|\s|[\/;(){}\[\],])')
@@ -215,7 +271,7 @@ RE_ANY_HASH = re.compile(r'^\$(([0-9A-Fa-f]{8})|([_%@#$0-9A-Za-z]+)|\{([^}]+)\})
 # RE_INLINE_HASH_EXPLICIT = re.compile(r'^\$\{(?P<name>(?:[^}]+)\}(?=$|\s|[\/;(){}\[\],])')
 
 # no-%-prefix hash, (implicit name | explicit name w/o {})
-RE_RESOURCE = re.compile(r'^%(([_%@#$0-9A-Za-z]+)|\{([^}]+)\})(?=$|\s|[\/;(){}\[\],])')
+RE_RESOURCE = re.compile(r'^%((?P<resource_name>[_%@#$0-9A-Za-z]+)|\{(?P<resource_explicit>[^}]+)\})(?=$|\s|[\/;(){}\[\],])')
 
 RE_PUNCTUATION = re.compile(r"^[(){}\[\],]")
 
@@ -226,63 +282,43 @@ RE_PUNCTUATION = re.compile(r"^[(){}\[\],]")
 def parse_target(token:ParseToken) -> NoReturn:
     # pattern: RE_TARGET
     m:Match = token.match
-    if m[2]: # explicit offset
+    if m['target_offset']: # explicit offset
         #NOTE: Python supports int('+1', 16), we don't need to handle it (if you're porting this, beware!)
-        token.value = int(m[2], 16)
+        token.value = int(m['target_offset'], 16)
         token.kind = TokenKind.OFFSET
-    elif m[3]: # address
-        token.value = m[3]  #TODO: address target is stored as str
-        # token.value = int(m[3], 16)
+    elif m['target_address']: # address
+        token.value = m['target_address']  #TODO: address target is stored as str
+        # token.value = int(m['target_address'], 16)
         token.kind = TokenKind.ADDRESS
-    else: #elif m[4]: # label name
-        token.value = m[4]
+    else: #elif m['target_name']: # label name
+        token.value = m['target_name']
         token.kind = TokenKind.LABEL
 
 def parse_label(token:ParseToken) -> NoReturn:
     # pattern: RE_LABEL
     m:Match = token.match
-    if m[2]: # address
-        token.value = m[2]  #TODO: address target is stored as str
-        # token.value = int(m[2], 16)
+    if m['label_address']: # address
+        token.value = m['label_address']  #TODO: address target is stored as str
+        # token.value = int(m['label_address'], 16)
         token.kind = TokenKind.ADDRESS
-    else: #elif m[3]: # label name
-        token.value = m[3]
+    else: #elif m['label_name']: # label name
+        token.value = m['label_name']
         token.kind = TokenKind.LABEL
 
 def parse_line_number(token:ParseToken) -> NoReturn:
     # pattern: RE_LINE_NUMBER
     m:Match = token.match
-    token.value = int(m[1], 10)
+    token.value = int(m['line_number'], 10)
     token.kind = TokenKind.LINE_NUMBER
 
 def parse_keyword(token:ParseToken) -> NoReturn:
     name = token.text
-
-    # types implementing function: cls.fromname(name:str, default=...)
-    for kind,namecls in FROMNAME_KIND_MAP.items():
-        nameval = namecls.fromname(name, None)
-        if nameval is not None:
-            # if kind is TokenKind.INVERT: and name in Opcode.ALIASES:
-            if kind is TokenKind.INVERT:
-                # handle context dependent keywords: notl, not
-                opcode = Opcode.fromname(name, None)
-                if opcode is not None:
-                    # flags and opcodes will need to handle this awkward scenario
-                    token.value = (Opcode.ALIASES[name], nameval)
-                    token.kind = TokenKind.OPCODE_INVERT
-                    return
-            token.value = nameval
-            token.kind = kind
-            return
-
-    # dictionaries of known keywords:
-    # func|void, directives, directive arguments:
-    for kind,kwddict in KEYWORD_KIND_MAP.items():
-        kwdval = kwddict.get(name, None)
-        if kwdval is not None:
-            token.value = kwdval
-            token.kind = kind
-            return
+    entry = KEYWORD_TABLE.get(name, None)
+    if entry is None:
+        entry = lookup_keyword(name)  # names outside the precomputed table
+    if entry is not None:
+        token.kind, token.value = entry
+        return
 
     # point of no return: add some non-essential failures that may have happened
     if re.match(r"^dim\d+$", name):
@@ -295,7 +331,7 @@ def parse_keyword(token:ParseToken) -> NoReturn:
 def parse_string(token:ParseToken) -> NoReturn:
     # pattern: RE_LITERAL_STRING
     m:Match = token.match
-    token.value = unescape_string(m[2])
+    token.value = unescape_string(m['string'])
     token.kind = TokenKind.LITERAL_STRING
 
 def parse_float(token:ParseToken) -> NoReturn:
@@ -312,24 +348,24 @@ def parse_int(token:ParseToken) -> NoReturn:
 def parse_hash(token:ParseToken) -> NoReturn:
     # pattern: RE_ANY_HASH
     m:Match = token.match
-    if m[2]: # hex
-        token.value = int(m[2], 16)
+    if m['hash_value']: # hex
+        token.value = int(m['hash_value'], 16)
         token.kind = TokenKind.LITERAL_HASH
-    elif m[3]: # inline implicit
-        token.value = m[3]
+    elif m['hash_name']: # inline implicit
+        token.value = m['hash_name']
         token.kind = TokenKind.INLINE_HASH
-    else: #elif m[4]: # inline explicit
-        token.value = m[4]
+    else: #elif m['hash_explicit']: # inline explicit
+        token.value = m['hash_explicit']
         token.kind = TokenKind.INLINE_HASH
 
 def parse_resource(token:ParseToken) -> NoReturn:
     ## pattern: RE_RESOURCE
     m:Match = token.match
-    if m[2]: # inline implicit
-        token.value = m[2]
+    if m['resource_name']: # inline implicit
+        token.value = m['resource_name']
         token.kind = TokenKind.INLINE_RESOURCE
-    else: #elif m[3]: # inline explicit
-        token.value = m[3]
+    else: #elif m['resource_explicit']: # inline explicit
+        token.value = m['resource_explicit']
         token.kind = TokenKind.INLINE_RESOURCE
 
 def parse_punctuation(token:ParseToken) -> NoReturn:
@@ -367,6 +403,18 @@ MATCHING:Dict[TokenType, Tuple[Pattern,Callable]] = OrderedDict({
     TokenType.PUNCTUATION: (RE_PUNCTUATION, parse_punctuation), # [(){}[],]
 })
 
+# all MATCHING patterns as one alternation (in the same priority order), for RE_TOKEN.match(line, pos),
+#  the outer group of each alternative is named after its TokenType (found with Match.lastgroup)
+RE_TOKEN:Pattern = re.compile('|'.join(f'(?P<{token_type.name}>{pattern.pattern[1:]})' for token_type,(pattern,_) in MATCHING.items()))
+# TokenType name -> (TokenType, parser)
+TOKEN_GROUPS:Dict[str, Tuple[TokenType,Callable]] = {token_type.name: (token_type, parser) for token_type,(_,parser) in MATCHING.items()}
+
+# whitespace and comments merged before each token, for .match(line, pos)
+#  (whitespace | inline comment | line comment (EOL) | open block comment (EOL+) | EOL)
+RE_ALL_WHITESPACE:Pattern = re.compile(r"(?:(\s+)|(\/\*[^\n]*?\*\/)|((?:\/\/|;).*$)|(\/\*)|($))")
+# end of a multiline block comment (last on the line)
+RE_COMMENT_END:Pattern = re.compile(r".*(\*\/)")
+
 # MATCHING:Dict[TokenType, Tuple[Pattern,Callable]] = OrderedDict({
 #     TokenType.EOL:         RE_EOL,            # [] empty string
 #     TokenType.WHITESPACE:  RE_WHITESPACE,     # [ \t] and comments (//|;|/**/)
@@ -441,42 +489,45 @@ LITERAL_ESCAPES:Dict[str,str] = OrderedDict({
 })
 
 def unescape_string(string:str, useless_escapes:bool=False) -> str:
+    i = string.find('\\')
+    if i == -1: # fast path: no escapes
+        return string
     sb = io.StringIO()
-    i = 0
-    while i < len(string):
-        c = string[i]
-        if c != '\\': # character
-            sb.write(c)
-            i += 1
-        else: # escape
-            c = string[i+1]
-            if c in LITERAL_ESCAPES: # \_
-                sb.write(LITERAL_ESCAPES[c])
-                i += 2
-            elif c == 'x': # \xFF
-                sb.write(chr(int(string[i+2:i+4], 16)))
-                i += 4
-            elif c == 'u': # \uFFFF
-                sb.write(chr(int(string[i+2:i+6], 16)))
-                i += 6
-            elif c == 'U': # \UFFFFFFFF
-                #sb.write(chr(int(string[i+1:i+9], 16)))
-                #i += 10
-                raise Exception('UTF-32 escape \\UXXXXXXXX is not supported')
-            elif ('0' <= c <= '7'): # \7, \77, \777
-                if not ('0' <= string[i+1] <= '7'):
-                    octlen = 1
-                elif not ('0' <= string[i+2] <= '7'):
-                    octlen = 2
-                else:
-                    octlen = 3
-                sb.write(chr(int(string[i+1:i+1+octlen], 8)))
-                i += 1 + octlen
-            elif useless_escapes: # useless literal escape
-                sb.write(c)
+    start = 0
+    while i != -1:
+        sb.write(string[start:i]) # unescaped run
+        c = string[i+1]
+        if c in LITERAL_ESCAPES: # \_
+            sb.write(LITERAL_ESCAPES[c])
+            i += 2
+        elif c == 'x': # \xFF
+            sb.write(chr(int(string[i+2:i+4], 16)))
+            i += 4
+        elif c == 'u': # \uFFFF
+            sb.write(chr(int(string[i+2:i+6], 16)))
+            i += 6
+        elif c == 'U': # \UFFFFFFFF
+            #sb.write(chr(int(string[i+1:i+9], 16)))
+            #i += 10
+            raise Exception('UTF-32 escape \\UXXXXXXXX is not supported')
+        elif ('0' <= c <= '7'): # \7, \77, \777
+            if not ('0' <= string[i+1] <= '7'):
+                octlen = 1
+            elif not ('0' <= string[i+2] <= '7'):
+                octlen = 2
             else:
-                #TODO: choose to handle useless escapes here
-                raise Exception('Unexpected escape character {!r} in string literal!'.format(c))
+                octlen = 3
+            sb.write(chr(int(string[i+1:i+1+octlen], 8)))
+            i += 1 + octlen
+        elif useless_escapes: # useless literal escape
+            sb.write(c)
+            i += 2
+        else:
+            #TODO: choose to handle useless escapes here
+            raise Exception('Unexpected escape character {!r} in string literal!'.format(c))
+        start = i
+        i = string.find('\\', start)
+    sb.write(string[start:])
     return sb.getvalue()
 
 #endregion
@@ -579,23 +630,51 @@ def instruction_size(instr:Instruction) -> int:
 
 #endregion
 
+#region ## FIXUPS ##
+
+# jump or switch case operand referring to a label, patched after all instructions of its function are sized
+#  pos:   bytecode offset of the int32 operand (offsets are relative to the end of the operand)
+#  label: label name (labels are local to the function)
+#  instr: instruction containing the operand
+#  case:  switch case index, or -1 for a jump offset
+Fixup = namedtuple('Fixup', ('pos', 'label', 'instr', 'case'))
+
+#endregion
+
 
 ## IL PARSER/ASSEMBLER CLASS ##
 
 class MjILAssembler:
-    def __init__(self, filename:str, *, encoding:str='utf-8'):
+    def __init__(self, filename:Union[str, TextIO], *, encoding:str='utf-8', function_cache:Optional[Dict[str, Tuple[bytes, int]]]=None, resource_loader:Optional[ResourceLoader]=None, bytecode_writer:Optional[BinaryIO]=None):
+        """filename: .mjil file name, or any open text stream (i.e. sys.stdin, resfile paths are relative to its name).
+        function_cache: {function_key: (bytecode, max_line)} of a previous build (i.e. FunctionCache.get()),
+        function bodies with the same key are spliced in without being parsed (and are not added to instructions),
+        when empty, keys of this build are recorded while parsing (no read ahead).
+        resource_loader: parsed resfile cache (defaults to the shared RESOURCE_LOADER).
+        bytecode_writer: stream each function's bytecode to this writer when its closing brace is parsed,
+        instructions are discarded after each function (bytecode is None, and instructions only hold the current function).
+        """
+        load_keyword_table()
         # IL script:
         self.script:MjoScript = MjoScript(MjoScript.SIGNATURE_DECRYPTED, None, 0, None, None, [], [])
         self.group_directive:Optional[str] = None
         self.resfile_directive:Optional[str] = None
-        self.resource_dict:dict = None
+        self.resource_dict:ResourceTable = None
+        self.resource_loader:ResourceLoader = RESOURCE_LOADER if resource_loader is None else resource_loader
         self.readmark_directive:Optional[bool] = None
         self.max_line:int = 0 # used for readmark enable
 
         # parsing:
+        self.stream:Optional[TextIO] = None  # caller-owned text stream (never closed)
+        if not isinstance(filename, str):
+            self.stream = filename
+            filename = getattr(filename, 'name', None)
+            if not isinstance(filename, str):
+                filename = '<stream>'
         self.filename:str = filename
         self.encoding:str = encoding
         self.file:Optional[io.TextIOBase] = None
+        self.pending_lines:deque = deque()  # lines read ahead, returned by next_line() before the file
         self.line:Optional[str] = None
         self.pos:int = 0
         self.line_num:int = 0  # (MJIL FILE) 0 is none
@@ -603,9 +682,25 @@ class MjILAssembler:
         # IL storage:
         self.current_function:Optional[FunctionEntry] = None
         self.labels:Dict[str,Instruction] = OrderedDict()  # map of label name to index of next instruction
-        self.unresolved_targets:Dict[str, Set[Instruction]] = {}
         self.current_labels:Set[str] = set()  # labels for the next instruction definition
 
+        # two-pass assembly (per function):
+        self.fixups:List[Fixup] = []  # flat table of label operands of the current function (pass one)
+        self.function_instructions:int = 0  # index of the current function's first instruction
+        self.bytecode_writer:Optional[BinaryIO] = bytecode_writer
+        self.bytecode:Optional[bytearray] = None if bytecode_writer is not None else bytearray()  # bytecode of all closed functions (pass two)
+        self.bytecode_written:int = 0  # size of bytecode emitted so far
+        self._bytecode_pos:int = 0
+
+        # function-level incremental assembly:
+        self.function_cache:Optional[Dict[str, Tuple[bytes, int]]] = function_cache
+        self.function_cache_entries:Dict[str, Tuple[bytes, int]] = {}  # entries of this build (after read)
+        self.function_key:Optional[str] = None  # key of the current (parsed) function
+        self.function_key_parts:Optional[List[str]] = None  # key parts recorded while parsing the current function
+        self.function_max_line:int = 0
+        self.function_hits:int = 0
+        self.function_misses:int = 0
+
         # special modes:
         self.is_block_comment:bool = False
         self.block_comment_line:Optional[int] = None
@@ -617,13 +712,17 @@ class MjILAssembler:
     #
     def close(self) -> bool:
         if self.file is not None:
-            self.file.close()
+            if self.file is not self.stream:
+                self.file.close()
             self.file = None
             return True
         return False
     def open(self) -> NoReturn:
         self.close()
-        self.file = open(self.filename, 'rt', encoding=self.encoding)
+        if self.stream is not None:
+            self.file = self.stream
+        else:
+            self.file = open(self.filename, 'rt', encoding=self.encoding)
         # self.line = None
         # self.pos = 0
         # self.line_num = 0
@@ -636,10 +735,7 @@ class MjILAssembler:
     #
     @property
     def bytecode_pos(self) -> int:
-        if not self.instructions:
-            return 0
-        instr = self.instructions[-1]
-        return instr.offset + instr.size
+        return self._bytecode_pos
     #
     @property
     def is_function(self) -> bool:
@@ -715,36 +811,11 @@ class MjILAssembler:
             raise Exception(f'Inline resource {name!s} could not be found')
         return value
     #
-    def load_resources(self, resfile:str, *, delimiter:str=',', strict:bool=True, escaped:bool=False) -> dict:#, keyname:Union[str,int]='Key', valname:Union[str,int]='Value') -> dict:
-        resources:dict = {}
+    def load_resources(self, resfile:str, *, delimiter:str=',', strict:bool=True, escaped:bool=False) -> ResourceTable:#, keyname:Union[str,int]='Key', valname:Union[str,int]='Value') -> ResourceTable:
         respath:str = os.path.join(os.path.dirname(self.filename), resfile)
         # keycol = keyname if isinstance(keyname, int) else None
         # valcol = valname if isinstance(valname, int) else None
-        with open(respath, 'rt', encoding='utf-8') as f:
-            print('Resources:')
-            reader = csv.reader(f, delimiter=delimiter or ',')
-            first = True
-            for i,row in enumerate(reader):
-                if not row: #TODO: is this possible?
-                    continue
-                if first:
-                    keyname_, valname_ = row
-                    print(keyname_, valname_)
-                    first = False
-                    if strict and tuple(r.lower() for r in row) != ('key', 'value'):
-                        raise Exception(f'Invalid resource file {resfile!r}. Expected first row to have column names [\'Key\',\'Value\'], not {row!r}')
-                    continue
-                if not strict and len(row) == 1:
-                    key, value = row[0], ''
-                else:
-                    key, value = row
-                    if escaped:
-                        value = unescape(value, not strict)
-                if strict and key in resources:
-                    raise Exception(f'Resource file {resfile!r} defines duplicate key {key!r} on line {(i+1)}')
-                print(f'[{key!r}] {escape_ignorequotes(value)}')
-                resources[key] = value
-        return resources
+        return self.resource_loader.load(respath, delimiter=delimiter, strict=strict, escaped=escaped)
     #
     #endregion
     #
@@ -762,8 +833,10 @@ class MjILAssembler:
         if self.is_eof:
             return False  # EOF
         self.is_eol = False
-        self.line = self.file.readline()
+        self.line = self.pending_lines.popleft() if self.pending_lines else self.file.readline()
         self.line_num += 1
+        if self.function_key_parts is not None:
+            self.function_key_parts.append('\n')
         # print(f'{self.line_num} : ', end='')
         self.pos = 0
         if not self.line:
@@ -787,11 +860,11 @@ class MjILAssembler:
         end = pos
         token_type:TokenType = None
 
+        line = self.line
         if self.is_block_comment:
-            RE_COMMENT_END = re.compile(r"^.*(\*\/)")
-            m:Match = RE_COMMENT_END.search(self.line[pos:])
+            m:Match = RE_COMMENT_END.match(line, pos)
             if m:
-                end = m.end() + pos
+                end = m.end()
                 self.is_block_comment = False
                 self.block_comment_line = None
                 self.block_comment_pos = None
@@ -803,41 +876,34 @@ class MjILAssembler:
 
         if not self.is_block_comment:
             # specially handle whitespace and normalize comments
-            RE_ALL_WHITESPACE = re.compile(r"^(?:(\s+)|(\/\*[^\n]*?\*\/)|((?:\/\/|;).*$)|(\/\*)|($))")#|(.*\*\/)")
-            # if not isinstance(pos, int): print(f'pos type is {pos.__class__.__name__}')
-            m:Match = RE_ALL_WHITESPACE.search(self.line[pos:])
+            m:Match = RE_ALL_WHITESPACE.match(line, end)
             while m:
                 if m[1]:  # whitespace
-                    end = m.end() + pos
+                    end = m.end()
                     token_type = TokenType.WHITESPACE
                 elif m[2]:  # inline comment
-                    # pad with whitespace to preserve character position
-                    #space = re.sub(r"[^\r\n]", r" ", self.line[m.start()+pos:m.end()+pos])
-                    #self.line = space.join( (self.line[:m.start()+pos], self.line[m.end()+pos:]) )
-                    end = m.end() + pos
+                    end = m.end()
                     token_type = TokenType.WHITESPACE # inline-comments constitute whitespace (even if VSCode doesn't show it)
                 elif m[3]:  # line comment (EOL)
-                    # self.line = self.line[:m.start()+pos]
-                    end = m.start() + pos
+                    end = m.start()
                     self.is_eol = True
                     token_type = TokenType.EOL
                     break  # break, we're done
                 elif m[4]:  # open block comment (EOL+)
-                    # self.line = self.line[:m.start()+pos]
-                    end = m.start() + pos
+                    end = m.start()
                     self.is_eol = True
                     self.is_block_comment = True
                     self.block_comment_line = self.line_num
-                    self.block_comment_pos = m.start() + pos
+                    self.block_comment_pos = m.start()
                     token_type = TokenType.EOL
                     break  # break, we're done
                 elif m[5] is not None: # EOL
-                    end = m.start() + pos
+                    end = m.start()
                     self.is_eol = True
                     token_type = TokenType.EOL
                     break  # break, we're done
                 # next match
-                m = RE_ALL_WHITESPACE.search(self.line[m.end()+pos:])
+                m = RE_ALL_WHITESPACE.match(line, end)
 
         if token_type is TokenType.WHITESPACE:
             # only when there's non-whitespace left on the line
@@ -872,16 +938,16 @@ class MjILAssembler:
             self.pos = token.end
             return token
 
-        # try to match normal tokens
-        for token_type,(pattern,parser) in MATCHING.items():
-            m:Match = pattern.search(self.line[pos:])
-            if m:
-                # if 'func' in m[0] or 'void' in m[0]:
-                #     input('found it!')
-                token = ParseToken(token_type, m, self.line, self.line_num, m.start()+pos, m.end()+pos)
-                self.pos = token.end
-                parser(token)  # extracts token value
-                return token
+        # try to match normal tokens (first matching alternative in MATCHING order)
+        m:Match = RE_TOKEN.match(self.line, pos)
+        if m:
+            token_type, parser = TOKEN_GROUPS[m.lastgroup]
+            token = ParseToken(token_type, m, self.line, self.line_num, pos, m.end())
+            self.pos = token.end
+            parser(token)  # extracts token value
+            if self.function_key_parts is not None:
+                self.append_key_part(self.function_key_parts, m)
+            return token
         print(f'failed to find token type at line {self.line_num}, pos {pos+1}\n{self.line!s}')
         print(' ' * pos + '^')
         raise Exception(f'failed to find token type at line {self.line_num}, pos {pos+1}\n{self.line!r}')
@@ -949,29 +1015,43 @@ class MjILAssembler:
         self.require_eol(token)
         self.current_function = function
         self.functions.append(function)
+        self.function_instructions = len(self.instructions)
+        self.function_max_line = 0
+        if self.function_cache:
+            self.read_cached_function()
+        elif self.function_cache is not None:
+            self.function_key_parts = [repr(self.group_directive)]  # nothing to splice, don't read ahead
         #TODO: clear label caches, and start anew
         
     def end_function(self, end_token:ParseToken):
         if self.current_function is None:
             raise Exception(f'closing {end_token.value!r} found without starting function')
+        if self.function_key_parts is not None:
+            self.function_misses += 1
+            self.function_key = self.function_key_of(self.function_key_parts[:-1])  # excluding closing brace
+            self.function_key_parts = None
         self.require_eol(end_token)
-        self.current_function = None
         if self.current_labels:
             raise Exception(f'{len(self.current_labels)} labels defined with no next instruction at end of function')
-        if self.unresolved_targets:
+        unresolved:Dict[str, List[Instruction]] = OrderedDict()
+        for fixup in self.fixups:
+            if fixup.label not in self.labels:
+                instrs = unresolved.setdefault(fixup.label, [])
+                if not instrs or instrs[-1] is not fixup.instr:
+                    instrs.append(fixup.instr)
+        if unresolved:
             def fmt_instr(i:Instruction):
                 if i.opcode.mnemonic == "switch":
                     return f'{i.offset:05x}: {i.opcode.mnemonic} {i.switch_targets!r}'
                 else:
                     return f'{i.offset:05x}: {i.opcode.mnemonic} {i.jump_target!r}'
-            for s in self.unresolved_targets.values():
-                print(', '.join(repr(fmt_instr(i)) for i in s))
-            #print(list(f'{i.offset:05x}: {i.opcode.mnemonic} self.unresolved_targets.values()))
-            raise Exception(f'{len(self.unresolved_targets)} unresolved targets defined with no label found by end of function')
-        self.unresolved_targets.clear()
+            for instrs in unresolved.values():
+                print(', '.join(repr(fmt_instr(i)) for i in instrs))
+            raise Exception(f'{len(unresolved)} unresolved targets defined with no label found by end of function')
+        with stats.phase('encode'):
+            self.emit_function()
+        self.current_function = None
         self.current_labels.clear()
-        self.labels.clear()
-        #TODO: clear label caches and enforce that all referenced labels are identified
 
     def require_eol(self, last_token:ParseToken):
         token = self.next_token() #_skipws()
@@ -991,6 +1071,7 @@ class MjILAssembler:
         if token.type is TokenType.EOL:
             return
         if token.kind is TokenKind.DIRECTIVE:
+            self.function_key_parts = None  # directives change assembler state, never cached
             if token.value in ('readmark', 'group', 'resfile'):
                 directive = token
                 self.require_ws(directive)
@@ -1052,46 +1133,91 @@ class MjILAssembler:
                 self.parse_instruction(token)
         else:
             raise Exception(f'unexpected token {token!r} while parsing line')
-    def define_target(self, target_name:str, instr:Instruction) -> Optional[Instruction]:
-        label_instr = self.labels.get(target_name, None)
-        if label_instr is not None:
-            return label_instr
-        
-        self.unresolved_targets.setdefault(target_name, set())
-        self.unresolved_targets[target_name].add(instr)
+    def read_cached_function(self):
+        """Read ahead to the closing brace of the current function, and splice in its cached bytecode if the key matches
+
+        otherwise the lines are parsed normally (and the key is remembered for function_cache_entries),
+        bodies containing directives, or that fail to tokenize, are always parsed normally.
+        """
+        start_state = (self.line_num, self.is_eof, self.is_block_comment, self.block_comment_line, self.block_comment_pos)
+        lines:List[str] = []
+        parts:List[str] = [repr(self.group_directive)]
+        key = None
+        stop:bool = False  # closing brace or directive found
+        try:
+            while not stop:
+                line_state = (self.line_num, self.is_eof, self.is_block_comment, self.block_comment_line, self.block_comment_pos)
+                if not self.next_line():
+                    break  # EOF, no closing brace
+                line = self.line
+                lines.append(line + '\n')
+                parts.append('\n')
+                first:bool = True
+                # token types and text only (no token values are parsed)
+                while not self.is_eol:
+                    if self._next_token_handle_ws(self.pos) is not None:
+                        continue  # whitespace or EOL
+                    m:Match = RE_TOKEN.match(line, self.pos)
+                    if m is None:
+                        raise Exception(f'failed to find token type at line {self.line_num}, pos {self.pos+1}')
+                    group, text = m.lastgroup, m[0]
+                    self.pos = m.end()
+                    if first:
+                        if group == 'PUNCTUATION' and text == '}':
+                            key = self.function_key_of(parts)
+                            stop = True
+                            break
+                        if group == 'KEYWORD' and KEYWORD_TABLE.get(text, (None,))[0] is TokenKind.DIRECTIVE:
+                            stop = True
+                            break  # directives change assembler state, never cached
+                        first = False
+                    self.append_key_part(parts, m)
+        except Exception:
+            key = None  # reported when parsed normally
+
+        entry = self.function_cache.get(key, None) if key is not None else None
+        if entry is not None:
+            # splice cached bytecode, then parse the closing brace line normally
+            self.function_hits += 1
+            bytecode, max_line = entry
+            self.write_bytecode(bytecode)
+            self._bytecode_pos += len(bytecode)
+            self.max_line = max(self.max_line, max_line)
+            self.function_cache_entries[key] = entry
+            self.line_num, self.is_eof, self.is_block_comment, self.block_comment_line, self.block_comment_pos = line_state
+            self.pending_lines.append(lines[-1])
+        else:
+            if key is not None:
+                self.function_misses += 1
+            self.function_key = key
+            self.line_num, self.is_eof, self.is_block_comment, self.block_comment_line, self.block_comment_pos = start_state
+            self.pending_lines.extend(lines)
+
+    def append_key_part(self, parts:List[str], m:Match) -> NoReturn:
+        """Append a token match to function key parts (resources include their resolved string)
+        """
+        if m.lastgroup == 'RESOURCE':
+            name = m['resource_name'] or m['resource_explicit']
+            parts.append(repr(self.resource_dict.get(name, None) if self.resource_dict is not None else None))
+        parts.append(m.lastgroup + m[0])
+
+    @classmethod
+    def function_key_of(cls, parts:List[str]) -> str:
+        """Return the function cache key of a function body's token stream parts
+        """
+        return hashlib.sha1('\x00'.join(parts).encode('utf-8')).hexdigest()
 
     def define_label(self, label_name:str, instr:Instruction):
         # clearing label from current_labels is handled by the parent caller
         self.labels[label_name] = instr
 
-        targets = self.unresolved_targets.get(label_name, None)
-        if targets is None:
-            return # nothing to do
-        
-        for target_instr in targets:
-            for operand in target_instr.opcode.encoding:
-                if operand == 'j':
-                    # jump offset
-                    jump = target_instr.jump_target
-                    if isinstance(jump, str) and jump == label_name:
-                        # if target_instr.jump_target == label_name:
-                        target_instr.jump_target = instr
-                        target_instr.jump_offset = instr.offset - target_instr.offset - target_instr.size
-                elif operand == 'c':
-                    # case offsets
-                    for i,case in enumerate(target_instr.switch_targets):
-                        if isinstance(case, str) and case == label_name:
-                            target_instr.switch_targets[i] = instr
-                            target_instr.switch_cases[i] = instr.offset - target_instr.offset - 4 - 4 - (i * 4)
-        
-        del self.unresolved_targets[label_name]
-
     def parse_instruction(self, opcode_token:ParseToken):
         opcode = opcode_token.value
         instr:Instruction = Instruction(opcode, self.bytecode_pos)
         for label_name in self.current_labels:
             self.define_label(label_name, instr)
         self.current_labels.clear()
+        targets:List[Tuple[str,int]] = []  # (label name, case index) operands to add to fixups
 
         # for operand in instr.opcode.encoding:
         # opcode_value:int = reader.unpackone('<H')
@@ -1288,18 +1414,16 @@ class MjILAssembler:
                     instr.jump_offset = token.value
                     instr.jump_target = None
                 else:
-                    label_instr = self.define_target(token.value, instr)
-                    if label_instr is not None:
-                        instr.jump_offset = label_instr.offset - instr.offset - instruction_size(instr)
-                        instr.jump_target = label_instr
-                    else:
-                        instr.jump_target = token.value
+                    instr.jump_offset = 0  # placeholder until fixups are patched
+                    instr.jump_target = token.value
+                    targets.append((token.value, -1))
             elif operand == 'l':
                 # line number
                 if token.type is not TokenType.LINE_NUMBER:
                     raise Exception(f'expected line number operand #NNNN, not token {token!r}')
                 instr.line_number = token.value
                 self.max_line = max(self.max_line, instr.line_number)
+                self.function_max_line = max(self.function_max_line, instr.line_number)
             elif operand == 'c':
                 # switch case table
                 # cases = []
@@ -1333,13 +1457,9 @@ class MjILAssembler:
                                 instr.switch_cases.append(token.value)
                                 instr.switch_targets.append(None)
                             else:
-                                label_instr = self.define_target(token.value, instr)
-                                if label_instr is not None:
-                                    instr.switch_cases.append(label_instr.offset - instr.offset - 4 - 4 - (i * 4))
-                                    instr.switch_targets.append(label_instr)
-                                else:
-                                    instr.switch_cases.append(None)
-                                    instr.switch_targets.append(token.value)
+                                instr.switch_cases.append(0)  # placeholder until fixups are patched
+                                instr.switch_targets.append(token.value)
+                                targets.append((token.value, i))
                         i += 1
                     else:
                         raise Exception(f'unexpected token during switch case list operand parsing, got {token!r}')
@@ -1358,6 +1478,14 @@ class MjILAssembler:
         instr.size = instruction_size(instr) # calculates size of variable-length operands
         self.require_eol(token)
         self.instructions.append(instr)
+        self._bytecode_pos = instr.offset + instr.size
+        if targets:
+            for label_name,case in targets:
+                if case == -1:  # jump offset is the last operand
+                    pos = instr.offset + instr.size - 4
+                else:  # opcode, case count, cases...
+                    pos = instr.offset + 2 + 2 + (case * 4)
+                self.fixups.append(Fixup(pos, label_name, instr, case))
 
         # RE_COMMENT_INLINE  = re.compile(r"^(\/\*[^\n]*?\*\/)")
         # token:ParseToken = self.parse_token_skipws()
@@ -1387,13 +1515,63 @@ class MjILAssembler:
     def read(self):
         self.open() #self.filename, encoding=self.encoding)
         # this is stuuupiiiiiiiid
-        self.parse_line()
-        while not self.is_eof:
+        with stats.phase('parse'):
             self.parse_line()
+            while not self.is_eof:
+                self.parse_line()
         self.close()
         self.bytecode_offset = calcsize(f'<16sIII{len(self.functions)}I')
         self.bytecode_size = self.bytecode_pos
         self.line_count = self.max_line if self.readmark_directive else 0
+        if self.current_function is not None:
+            # function without a closing brace at EOF, its labels still apply
+            with stats.phase('encode'):
+                self.emit_function()
+        stats.add('lines_parsed', self.line_num)
+        stats.add('functions_assembled', len(self.functions) - self.function_hits)  # spliced functions aren't re-encoded
+        if self.function_cache is not None:
+            stats.add('function_cache_hits', self.function_hits)
+            stats.add('function_cache_misses', self.function_misses)
+
+    def write_bytecode(self, data:bytes):
+        if self.bytecode_writer is not None:
+            self.bytecode_writer.write(data)
+        else:
+            self.bytecode += data
+        self.bytecode_written += len(data)
+
+    def emit_function(self):
+        """Pass two for the current function: encode its instructions into a preallocated buffer, patch its fixups,
+        and write the bytecode (instructions are dropped afterwards when streaming to bytecode_writer)
+        """
+        start = self.bytecode_written  # function offset (cached functions are already written)
+        instructions = self.instructions
+        bytecode = bytearray(self.bytecode_pos - start)
+        for i in range(self.function_instructions, len(instructions)):
+            instr = instructions[i]
+            bytecode[instr.offset - start:instr.offset - start + instr.size] = instr.encode()
+        labels = self.labels
+        for pos, label, instr, case in self.fixups:
+            label_instr = labels.get(label, None)
+            if label_instr is None:
+                raise Exception(f'unresolved target {label!r} with no label found at {instr.offset:05x}: {instr.opcode.mnemonic}')
+            offset = label_instr.offset - pos - 4
+            pack_into('<i', bytecode, pos - start, offset)
+            if case == -1:
+                instr.jump_offset = offset
+                instr.jump_target = label_instr
+            else:
+                instr.switch_cases[case] = offset
+                instr.switch_targets[case] = label_instr
+        self.fixups.clear()
+        labels.clear()
+        if self.function_key is not None:
+            self.function_cache_entries[self.function_key] = (bytes(bytecode), self.function_max_line)
+            self.function_key = None
+        if bytecode:
+            self.write_bytecode(bytecode)
+        if self.bytecode_writer is not None:
+            del instructions[self.function_instructions:]
 
 
 # class Assembler:
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""Majiro compact binary IL interchange format (.mjb)
+"""
+
+__version__ = '0.1.0'
+__date__    = '2021-05-10'
+__author__  = 'Robert Jordan'
+
+__all__ = ['BinaryScript', 'write_binary', 'pack_binary', 'read_binary', 'BINARY_EXT', 'BINARY_MAGIC']
+
+#######################################################################################
+
+## BINARY IL FORMAT ##
+#
+# all integers are little-endian, every section starts 4-byte aligned (zero padded)
+#
+# HEADER: <8sHH16sIIIIIIIIIII
+#  magic, version, reserved,
+#  signature, main_offset, line_count, bytecode_offset, bytecode_size,  (MjoScript header)
+#  entry_count, function_count, block_count, instruction_count, string_count, value_count, name_count
+#
+# ENTRIES:      entry_count    * <II  (name_hash, offset)  function table of the .mjo script
+# FUNCTIONS:    function_count * <IIIIII  (CFG annotations)
+#  name_hash, first_instruction_index, last_instruction_index, first_block, block_count,
+#  parameter_types (value pool index of [count, *types], or NONE)
+# BLOCKS:       block_count u32 first_instruction_index, then block_count u8 flags (bit 0 = destructor block)
+# INSTRUCTIONS: columns of instruction_count entries each:
+#  u16 opcode value, u32 offset, u32 operand0, u32 operand1, u32 operand2
+#  operands follow the opcode encoding order ('0' excluded), unused operands are 0:
+#   t, c: value pool index of [count, *values]     s: string pool index
+#   i, j, o: two's complement 32-bit               r: IEEE 754 single bits
+#   f, h, a, l: unsigned value
+# STRINGS:      string_count+1 u32 end offsets (first is 0), then UTF-8 data
+# VALUES:       value_count u32 (type lists, switch cases, and parameter types)
+# NAMES:        name_count * <III  (hash, kind, string pool index)  known hash names in the script
+#  kind: 0 = function, 1 = syscall, 2 = variable, 3 = group
+#
+# NONE: 0xffffffff
+
+import io, mmap, struct, sys
+from array import array
+from struct import calcsize, pack, unpack_from
+from typing import Dict, Iterator, List, NoReturn, Optional, Tuple, Union  # for hinting in declarations
+
+from ._util import signed_i
+from .flags import MjoFlags, MjoType
+from .opcodes import Opcode
+from .script import FunctionEntry, Instruction, MjoScript
+from .analysis import ControlFlowGraph
+from . import known_hashes
+
+
+BINARY_EXT:str = '.mjb'
+BINARY_MAGIC:bytes = b'MJILBIN\x00'
+BINARY_VERSION:int = 1
+
+HEADER_FMT:str = '<8sHH16sIIIIIIIIIII'
+NONE:int = 0xffffffff
+
+NAME_KINDS:tuple = ('function', 'syscall', 'variable', 'group')
+BLOCK_DTOR:int = 0x1
+
+# integer arrays are stored little-endian, and byteswapped on load for big-endian hosts
+_SWAP:bool = sys.byteorder != 'little'
+
+
+def _align4(size:int) -> int:
+    return (size + 3) & ~3
+
+def _name_tables() -> tuple:
+    return (known_hashes.FUNCTIONS, known_hashes.SYSCALLS, known_hashes.VARIABLES, known_hashes.GROUPS)
+
+
+#region ## WRITER ##
+
+class _Pools:
+    """String and value pools shared by a single binary script
+    """
+    def __init__(self):
+        self.strings:List[str] = []
+        self.string_indices:Dict[str, int] = {}
+        self.values:array = array('I')
+
+    def string(self, value:str) -> int:
+        index = self.string_indices.get(value, None)
+        if index is None:
+            index = self.string_indices[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+    def sequence(self, values) -> int:
+        index = len(self.values)
+        self.values.append(len(values))
+        self.values.extend(v & 0xffffffff for v in values)
+        return index
+
+def _pack_operands(instruction:Instruction, pools:_Pools) -> List[int]:
+    operands:List[int] = []
+    for operand in instruction.opcode.encoding:
+        if   operand == 't': operands.append(pools.sequence([t.value for t in instruction.type_list]))
+        elif operand == 's': operands.append(pools.string(instruction.string))
+        elif operand == 'f': operands.append(int(instruction.flags))
+        elif operand == 'h': operands.append(instruction.hash)
+        elif operand == 'o': operands.append(instruction.var_offset & 0xffffffff)
+        elif operand == 'i': operands.append(instruction.int_value & 0xffffffff)
+        elif operand == 'r': operands.append(struct.unpack('<I', pack('<f', instruction.float_value))[0])
+        elif operand == 'a': operands.append(instruction.argument_count)
+        elif operand == 'j': operands.append(instruction.jump_offset & 0xffffffff)
+        elif operand == 'l': operands.append(instruction.line_number)
+        elif operand == 'c': operands.append(pools.sequence(instruction.switch_cases))
+    return operands
+
+def _le(values:array) -> bytes:
+    if _SWAP:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def pack_binary(script:MjoScript, cfg:ControlFlowGraph) -> bytes:
+    """Serialize a script with its control flow graph and known hash names to binary IL
+    """
+    pools = _Pools()
+    instructions:List[Instruction] = script.instructions
+
+    # instruction columns
+    opcodes = array('H', (instr.opcode.value for instr in instructions))
+    offsets = array('I', (instr.offset for instr in instructions))
+    columns = (array('I', bytes(4 * len(instructions))), array('I', bytes(4 * len(instructions))), array('I', bytes(4 * len(instructions))))
+    hashes:set = set()
+    for i,instr in enumerate(instructions):
+        for column,value in zip(columns, _pack_operands(instr, pools)):
+            column[i] = value
+        if instr.is_syscall or instr.is_call or instr.is_load or instr.is_store:
+            hashes.add(instr.hash)
+        elif instr.opcode.mnemonic == 'ldc.i':
+            hashes.add(instr.int_value & 0xffffffff)
+
+    # CFG annotations
+    functions = io.BytesIO()
+    block_starts = array('I')
+    block_flags = array('B')
+    for function in cfg.functions:
+        name_hash, first_index, last_index, starts, dtor_starts, parameter_types = cfg.function_boundaries(function)
+        params_index = pools.sequence(parameter_types) if parameter_types is not None else NONE
+        functions.write(pack('<IIIIII', name_hash, first_index, last_index, len(block_starts), len(starts), params_index))
+        block_starts.extend(starts)
+        block_flags.extend((BLOCK_DTOR if s in dtor_starts else 0) for s in starts)
+        hashes.add(name_hash)
+
+    # known hash names
+    names = io.BytesIO()
+    name_count:int = 0
+    tables = _name_tables()
+    for value in sorted(hashes):
+        for kind,table in enumerate(tables):
+            name = table.get(value, None)
+            if name is not None:
+                names.write(pack('<III', value, kind, pools.string(name)))
+                name_count += 1
+
+    # string pool
+    string_data = [s.encode('utf-8') for s in pools.strings]
+    string_ends = array('I', [0])
+    for data in string_data:
+        string_ends.append(string_ends[-1] + len(data))
+
+    header = pack(HEADER_FMT, BINARY_MAGIC, BINARY_VERSION, 0,
+                  script.signature, script.main_offset, script.line_count, script.bytecode_offset, script.bytecode_size,
+                  len(script.functions), len(cfg.functions), len(block_starts), len(instructions), len(string_data), len(pools.values), name_count)
+    sections = [
+        header,
+        b''.join(pack('<II', fn.name_hash, fn.offset) for fn in script.functions),
+        functions.getvalue(),
+        _le(block_starts), block_flags.tobytes(),
+        _le(opcodes), _le(offsets), _le(columns[0]), _le(columns[1]), _le(columns[2]),
+        _le(string_ends), b''.join(string_data),
+        _le(pools.values),
+        names.getvalue(),
+    ]
+    return b''.join(s + bytes(_align4(len(s)) - len(s)) for s in sections)
+
+def write_binary(script:MjoScript, cfg:ControlFlowGraph, writer:io.BufferedWriter) -> int:
+    """Write a script in binary IL format, returns the number of bytes written
+    """
+    return writer.write(pack_binary(script, cfg))
+
+#endregion
+
+#region ## READER ##
+
+class BinaryScript:
+    """Memory-mapped binary IL script with zero-copy columnar access
+
+    instruction columns are memoryviews into the mapped file, strings are decoded on access,
+    use to_script() for a full MjoScript and lazy ControlFlowGraph.
+    """
+    def __init__(self, data:Union[bytes, mmap.mmap], *, owner:object=None):
+        self._data = data
+        self._owner = owner  # keeps the mapped file open
+        view = memoryview(data)
+        self._view:memoryview = view
+        fields = unpack_from(HEADER_FMT, data, 0)
+        if fields[0] != BINARY_MAGIC:
+            raise Exception('Invalid binary IL signature {!r}'.format(fields[0]))
+        if fields[1] != BINARY_VERSION:
+            raise Exception('Unsupported binary IL version {:d}'.format(fields[1]))
+        (_, _, _, self.signature, self.main_offset, self.line_count, self.bytecode_offset, self.bytecode_size,
+         self.entry_count, self.function_count, self.block_count, self.instruction_count, self.string_count, self.value_count, self.name_count) = fields
+
+        pos = _align4(calcsize(HEADER_FMT))
+        def section(size:int) -> memoryview:
+            nonlocal pos
+            start, pos = pos, pos + _align4(size)
+            return view[start:start + size]
+        def column(count:int, typecode:str, itemsize:int):
+            raw = section(count * itemsize)
+            if _SWAP and itemsize > 1:
+                values = array(typecode, raw.tobytes())
+                values.byteswap()
+                return values
+            return raw.cast(typecode)
+        n:int = self.instruction_count
+        self._entries:memoryview = section(self.entry_count * 8)
+        self._functions:memoryview = section(self.function_count * 24)
+        self.block_starts = column(self.block_count, 'I', 4)
+        self.block_flags = column(self.block_count, 'B', 1)
+        self.opcodes = column(n, 'H', 2)
+        self.offsets = column(n, 'I', 4)
+        self.operands = (column(n, 'I', 4), column(n, 'I', 4), column(n, 'I', 4))
+        self._string_ends = column(self.string_count + 1, 'I', 4)
+        self._string_data:memoryview = section(self._string_ends[-1])
+        self.values = column(self.value_count, 'I', 4)
+        self._names:memoryview = section(self.name_count * 12)
+
+    @classmethod
+    def open(cls, filename:str) -> 'BinaryScript':
+        """Memory-map a binary IL file (read-only)
+        """
+        with open(filename, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mapped, owner=mapped)
+
+    def close(self) -> NoReturn:
+        # release all views before closing the mapping
+        for name in ('_entries', '_functions', 'block_starts', 'block_flags', 'opcodes', 'offsets', '_string_ends', '_string_data', 'values', '_names', '_view'):
+            value = getattr(self, name, None)
+            if isinstance(value, memoryview):
+                value.release()
+        for value in getattr(self, 'operands', ()):
+            if isinstance(value, memoryview):
+                value.release()
+        if self._owner is not None:
+            self._owner.close()
+            self._owner = None
+
+    def __enter__(self) -> 'BinaryScript':
+        return self
+    def __exit__(self, exc_type, exc_value, traceback) -> NoReturn:
+        self.close()
+
+    #region ## POOLS ##
+
+    def string(self, index:int) -> str:
+        ends = self._string_ends
+        return str(self._string_data[ends[index]:ends[index + 1]], 'utf-8')
+
+    def sequence(self, index:int) -> List[int]:
+        values = self.values
+        return list(values[index + 1:index + 1 + values[index]])
+
+    def names(self) -> Iterator[Tuple[int, str, str]]:
+        """Yield (hash, kind, name) for all known hash names stored in the script
+        """
+        for value, kind, index in struct.iter_unpack('<III', self._names):
+            yield (value, NAME_KINDS[kind], self.string(index))
+
+    #endregion
+
+    #region ## CONVERSION ##
+
+    def instruction(self, i:int) -> Instruction:
+        opcode:Opcode = Opcode.BYVALUE[self.opcodes[i]]
+        instruction:Instruction = Instruction(opcode, self.offsets[i])
+        operands = iter((self.operands[0][i], self.operands[1][i], self.operands[2][i]))
+        for operand in opcode.encoding:
+            if operand == '0':
+                continue
+            value = next(operands)
+            if   operand == 't': instruction.type_list = [MjoType(t) for t in self.sequence(value)]
+            elif operand == 's': instruction.string = self.string(value)
+            elif operand == 'f': instruction.flags = MjoFlags(value)
+            elif operand == 'h': instruction.hash = value
+            elif operand == 'o': instruction.var_offset = signed_i(value)
+            elif operand == 'i': instruction.int_value = signed_i(value)
+            elif operand == 'r': instruction.float_value = struct.unpack('<f', pack('<I', value))[0]
+            elif operand == 'a': instruction.argument_count = value
+            elif operand == 'j': instruction.jump_offset = signed_i(value)
+            elif operand == 'l': instruction.line_number = value
+            elif operand == 'c': instruction.switch_cases = [signed_i(c) for c in self.sequence(value)]
+        return instruction
+
+    def boundaries(self) -> List[tuple]:
+        """Return the ControlFlowGraph.function_boundaries() of all functions
+        """
+        boundaries:List[tuple] = []
+        starts, flags = self.block_starts, self.block_flags
+        for name_hash, first_index, last_index, first_block, block_count, params_index in struct.iter_unpack('<IIIIII', self._functions):
+            blocks = range(first_block, first_block + block_count)
+            boundaries.append((name_hash, first_index, last_index,
+                               tuple(starts[b] for b in blocks),
+                               tuple(starts[b] for b in blocks if flags[b] & BLOCK_DTOR),
+                               (tuple(self.sequence(params_index)) if params_index != NONE else None)))
+        return boundaries
+
+    def to_script(self) -> Tuple[MjoScript, ControlFlowGraph]:
+        """Return the decoded script and its lazy control flow graph
+        """
+        instructions:List[Instruction] = [self.instruction(i) for i in range(self.instruction_count)]
+        # instruction sizes are the distance to the next instruction
+        for instr, next_instr in zip(instructions, instructions[1:]):
+            instr.size = next_instr.offset - instr.offset
+        if instructions:
+            instructions[-1].size = self.bytecode_size - instructions[-1].offset
+        functions = [FunctionEntry(*fn) for fn in struct.iter_unpack('<II', self._entries)]
+        script = MjoScript(self.signature, self.main_offset, self.line_count, self.bytecode_offset, self.bytecode_size, functions, instructions)
+        return (script, ControlFlowGraph.build_from_boundaries(script, self.boundaries()))
+
+    #endregion
+
+def read_binary(filename:str) -> Tuple[MjoScript, ControlFlowGraph]:
+    """Read a binary IL file into a script and its lazy control flow graph
+    """
+    with BinaryScript.open(filename) as binary:
+        return binary.to_script()
+
+#endregion
+
+
+del Dict, Iterator, List, NoReturn, Optional, Tuple, Union  # cleanup declaration-only imports
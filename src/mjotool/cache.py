@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""Majiro persistent content-addressed script analysis cache
+"""
+
+__version__ = '0.1.0'
+__date__    = '2021-05-10'
+__author__  = 'Robert Jordan'
+
+__all__ = ['ScriptCache', 'FunctionCache', 'default_cache_dir']
+
+#######################################################################################
+
+## CACHE ENTRY FORMAT ##
+#
+# file name: SHA-1 hex digest of (CACHE_SALT + .mjo file bytes) + ".mjc"
+# contents:  CACHE_MAGIC + marshal.dumps(ENTRY)
+#
+# ENTRY: (header, functions, instructions, boundaries)
+#  header:       (signature, main_offset, line_count, bytecode_offset, bytecode_size)
+#  functions:    ((name_hash, offset), ...)
+#  instructions: ((opcode_value, offset, *operands), ...)  operands in opcode encoding order ('0' excluded)
+#  boundaries:   (ControlFlowGraph.scan_function(), ...)  same as function_boundaries()
+#
+# entries are evicted least-recently-used first (by file mtime, which is touched on every hit),
+#  the directory is scanned on the first write of a process, and when the tracked size crosses max_size
+
+## FUNCTION CACHE FORMAT ##
+#
+# file name: SHA-1 hex digest of (CACHE_SALT + "function\0" + absolute .mjil path) + ".mjf"
+# contents:  FUNCTION_CACHE_MAGIC + marshal.dumps({KEY: (bytecode, max_line), ...})
+#
+# KEY: MjILAssembler.function_key_of() of a function body's token stream (see MjILAssembler.function_cache)
+# only functions in the last build of the .mjil file are kept
+
+import hashlib, io, marshal, os, sys
+from typing import Dict, List, NoReturn, Optional, Tuple  # for hinting in declarations
+
+from . import __version__ as _tool_version
+from .flags import MjoFlags, MjoType
+from .opcodes import Opcode
+from .script import FunctionEntry, Instruction, MjoScript
+from .analysis import ControlFlowGraph
+from . import stats
+
+
+CACHE_FORMAT:int = 2
+CACHE_MAGIC:bytes = b'MJOCACHE'
+CACHE_EXT:str = '.mjc'
+FUNCTION_CACHE_MAGIC:bytes = b'MJFCACHE'
+FUNCTION_CACHE_EXT:str = '.mjf'
+# tool version, cache format, and marshal/python version all invalidate entries
+CACHE_SALT:bytes = 'mjotool {!s} cache {:d} marshal {:d} py{:d}.{:d}\x00'.format(_tool_version, CACHE_FORMAT, marshal.version, *sys.version_info[:2]).encode('utf-8')
+
+DEFAULT_MAX_SIZE:int = 256 * 1024 * 1024  # 256 MiB
+EVICT_RATIO:float = 0.75  # eviction frees space down to this ratio of max_size, so it doesn't rescan on every write
+
+# total entry size of each cache directory known to this process (shared by all cache types,
+#  and by pickled copies sent to job workers), entries written by other processes aren't counted
+_DIRECTORY_SIZES:Dict[str, int] = {}
+
+
+def default_cache_dir() -> str:
+    """Return the default cache directory ($XDG_CACHE_HOME/mjotool or ~/.cache/mjotool)
+    """
+    base = os.environ.get('XDG_CACHE_HOME', None) or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'mjotool')
+
+
+#region ## SERIALIZATION ##
+
+def _pack_instruction(instruction:Instruction) -> tuple:
+    operands:list = [instruction.opcode.value, instruction.offset]
+    for operand in instruction.opcode.encoding:
+        if   operand == 't': operands.append(tuple(t.value for t in instruction.type_list))
+        elif operand == 's': operands.append(instruction.string)
+        elif operand == 'f': operands.append(int(instruction.flags))
+        elif operand == 'h': operands.append(instruction.hash)
+        elif operand == 'o': operands.append(instruction.var_offset)
+        elif operand == 'i': operands.append(instruction.int_value)
+        elif operand == 'r': operands.append(instruction.float_value)
+        elif operand == 'a': operands.append(instruction.argument_count)
+        elif operand == 'j': operands.append(instruction.jump_offset)
+        elif operand == 'l': operands.append(instruction.line_number)
+        elif operand == 'c': operands.append(tuple(instruction.switch_cases))
+    return tuple(operands)
+
+def _unpack_instruction(packed:tuple) -> Instruction:
+    opcode:Opcode = Opcode.BYVALUE[packed[0]]
+    instruction:Instruction = Instruction(opcode, packed[1])
+    i:int = 2
+    for operand in opcode.encoding:
+        if operand == '0':
+            continue
+        value = packed[i]
+        i += 1
+        if   operand == 't': instruction.type_list = [MjoType(t) for t in value]
+        elif operand == 's': instruction.string = value
+        elif operand == 'f': instruction.flags = MjoFlags(value)
+        elif operand == 'h': instruction.hash = value
+        elif operand == 'o': instruction.var_offset = value
+        elif operand == 'i': instruction.int_value = value
+        elif operand == 'r': instruction.float_value = value
+        elif operand == 'a': instruction.argument_count = value
+        elif operand == 'j': instruction.jump_offset = value
+        elif operand == 'l': instruction.line_number = value
+        elif operand == 'c': instruction.switch_cases = list(value)
+    return instruction
+
+def pack_script(script:MjoScript, boundaries:List[tuple]) -> bytes:
+    """Serialize a script's instructions and all function block boundaries (ControlFlowGraph.scan_boundaries())
+    """
+    header = (script.signature, script.main_offset, script.line_count, script.bytecode_offset, script.bytecode_size)
+    functions = tuple(tuple(fn) for fn in script.functions)
+    instructions = tuple(_pack_instruction(instr) for instr in script.instructions)
+    boundaries = tuple(boundaries)
+    return CACHE_MAGIC + marshal.dumps((header, functions, instructions, boundaries))
+
+def unpack_script(data:bytes) -> Tuple[MjoScript, ControlFlowGraph]:
+    """Deserialize a script and its lazy control flow graph
+    """
+    if not data.startswith(CACHE_MAGIC):
+        raise Exception('Invalid cache entry signature')
+    header, functions, packed_instructions, boundaries = marshal.loads(data[len(CACHE_MAGIC):])
+    instructions:List[Instruction] = [_unpack_instruction(p) for p in packed_instructions]
+    # instruction sizes are the distance to the next instruction
+    for instr, next_instr in zip(instructions, instructions[1:]):
+        instr.size = next_instr.offset - instr.offset
+    if instructions:
+        instructions[-1].size = header[4] - instructions[-1].offset
+    script = MjoScript(*header, [FunctionEntry(*fn) for fn in functions], instructions)
+    return (script, ControlFlowGraph.build_from_boundaries(script, boundaries))
+
+#endregion
+
+#region ## CACHE DIRECTORY ##
+
+class _CacheDirectory:
+    """Cache directory shared by all cache types (one size limit for all entries)
+    """
+    def __init__(self, directory:str=None, max_size:int=DEFAULT_MAX_SIZE):
+        self.directory:str = directory if directory is not None else default_cache_dir()
+        self.max_size:int = max_size
+        self.hits:int = 0
+        self.misses:int = 0
+
+    def _write(self, path:str, data:bytes) -> NoReturn:
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            replaced = os.stat(path).st_size
+        except OSError:
+            replaced = 0
+        temppath = '{}.{:d}.tmp'.format(path, os.getpid())
+        with open(temppath, 'wb') as f:
+            f.write(data)
+        os.replace(temppath, path)
+        size:Optional[int] = self.size
+        if size is None or size + len(data) - replaced > self.max_size:
+            self.evict()  # directory is only scanned once, and when max_size is crossed
+        else:
+            _DIRECTORY_SIZES[os.path.abspath(self.directory)] = size + len(data) - replaced
+
+    @property
+    def size(self) -> Optional[int]:
+        """Total size of entries known to this process, None before the first scan
+        """
+        return _DIRECTORY_SIZES.get(os.path.abspath(self.directory), None)
+
+    def evict(self) -> int:
+        """Scan the cache and remove least-recently-used entries if it's over max_size, returns number removed
+
+        entries are removed until the cache fits EVICT_RATIO of max_size.
+        """
+        entries:list = []
+        total:int = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith((CACHE_EXT, FUNCTION_CACHE_EXT)):
+                    st = entry.stat()
+                    entries.append((st.st_mtime_ns, st.st_size, entry.path))
+                    total += st.st_size
+        removed:int = 0
+        if total > self.max_size:
+            target:float = self.max_size * EVICT_RATIO
+            entries.sort()
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+        _DIRECTORY_SIZES[os.path.abspath(self.directory)] = total
+        return removed
+
+    def clear(self) -> NoReturn:
+        max_size, self.max_size = self.max_size, -1
+        try:
+            if os.path.isdir(self.directory):
+                self.evict()
+        finally:
+            self.max_size = max_size
+
+#endregion
+
+#region ## SCRIPT CACHE ##
+
+class ScriptCache(_CacheDirectory):
+    """On-disk cache of decoded scripts and basic block boundaries, keyed by .mjo content
+    """
+    @classmethod
+    def key(cls, data:bytes) -> str:
+        return hashlib.sha1(CACHE_SALT + data).hexdigest()
+
+    def path(self, key:str) -> str:
+        return os.path.join(self.directory, key + CACHE_EXT)
+
+    def load(self, filename:str) -> Tuple[MjoScript, ControlFlowGraph]:
+        """Read a .mjo script and its control flow graph, from cache when possible
+        """
+        with stats.phase('read'):
+            with open(filename, 'rb') as f:
+                data = f.read()
+        stats.add('bytes_read', len(data))
+        with stats.phase('cache'):
+            key = self.key(data)
+            entry = self.get(key)
+        if entry is not None:
+            self.hits += 1
+            stats.add('script_cache_hits')
+            return entry
+        self.misses += 1
+        stats.add('script_cache_misses')
+        script = MjoScript.disassemble_script(io.BytesIO(data))
+        # block boundaries are cheap to find, functions are still only built on first access
+        boundaries = ControlFlowGraph.scan_boundaries(script)
+        with stats.phase('cache'):
+            self._write(self.path(key), pack_script(script, boundaries))
+        return (script, ControlFlowGraph.build_from_boundaries(script, boundaries))
+
+    def get(self, key:str) -> Optional[Tuple[MjoScript, ControlFlowGraph]]:
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            entry = unpack_script(data)
+        except Exception:
+            return None  # corrupt or incompatible entry, overwritten by the next put
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key:str, script:MjoScript, cfg:ControlFlowGraph) -> NoReturn:
+        self._write(self.path(key), pack_script(script, [cfg.function_boundaries(fn) for fn in cfg.functions]))
+
+#endregion
+
+#region ## FUNCTION CACHE ##
+
+class FunctionCache(_CacheDirectory):
+    """On-disk cache of assembled function bodies for each .mjil file, keyed by token stream
+    """
+    @classmethod
+    def key(cls, filename:str) -> str:
+        return hashlib.sha1(CACHE_SALT + b'function\x00' + os.path.abspath(filename).encode('utf-8')).hexdigest()
+
+    def path(self, key:str) -> str:
+        return os.path.join(self.directory, key + FUNCTION_CACHE_EXT)
+
+    def get(self, filename:str) -> Dict[str, Tuple[bytes, int]]:
+        """Return the function entries of the last build of an .mjil file (empty if none)
+        """
+        path = self.path(self.key(filename))
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return {}
+        if not data.startswith(FUNCTION_CACHE_MAGIC):
+            return {}
+        try:
+            entries = marshal.loads(data[len(FUNCTION_CACHE_MAGIC):])
+        except Exception:
+            return {}  # corrupt or incompatible entry, overwritten by the next put
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        return entries
+
+    def put(self, filename:str, entries:Dict[str, Tuple[bytes, int]]) -> NoReturn:
+        self._write(self.path(self.key(filename)), FUNCTION_CACHE_MAGIC + marshal.dumps(entries))
+
+#endregion
+
+
+del Dict, List, NoReturn, Optional, Tuple  # cleanup declaration-only imports
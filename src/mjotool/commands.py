@@ -0,0 +1,855 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""Majiro script IL tool commands (print, disassemble, assemble, convert, export, cross-reference)
+"""
+
+__version__ = '0.1.0'
+__date__    = '2021-04-04'
+__author__  = 'Robert Jordan'
+__credits__ = '''Original C# implementation by AtomCrafty - 2021
+Converted to Python library by Robert Jordan - 2021
+'''
+
+#######################################################################################
+
+import copy, csv, io, json, os, re, sys, time
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, NoReturn, Optional, Set, TextIO, Tuple, Union  # for hinting in declarations
+from ._util import DummyColors, Colors
+from .script import MjoScript, ILFormat
+from .analysis import ControlFlowGraph
+from .binary import write_binary, read_binary, BINARY_EXT
+from .cache import ScriptCache, FunctionCache
+from .manifest import BuildManifest, file_digest, fingerprint, DISASM_MANIFEST, ASM_MANIFEST
+from .records import iter_instruction_records, write_jsonl
+from .resources import RESOURCE_LOADER
+from .stats import Stats, StatsConfig, measure, aggregate, format_stats
+from .walk import FileEntry, walk_files
+from .writer import iter_script_lines, write_lines, open_il_writer
+from .xref import XRefIndex
+from . import crypt
+from . import known_hashes
+from . import stats
+
+## runtime imports (only needed by --asm):
+# from .assembler import MjILAssembler  # used in parse_script()
+# import tempfile                       # used in assemble_file()
+
+
+## READ / ANALYZE SCRIPT ##
+
+def read_script(filename:str) -> MjoScript:
+    """Read and return a MjoScript from file
+    """
+    with open(filename, 'rb') as f:
+        script = MjoScript.disassemble_script(f)
+        stats.add('bytes_read', f.tell())
+        return script
+
+def load_script(filename:str, cache:Optional[ScriptCache]=None) -> Tuple[MjoScript, ControlFlowGraph]:
+    """Read and return a MjoScript and its (lazy) analysis, using the analysis cache when passed
+
+    binary IL (.mjb) files are loaded directly (never cached)
+    """
+    if os.path.splitext(filename)[1].lower() == BINARY_EXT:
+        return read_binary(filename)
+    if cache is not None:
+        return cache.load(filename)
+    script = read_script(filename)
+    return (script, analyze_script(script))
+
+def analyze_script(script:MjoScript) -> ControlFlowGraph:
+    """Return the analysis of a script's control flow, blocks, functions, etc.
+
+    argument can also be a filename
+    """
+    if isinstance(script, str):  # is argument filename?
+        script = read_script(script)
+    return ControlFlowGraph.build_from_script(script)
+
+def parse_script(filename:Union[str, TextIO], function_cache:Optional[Dict[str, Tuple[bytes, int]]]=None, bytecode_writer:Optional[BinaryIO]=None) -> 'MjILAssembler':
+    """Returns an assembler after parsing an .mjil assembler language file (or text stream)
+    """
+    from .assembler import MjILAssembler
+    return MjILAssembler(filename, function_cache=function_cache, bytecode_writer=bytecode_writer)
+
+
+def parse_function_filter(value:str, group:Optional[str]=None) -> int:
+    """Return the name hash for a --function filter argument
+
+    $XXXXXXXX or 0xXXXXXXXX is a literal hash, anything else is a function name,
+    where the group directive is appended to names without an explicit group.
+    """
+    m = re.match(r"^(?:\$|0[Xx])([0-9A-Fa-f]{8})$", value)
+    if m:
+        return int(m[1], 16)
+    name = value
+    if name.startswith('${') and name.endswith('}'):
+        name = name[2:-1]  # explicit inline hash syntax
+    if not name.startswith('$'):
+        name = '$' + name  # usercall names always have a '$' prefix
+    if name.find('@', 1) == -1:
+        if group is None:
+            raise ValueError(f'Missing group for function name {value!r} when no group directive is specified')
+        name += f'@{group}'
+    return crypt.hash32(name)
+
+def select_functions(cfg:ControlFlowGraph, function_hashes:Optional[Set[int]]=None) -> list:
+    """Return all functions in the control flow graph matching the filter hashes (or all when None)
+
+    unselected functions are never analyzed when the control flow graph is lazy
+    """
+    if function_hashes is None:
+        return cfg.functions
+    return [fn for fn in cfg.functions if fn.name_hash in function_hashes]
+
+## PRINT SCRIPT ##
+
+def print_script(filename:str, script:MjoScript, *, options:ILFormat=ILFormat.DEFAULT, function_hashes:Optional[Set[int]]=None, cfg:ControlFlowGraph=None, writer:TextIO=None) -> int:
+    """Print analyzed script IL instructions and blocks to console (PRINTS A LOT OF LINE)
+
+    writer defaults to sys.stdout
+
+    returns the number of lines printed
+    """
+    if cfg is None:
+        cfg = analyze_script(script)
+    options.set_address_len(script.bytecode_size)
+
+    lines = iter_script_lines(os.path.basename(filename), script, cfg, options=options,
+                              functions=select_functions(cfg, function_hashes))
+    with stats.phase('format'):
+        count = write_lines(sys.stdout if writer is None else writer, lines)
+    stats.add('lines_formatted', count)
+    return count
+
+
+## WRITE SCRIPT ##
+
+def disassemble_script(filename:str, script:MjoScript, outfilename:str, *, options:ILFormat=ILFormat.DEFAULT, function_hashes:Optional[Set[int]]=None, cfg:ControlFlowGraph=None) -> int:
+    """Write analyzed script IL instructions and blocks to .mjil file
+
+    returns the number of lines written
+    """
+    options.color = False
+    options.set_address_len(script.bytecode_size)
+    if cfg is None:
+        cfg = analyze_script(script)
+
+    resfile = reswriter = None
+    with open_il_writer(outfilename) as writer:
+      try:
+        on_resource = None
+        if options.resfile_directive is not None:
+            #respath = os.path.join(os.path.dirname(filename), options.resfile_directive)
+            resfile = open(options._resfile_path or options.resfile_directive, 'wt+', encoding='utf-8')
+            # sigh, no way to force quotes for one line
+            # lineterminator='\n' is required to stop double-line termination caused by default behavior of "\r\n" on Windows
+            reswriter = csv.writer(resfile, quoting=csv.QUOTE_MINIMAL, delimiter=',', quotechar='"', lineterminator='\n')
+            reswriter.writerow(['Key','Value'])
+            on_resource = lambda key, instruction: reswriter.writerow([key, instruction.string])
+
+        lines = iter_script_lines(os.path.basename(filename), script, cfg, options=options,
+                                  functions=select_functions(cfg, function_hashes), on_resource=on_resource)
+        with stats.phase('format'):
+            count = write_lines(writer, lines)
+        stats.add('lines_formatted', count)
+        return count
+      finally:
+        if resfile is not None:
+            reswriter = None
+            resfile.close()
+
+def assemble_script(script:MjoScript, outfilename:str, bytecode:Union[bytes, BinaryIO, None]=None):
+    """Write script to .mjo file (bytecode from MjILAssembler skips re-encoding instructions)
+    """
+    with open(outfilename, 'wb+') as writer:
+        script.signature = MjoScript.SIGNATURE_DECRYPTED
+        script.assemble_script(writer, bytecode)
+
+def convert_binary(infilename:str, outfilename:str, *, options:ILFormat=ILFormat.DEFAULT, cache:Optional[ScriptCache]=None) -> NoReturn:
+    """Convert between binary IL (.mjb) and .mjo/.mjil files (direction chosen by file extensions)
+
+    .mjo/.mjil -> .mjb, .mjb -> .mjo/.mjil/.mjb
+    """
+    inext = os.path.splitext(infilename)[1].lower()
+    outext = os.path.splitext(outfilename)[1].lower()
+    if inext == '.mjil':
+        assembler = parse_script(infilename)
+        assembler.read()
+        script = assembler.script
+        cfg = ControlFlowGraph.build_from_script(script, lazy=False)
+    else:
+        script, cfg = load_script(infilename, cache)
+
+    if outext == BINARY_EXT:
+        with open(outfilename, 'wb') as writer:
+            write_binary(script, cfg, writer)
+    elif inext != BINARY_EXT:
+        raise Exception(f'--binary requires a {BINARY_EXT!r} input or output file, not {infilename!r} -> {outfilename!r}')
+    elif outext == '.mjil':
+        disassemble_script(infilename, script, outfilename, options=options, cfg=cfg)
+    elif outext == '.mjo':
+        # keep the signature stored in the binary IL (encrypted scripts stay encrypted)
+        with open(outfilename, 'wb+') as writer:
+            script.assemble_script(writer)
+    else:
+        raise Exception(f'--binary output file {outfilename!r} must have a \'.mjo\', \'.mjil\', or {BINARY_EXT!r} extension')
+
+
+def print_xrefs(xref:XRefIndex, name_hash:int, *, colors:dict=DummyColors):
+    """Print definitions, callers, and callees of a function hash in a cross-reference index
+    """
+    name = known_hashes.FUNCTIONS.get(name_hash, None) or known_hashes.SYSCALLS.get(name_hash, None)
+    name = '{BRIGHT}{BLUE}{!s}{RESET_ALL} '.format(name, **colors) if name is not None else ''
+    print('{BRIGHT}{YELLOW}function{RESET_ALL} {}{BRIGHT}{BLACK}${:08x}{RESET_ALL}'.format(name, name_hash, **colors))
+    for filename,offset in xref.definitions_of(name_hash):
+        print('  {DIM}{CYAN}defined:{RESET_ALL} {BRIGHT}{MAGENTA}{!s}{RESET_ALL} {BRIGHT}{BLACK}{:05x}{RESET_ALL}'.format(filename, offset, **colors))
+    for ref in xref.callers_of(name_hash):
+        caller = '${:08x}'.format(ref.caller) if ref.caller is not None else '?'
+        print('  {DIM}{CYAN}caller :{RESET_ALL} {BRIGHT}{MAGENTA}{!s}{RESET_ALL} {BRIGHT}{BLACK}{:05x}{RESET_ALL} {DIM}{YELLOW}{!s}{RESET_ALL} in {!s} ({:d})'.format(ref.filename, ref.offset, ref.kind, caller, ref.argument_count, **colors))
+    for ref in xref.callees_of(name_hash):
+        print('  {DIM}{CYAN}callee :{RESET_ALL} {BRIGHT}{MAGENTA}{!s}{RESET_ALL} {BRIGHT}{BLACK}{:05x}{RESET_ALL} {DIM}{YELLOW}{!s}{RESET_ALL} ${:08x} ({:d})'.format(ref.filename, ref.offset, ref.kind, ref.target, ref.argument_count, **colors))
+
+
+## BATCH JOBS ##
+
+# result of one file in a batch, lines is the number of IL lines printed/written (0 for assembly),
+#  output is the buffered console text (print jobs only),
+#  error is the formatted exception that stopped the file (or None),
+#  outputs/depends are the files written/read besides path (tracked by the build manifest),
+#  warnings are formatted diagnostics to report once after all files (i.e. duplicate resource keys),
+#  stats is the file's --stats record (Stats.as_dict), or None
+JobResult = namedtuple('JobResult', ('path', 'lines', 'output', 'error', 'outputs', 'depends', 'warnings', 'stats'), defaults=((), (), (), None))
+
+def prepare_options(base_options:ILFormat, filename:str=None, *, color:bool=...) -> ILFormat:
+    """Return a copy of the options for a single file (expanding '*' in the resfile directive)
+    """
+    new_options = copy.copy(base_options)
+    if color is not Ellipsis:
+        new_options.color = color
+    if new_options.resfile_directive and filename is not None:
+        new_options.resfile_directive = new_options.resfile_directive.replace('*', os.path.splitext(os.path.basename(filename))[0])
+        new_options._resfile_path = os.path.join(os.path.dirname(filename), new_options.resfile_directive)
+    return new_options
+
+def makedirs_for(filename:str):
+    """Create the parent directories of an output file
+    """
+    dirname = os.path.dirname(filename)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+
+def _format_error(ex:Exception) -> str:
+    return '{}: {!s}'.format(type(ex).__name__, ex)
+
+@contextmanager
+def measure_file(path:str, stats_config:Optional[StatsConfig], options:Optional[ILFormat]=None) -> Iterator[Optional[Stats]]:
+    """Measure one file for --stats (yields None when disabled), including known-hash cache hits/misses of options
+    """
+    with measure(path, stats_config) as record:
+        hash_info = options.resolver.cache_info() if (record is not None and options is not None) else None
+        try:
+            yield record
+        finally:
+            if hash_info is not None:
+                hits, misses = options.resolver.cache_info()
+                record.add('hash_cache_hits', hits - hash_info[0])
+                record.add('hash_cache_misses', misses - hash_info[1])
+
+def check_budget(record:Stats, *, colors:dict=DummyColors) -> int:
+    """Print an error if a single file exceeded its --mem-budget, returns the number of errors
+    """
+    error = record.budget_error()
+    if error is not None:
+        print_error(JobResult(record.name, 0, None, error), colors=colors)
+        return 1
+    return 0
+
+def add_bytes_written(record:Optional[Stats], outputs:Iterable[str]):
+    if record is not None:
+        record.add('bytes_written', sum(os.path.getsize(p) for p in outputs if os.path.isfile(p)))
+
+def print_job(path:str, options:ILFormat, *, function_hashes:Optional[Set[int]]=None, cache:Optional[ScriptCache]=None, buffered:bool=True, stats_config:Optional[StatsConfig]=None) -> JobResult:
+    """Print a single .mjo file, to a returned buffer or directly to the console
+    """
+    writer = io.StringIO() if buffered else sys.stdout
+    with measure_file(path, stats_config, options) as record:
+        try:
+            script, cfg = load_script(path, cache)
+            lines = print_script(path, script, options=options, function_hashes=function_hashes, cfg=cfg, writer=writer)
+        except Exception as ex:
+            error = _format_error(ex)
+            lines = 0
+        else:
+            error = None
+        if record is not None and buffered:
+            record.add('bytes_written', len(writer.getvalue().encode('utf-8')))
+    if error is None and record is not None:
+        error = record.budget_error()
+    return JobResult(path, lines, writer.getvalue() if buffered else None, error, stats=record.as_dict() if record is not None else None)
+
+def disassemble_job(path:str, outpath:str, options:ILFormat, *, function_hashes:Optional[Set[int]]=None, cache:Optional[ScriptCache]=None, stats_config:Optional[StatsConfig]=None) -> JobResult:
+    """Disassemble a single .mjo file to an .mjil file
+    """
+    with measure_file(path, stats_config, options) as record:
+        try:
+            makedirs_for(outpath)
+            if options.resfile_directive is not None:
+                makedirs_for(options._resfile_path or options.resfile_directive)
+            script, cfg = load_script(path, cache)
+            lines = disassemble_script(path, script, outpath, options=options, function_hashes=function_hashes, cfg=cfg)
+        except Exception as ex:
+            return JobResult(path, 0, None, _format_error(ex))
+        outputs = (outpath,)
+        if options.resfile_directive is not None:
+            outputs += (options._resfile_path or options.resfile_directive,)
+        add_bytes_written(record, outputs)
+    return JobResult(path, lines, None, record.budget_error() if record is not None else None, outputs, stats=record.as_dict() if record is not None else None)
+
+def assemble_file(path:str, outpath:str, function_cache:Optional[FunctionCache]=None) -> 'MjILAssembler':
+    """Assemble a single .mjil file ('-' for stdin) to an .mjo file, only re-encoding functions changed since the last cached build
+
+    bytecode is streamed to a temporary file one function at a time, so memory use doesn't grow with the script size.
+    """
+    if path == '-':
+        sys.stdin.reconfigure(encoding='utf-8')
+        source, function_cache = sys.stdin, None  # function cache is keyed by file path
+    else:
+        source = path
+    import tempfile
+    with tempfile.TemporaryFile() as spool:
+        assembler = parse_script(source, function_cache.get(path) if function_cache is not None else None, spool)
+        assembler.read()
+        spool.seek(0)
+        with stats.phase('write'):
+            assemble_script(assembler.script, outpath, spool)
+    if function_cache is not None:
+        function_cache.put(path, assembler.function_cache_entries)
+    return assembler
+
+def assemble_job(path:str, outpath:str, *, function_cache:Optional[FunctionCache]=None, stats_config:Optional[StatsConfig]=None) -> JobResult:
+    """Assemble a single .mjil file to an .mjo file
+    """
+    with measure_file(path, stats_config) as record:
+        try:
+            makedirs_for(outpath)
+            assembler = assemble_file(path, outpath, function_cache)
+        except Exception as ex:
+            return JobResult(path, 0, None, _format_error(ex), warnings=resource_warnings())
+        add_bytes_written(record, (outpath,))
+    depends = ()
+    if assembler.resfile_directive is not None:
+        depends = (os.path.join(os.path.dirname(path), assembler.resfile_directive),)
+    return JobResult(path, 0, None, record.budget_error() if record is not None else None, (outpath,), depends, resource_warnings(),
+                     record.as_dict() if record is not None else None)
+
+def resource_warnings() -> Tuple[str, ...]:
+    """Return formatted duplicate key diagnostics for resource files parsed since the last call (in this process)
+    """
+    return tuple('{!s}:{:d}: duplicate resource key {!r} (previously defined on line {:d})'.format(d.path, d.line, d.key, d.first_line)
+                 for d in RESOURCE_LOADER.pop_duplicates())
+
+PENDING_PER_JOB:int = 4  # tasks submitted ahead of the oldest unfinished task, per process
+
+def run_jobs(job:Callable[..., JobResult], tasks:Iterable[Tuple[Any, tuple]], *, jobs:int=1) -> Iterator[Tuple[Any, JobResult]]:
+    """Run job(*args) for each (tag, args) task, yields (tag, result) in input order
+
+    tasks are consumed lazily, so files are processed while a directory walk is still running.
+    jobs > 1 runs files in a process pool (job and all args must be picklable)
+    """
+    if jobs <= 1:
+        for tag, args in tasks:
+            yield (tag, job(*args))
+        return
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for tag, args in tasks:
+            pending.append((tag, executor.submit(job, *args)))
+            if len(pending) >= jobs * PENDING_PER_JOB:
+                tag, future = pending.popleft()
+                yield (tag, future.result())
+        while pending:
+            tag, future = pending.popleft()
+            yield (tag, future.result())
+
+def options_fingerprint(options:ILFormat, function_hashes:Optional[Set[int]]=None) -> str:
+    """Return the build manifest fingerprint of all options that affect disassembler output
+    """
+    values = {k: v for k,v in vars(options).items() if k[0] != '_' and k != 'color'}  # color is never written to file
+    return fingerprint(values, sorted(function_hashes) if function_hashes is not None else None)
+
+def plan_build(manifest:BuildManifest, entries:Iterable[FileEntry], fingerprint_of:Callable[[str], str], *, force:bool=False, seen:Optional[List[str]]=None) -> Iterator[Tuple[FileEntry, str, str]]:
+    """Yield the (entry, digest, fingerprint) of inputs that need to be rebuilt, unchanged inputs are skipped
+
+    the relpaths of all inputs (rebuilt or not) are appended to seen
+    """
+    for entry in entries:
+        if seen is not None:
+            seen.append(entry.relpath)
+        fp = fingerprint_of(entry.relpath)
+        digest = file_digest(entry.path)
+        if not force and manifest.is_current(entry.relpath, digest, fp):
+            continue
+        yield (entry, digest, fp)
+
+def output_path(outdir:str, relpath:str, ext:str) -> str:
+    """Return the output file path mirroring an input relpath in the output directory
+    """
+    return os.path.join(outdir, *(os.path.splitext(relpath)[0] + ext).split('/'))
+
+def print_error(result:JobResult, *, colors:dict=DummyColors):
+    print('{BRIGHT}{RED}[ERROR]{RESET_ALL} {BRIGHT}{MAGENTA}{!s}{RESET_ALL}: {!s}'.format(result.path, result.error, **colors))
+
+def write_stats_report(records:List[dict], format:str='text', filename:Optional[str]=None):
+    """Write the --stats report of all measured files (text or json), to the console or a file
+    """
+    writer = sys.stdout if filename is None else open(filename, 'wt', encoding='utf-8')
+    try:
+        if format == 'json':
+            json.dump({'files': records, 'total': aggregate(records)}, writer, indent=2)
+            writer.write('\n')
+        else:
+            for line in format_stats(records):
+                writer.write(line + '\n')
+    finally:
+        if filename is not None:
+            writer.close()
+    if filename is not None:
+        print('Stats:', filename)
+
+def print_warnings(warnings:Iterable[str], *, colors:dict=DummyColors):
+    for warning in warnings:
+        print('{BRIGHT}{YELLOW}[WARNING]{RESET_ALL} {!s}'.format(warning, **colors))
+
+def print_summary(files:int, errors:int, elapsed:float, lines:int=None, *, unit:str='lines', skipped:int=0, pad:int=0, colors:dict=DummyColors):
+    files_per_sec = (files / elapsed) if elapsed > 0 else 0
+    summary = 'Done ({:d} files, {:.1f} files/s'.format(files, files_per_sec)
+    if skipped:
+        summary += ', {:d} unchanged'.format(skipped)
+    if lines is not None:
+        lines_per_sec = (lines / elapsed) if elapsed > 0 else 0
+        summary += ', {0:d} {2}, {1:.0f} {2}/s'.format(lines, lines_per_sec, unit)
+    if errors:
+        summary += ', {BRIGHT}{RED}{:d} errors{RESET_ALL}'.format(errors, **colors)
+    print((summary + ')').ljust(pad))
+
+
+## OPTIONS ##
+
+# on|off flag characters for -H/--hash, -A/--alias, -F/--format (lowercase = on, uppercase = off)
+HASH_FLAGNAMES:dict = {
+    'a': 'annotations',
+    'k': 'known_hashes',
+    'i': 'inline_hash',
+    'e': 'explicit_inline_hash',
+    's': 'syscall_inline_hash',
+    'l': 'int_inline_hash',
+    'h': 'annotate_hex',
+    'g': 'implicit_local_groups',
+}
+ALIAS_FLAGNAMES:dict = {
+    'v': 'explicit_varoffset',
+    'm': 'modifier_aliases',
+    's': 'scope_aliases',
+    't': 'vartype_aliases',
+    'l': 'typelist_aliases',
+    'f': 'functype_aliases',
+    'd': 'explicit_dim0',
+}
+FORMAT_FLAGNAMES:dict = {
+    'a': 'address_labels',
+    'r': 'explicit_inline_resource',
+}
+
+
+def default_options(color:bool=True) -> ILFormat:
+    """Return the disassembler's default format options (before command line flags)
+    """
+    options:ILFormat = ILFormat()
+
+    ###########################################################################
+
+    options.color  = color  # color, disabled by __main__.disassemble_script() when outputting to file
+    options.braces = True  # function braces
+    options.annotations  = True  # annotations that describe either known hash names, or original hashed values
+    options.known_hashes = True  # check for known hash values
+    options.inline_hash  = True  # inline hash function $name / ${name} for known hash values
+    options.syscall_inline_hash  = True
+    options.int_inline_hash      = True   # ldc.i with a known hash value will use inline hash
+    options.explicit_inline_hash = False  # always use ${name} over $name
+    options.annotate_hex         = True  # hex annotations when inline hash is used
+    options.implicit_local_groups= True  # always exclude empty group name from known local names
+
+    options.explicit_varoffset   = False  # exclude -1 offset for non-locals
+    options.modifier_aliases     = False  # inc.x, dec.x, x.inc...
+    options.invert_aliases       = False  # (there are no aliases)
+    options.scope_aliases        = False  # persist, save (shorthands)
+    options.vartype_aliases      = False  # i, r, s, iarr... for variable type flags
+    options.functype_aliases     = False  # i, r, s, iarr... for function signatures
+    options.typelist_aliases     = False  # i, r, s, iarr... for type list operands
+    options.explicit_dim0        = False  # a useless feature (but it's legal)
+
+    options.address_labels       = True   # print bytecode address offset labels before opcodes
+    options.opcode_padding       = 13     # number of absolute padding added from start of opcode (always adds one space after)
+
+    options.explicit_inline_resource = True  # always use %{name} over %name
+    options.resfile_directive    = None   # output all `text` opcode string operands to csv resource file
+    options.group_directive      = None   # removes @GROUP for that matching this setting (DO NOT INCLUDE "@" in NAME)
+    # options.group_directive      = "CONSOLE"
+    return options
+
+
+## RUN COMMANDS ##
+
+def run(args) -> int:
+    """Run all commands of parsed arguments (see __main__.build_parser), returns the exit code
+    """
+    import argparse
+
+    HASH_FLAGNAME_LEN:int = max(len(n) for n in HASH_FLAGNAMES.values())
+    ALIAS_FLAGNAME_LEN:int = max(len(n) for n in ALIAS_FLAGNAMES.values())
+    FORMAT_FLAGNAME_LEN:int = max(len(n) for n in FORMAT_FLAGNAMES.values())
+    FLAGNAME_LEN:int = max(HASH_FLAGNAME_LEN, ALIAS_FLAGNAME_LEN, FORMAT_FLAGNAME_LEN)
+
+    # print(args)
+    # return 0
+
+    options:ILFormat = default_options(args.color)
+    
+    colors = Colors if args.color else DummyColors
+
+    if args.group is not None:
+        if '@' in args.group:
+            raise argparse.ArgumentError('--group', f'"@" character cannot be present in name : {args.group!r}')
+        if args.group == 'GROUP':  # special warning just for me :)
+            print('{DIM}{YELLOW}[WARNING]{RESET_ALL} {BRIGHT}{RED}specified group name {DIM}{GREEN}{!r}{BRIGHT}{RED}, did you mean {DIM}{GREEN}{!r}{BRIGHT}{RED}?{RESET_ALL}'.format(args.group, 'GLOBAL', **colors))
+        options.group_directive = args.group
+        print('{DIM}{CYAN}group name:{RESET_ALL}'.format(**colors), '{DIM}{GREEN}{!r}{RESET_ALL}'.format(args.group, **colors))
+
+    function_hashes:Optional[Set[int]] = None
+    if args.functions is not None:
+        function_hashes = set()
+        for value in args.functions:
+            try:
+                name_hash = parse_function_filter(value, options.group_directive)
+            except ValueError as ex:
+                raise argparse.ArgumentError(None, f'--function {ex}')
+            function_hashes.add(name_hash)
+            print('{DIM}{CYAN}function  :{RESET_ALL}'.format(**colors), '{BRIGHT}{BLUE}{!s}{RESET_ALL} {BRIGHT}{BLACK}; ${:08x}{RESET_ALL}'.format(value, name_hash, **colors))
+
+    if args.resfile is not None:
+        if not args.resfile:
+            raise argparse.ArgumentError('--resfile', f'resfile name is empty : {args.resfile!r}')
+        options.resfile_directive = args.resfile
+        resfile_fmt = repr(args.resfile).replace('*', '{BRIGHT}{CYAN}*{DIM}{GREEN}'.format(**colors))
+        print('{DIM}{CYAN}rsrc  file:{RESET_ALL}'.format(**colors), '{DIM}{GREEN}{}{RESET_ALL}'.format(resfile_fmt, **colors))
+
+    if args.jobs < 0:
+        raise argparse.ArgumentError('--jobs', f'job count less than zero : {args.jobs!r}')
+    jobs:int = args.jobs or (os.cpu_count() or 1)
+
+    memprofile:bool = args.memprofile or args.mem_budget is not None
+    stats_format:Optional[str] = args.stats or ('text' if (args.profile_dir is not None or args.stats_file is not None or memprofile) else None)
+    stats_config:Optional[StatsConfig] = StatsConfig(args.profile_dir, memprofile, args.mem_budget) if stats_format is not None else None
+    stats_records:List[dict] = []  # Stats.as_dict() of every measured file
+
+    if args.opcode_pad is not None:
+        if args.opcode_pad < 0:
+            raise argparse.ArgumentError('--opcode-pad', f'padding less than zero : {args.opcode_pad!r}')
+        options.opcode_padding = args.opcode_pad
+        print('{DIM}{CYAN}opcode pad:{RESET_ALL}'.format(**colors), '{BRIGHT}{WHITE}{!r}{RESET_ALL}'.format(args.opcode_pad, **colors))
+    
+    CONSUMED_HASH_FLAGS:set = set()
+    CONSUMED_ALIAS_FLAGS:set = set()
+    CONSUMED_FORMAT_FLAGS:set = set()
+
+    # visual names for flag on/off modes
+    ONOFF:dict = {
+        False: '{BRIGHT}{RED}off{RESET_ALL}'.format(**colors),
+        True:  '{BRIGHT}{GREEN}on{RESET_ALL}'.format(**colors),
+    }
+
+    for f in args.hash_flags:
+        if f.lower() not in HASH_FLAGNAMES:
+            raise argparse.ArgumentError('--hash', f'unknown flag {f!r}')
+        if f.lower() in CONSUMED_HASH_FLAGS:
+            raise argparse.ArgumentError('--hash', f'flag {f!r} already used')
+        CONSUMED_HASH_FLAGS.add(f.lower())
+        opt_name = HASH_FLAGNAMES[f.lower()]
+        opt_on = f == f.lower()
+        setattr(options, opt_name, opt_on)  # lower=True
+        print('{BRIGHT}{YELLOW}hash   opt:{RESET_ALL}'.format(**colors), opt_name.ljust(FLAGNAME_LEN), '=', ONOFF[opt_on])
+
+    for f in args.alias_flags:
+        if f.lower() not in ALIAS_FLAGNAMES:
+            raise argparse.ArgumentError('--alias', f'unknown flag {f!r}')
+        if f.lower() in CONSUMED_ALIAS_FLAGS:
+            raise argparse.ArgumentError('--alias', f'flag {f!r} already used')
+        CONSUMED_ALIAS_FLAGS.add(f.lower())
+        opt_name = ALIAS_FLAGNAMES[f.lower()]
+        opt_on = f == f.lower()
+        setattr(options, opt_name, opt_on)  # lower=True
+        print('{BRIGHT}{BLUE}alias  opt:{RESET_ALL}'.format(**colors), opt_name.ljust(FLAGNAME_LEN), '=', ONOFF[opt_on])
+
+    for f in args.format_flags:
+        if f.lower() not in FORMAT_FLAGNAMES:
+            raise argparse.ArgumentError('--format', f'unknown flag {f!r}')
+        if f.lower() in CONSUMED_FORMAT_FLAGS:
+            raise argparse.ArgumentError('--format', f'flag {f!r} already used')
+        CONSUMED_FORMAT_FLAGS.add(f.lower())
+        opt_name = FORMAT_FLAGNAMES[f.lower()]
+        opt_on = f == f.lower()
+        setattr(options, opt_name, opt_on)  # lower=True
+        print('{BRIGHT}{MAGENTA}format opt:{RESET_ALL}'.format(**colors), opt_name.ljust(FLAGNAME_LEN), '=', ONOFF[opt_on])
+
+
+    research:bool = getattr(args, 'research', False)
+    if research:
+        from ._research import _init_args, do_research
+        _init_args(args)  # research one-time setup
+
+    base_options = options
+
+    # decoded scripts and block boundaries, keyed by .mjo content (skipped for research)
+    cache:Optional[ScriptCache] = ScriptCache(args.cache_dir) if (args.cache and not research) else None
+    # assembled function bodies, keyed by .mjil path and token stream (skipped for research)
+    function_cache:Optional[FunctionCache] = FunctionCache(args.cache_dir) if (args.cache and not research) else None
+
+    errors:int = 0
+    warnings:List[str] = []  # reported once after all files
+    walk_options:dict = dict(recurse=args.recursive, include=args.include, exclude=args.exclude, symlinks=args.symlinks)
+
+
+    # [--print]  loop through input files/directories
+    for infile in (args.print or []):
+        options = prepare_options(base_options, infile)
+        if not research:
+            print('Printing:', infile)
+        if os.path.isdir(infile):  # directory of .mjo files
+            entries = walk_files(infile, ('.mjo',), **walk_options)
+            if research:
+                for entry in entries:
+                    do_research(args, entry.path, options=options)
+            else:
+                start_time = time.perf_counter()
+                # console output is buffered per file when using multiple processes, and written in order
+                job = partial(print_job, options=options, function_hashes=function_hashes, cache=cache, buffered=(jobs > 1), stats_config=stats_config)
+                file_count = batch_errors = 0
+                for _,result in run_jobs(job, ((entry.relpath, (entry.path,)) for entry in entries), jobs=jobs):
+                    file_count += 1
+                    if result.stats is not None:
+                        stats_records.append(result.stats)
+                    if result.output:
+                        sys.stdout.write(result.output)
+                    if result.error is not None:
+                        batch_errors += 1
+                        print_error(result, colors=colors)
+                errors += batch_errors
+                print_summary(file_count, batch_errors, time.perf_counter() - start_time, colors=colors)
+        else:  # single file
+            if research:
+                do_research(args, infile, options=options)
+            else:
+                with measure_file(infile, stats_config, options) as record:
+                    script, cfg = load_script(infile, cache)
+                    print_script(infile, script, options=options, function_hashes=function_hashes, cfg=cfg)
+                if record is not None:
+                    stats_records.append(record.as_dict())
+                    errors += check_budget(record, colors=colors)
+        if not research:
+            print()
+
+    # [--disasm]  loop through input files/directories
+    for infile,outfile in (args.disasm or []):
+        if not research:
+            print('Disassembling:', infile)
+        if os.path.isdir(infile):  # directory of .mjo files
+            if outfile is None:
+                outfile = infile
+            elif os.path.isfile(outfile):
+                raise Exception('Cannot use output "{!s}" because it is not a directory'.format(outfile))
+            elif not os.path.exists(outfile):
+                raise Exception('Output directory "{!s}" does not exist'.format(outfile))
+
+            start_time = time.perf_counter()
+            manifest = BuildManifest.load(os.path.join(outfile, DISASM_MANIFEST))
+            seen:List[str] = []
+            # resfile paths are relative to each output .mjil (mirrored with --recursive)
+            plan = plan_build(manifest, walk_files(infile, ('.mjo',), **walk_options),
+                              lambda name: options_fingerprint(prepare_options(base_options, output_path(outfile, name, '.mjil')), function_hashes), force=args.force, seen=seen)
+            tasks = (((entry.relpath, digest, fp), (entry.path, output_path(outfile, entry.relpath, '.mjil'), prepare_options(base_options, output_path(outfile, entry.relpath, '.mjil'))))
+                     for entry,digest,fp in plan)
+
+            last_name = ''
+            file_count = line_count = batch_errors = 0
+            job = partial(disassemble_job, function_hashes=function_hashes, cache=cache, stats_config=stats_config)
+            try:
+                for (name,digest,fp),result in run_jobs(job, tasks, jobs=jobs):
+                    file_count += 1
+                    if result.stats is not None:
+                        stats_records.append(result.stats)
+                    print('Disassembling:', name.ljust(len(last_name)*2), end='\r')  #HACK: *2 to handle double-width CJK
+                    last_name = name
+                    line_count += result.lines
+                    if result.error is not None:
+                        batch_errors += 1
+                        print_error(result, colors=colors)
+                        manifest.discard(name)
+                    else:
+                        manifest.record(name, digest, fp, result.outputs)
+                # outputs of deleted inputs (inputs only filtered out by --include/--exclude are kept)
+                seen_names = set(seen)
+                manifest.remove_stale([n for n in manifest.entries if n in seen_names or os.path.isfile(os.path.join(infile, n))])
+            finally:
+                manifest.save()
+            errors += batch_errors
+            print_summary(file_count, batch_errors, time.perf_counter() - start_time, line_count, skipped=len(seen) - file_count,
+                          pad=len(f'Disassembling: ') + len(last_name)*2, colors=colors)  #HACK: *2 to handle double-width CJK
+        else:  # single file
+            options = prepare_options(base_options, outfile)
+
+            outpath = outfile
+            if outfile is None:
+                if os.path.splitext(infile)[1].lower() == '.mjil':  # avoid overwriting input file by accident
+                    raise Exception(f'--disasm file {infile!r} has \'.mjil\' extension, with no output file passed')
+                outpath = os.path.splitext(infile)[0] + '.mjil'
+            elif os.path.isdir(outfile):  # write to outfile/infilename.mjil
+                name = os.path.basename(infile)
+                outpath = os.path.join(outfile, os.path.splitext(name)[0] + '.mjil')
+            with measure_file(infile, stats_config, options) as record:
+                script, cfg = load_script(infile, cache)
+                disassemble_script(infile, script, outpath, options=options, function_hashes=function_hashes, cfg=cfg)
+                add_bytes_written(record, (outpath,))
+            if record is not None:
+                stats_records.append(record.as_dict())
+                errors += check_budget(record, colors=colors)
+        if not research:
+            print()
+
+    # [--asm]  loop through input files/directories
+    for infile,outfile in (args.asm or []):
+        if not research:
+            print('Assembling:', infile)
+        if os.path.isdir(infile):  # directory of .mjil files
+            if outfile is None:
+                outfile = infile
+            elif os.path.isfile(outfile):
+                raise Exception('Cannot use output "{!s}" because it is not a directory'.format(outfile))
+            elif not os.path.exists(outfile):
+                raise Exception('Output directory "{!s}" does not exist'.format(outfile))
+
+            start_time = time.perf_counter()
+            manifest = BuildManifest.load(os.path.join(outfile, ASM_MANIFEST))
+            seen:List[str] = []
+            asm_fingerprint = fingerprint('asm')
+            plan = plan_build(manifest, walk_files(infile, ('.mjil',), **walk_options),
+                              lambda name: asm_fingerprint, force=args.force, seen=seen)
+            tasks = (((entry.relpath, digest, fp), (entry.path, output_path(outfile, entry.relpath, '.mjo')))
+                     for entry,digest,fp in plan)
+
+            last_name = ''
+            file_count = batch_errors = 0
+            try:
+                job = partial(assemble_job, function_cache=function_cache, stats_config=stats_config)
+                for (name,digest,fp),result in run_jobs(job, tasks, jobs=jobs):
+                    file_count += 1
+                    if result.stats is not None:
+                        stats_records.append(result.stats)
+                    print('Assembling:', name.ljust(len(last_name)*2), end='\r')  #HACK: *2 to handle double-width CJK
+                    last_name = name
+                    warnings.extend(result.warnings)
+                    if result.error is not None:
+                        batch_errors += 1
+                        print_error(result, colors=colors)
+                        manifest.discard(name)
+                    else:
+                        manifest.record(name, digest, fp, result.outputs, result.depends)
+                # outputs of deleted inputs (inputs only filtered out by --include/--exclude are kept)
+                seen_names = set(seen)
+                manifest.remove_stale([n for n in manifest.entries if n in seen_names or os.path.isfile(os.path.join(infile, n))])
+            finally:
+                manifest.save()
+            errors += batch_errors
+            print_summary(file_count, batch_errors, time.perf_counter() - start_time, skipped=len(seen) - file_count,
+                          pad=len('Assembling: ') + len(last_name)*2, colors=colors)  #HACK: *2 to handle double-width CJK
+        else:  # single file
+            options = prepare_options(base_options, infile)
+
+            outpath = outfile
+            if infile == '-' and (outfile is None or os.path.isdir(outfile)):
+                raise Exception('--asm from stdin requires an output file')
+            if outfile is None:
+                if os.path.splitext(infile)[1].lower() == '.mjo':  # avoid overwriting input file by accident
+                    raise Exception(f'--asm file {infile!r} has \'.mjo\' extension, with no output file passed')
+                outpath = os.path.splitext(infile)[0] + '.mjo'
+            elif os.path.isdir(outfile):  # write to outfile/infilename.mjil
+                name = os.path.basename(infile)
+                outpath = os.path.join(outfile, os.path.splitext(name)[0] + '.mjo')
+            try:
+                with measure_file(infile, stats_config) as record:
+                    assemble_file(infile, outpath, function_cache)
+                    add_bytes_written(record, (outpath,))
+                if record is not None:
+                    stats_records.append(record.as_dict())
+                    errors += check_budget(record, colors=colors)
+            finally:
+                warnings.extend(resource_warnings())
+        if not research:
+            print()
+
+    # duplicate resource keys (once per resource file, after all scripts)
+    if warnings:
+        print_warnings(dict.fromkeys(warnings), colors=colors)
+        print()
+
+    # [--binary]  convert files to/from binary IL
+    for infile,outfile in (args.binary or []):
+        print('Converting:', infile, '->', outfile)
+        convert_binary(infile, outfile, options=prepare_options(base_options, outfile), cache=cache)
+        print()
+
+    # [--jsonl]  export instruction records
+    for infile,outfile in (args.jsonl or []):
+        if os.path.isdir(infile):  # directory of .mjo files
+            entries = walk_files(infile, ('.mjo', BINARY_EXT), **walk_options)
+        else:  # single file
+            entries = [FileEntry(infile, os.path.basename(infile))]
+        to_stdout = (outfile == '-')
+        writer = sys.stdout if to_stdout else open_il_writer(outfile)
+        try:
+            start_time = time.perf_counter()
+            file_count = record_count = 0
+            for entry in entries:
+                record_count += write_jsonl(writer, iter_instruction_records(entry.path, filename=entry.relpath, cache=cache))
+                file_count += 1
+        finally:
+            if not to_stdout:
+                writer.close()
+        if not to_stdout:
+            print('Exported:', infile, '->', outfile)
+            print_summary(file_count, 0, time.perf_counter() - start_time, record_count, unit='records', colors=colors)
+            print()
+
+    # [--xref]  update cross-reference indexes
+    for indir,indexfile in (args.xref or []):
+        print('Cross-referencing:', indir)
+        if not os.path.isdir(indir):
+            raise Exception('Cannot use input "{!s}" because it is not a directory'.format(indir))
+        xref = XRefIndex.load(indexfile)
+        scanned, removed = xref.update(indir, **walk_options)
+        xref.save(indexfile)
+        print('{DIM}{CYAN}scanned   :{RESET_ALL} {BRIGHT}{WHITE}{:d}{RESET_ALL}, {DIM}{CYAN}removed:{RESET_ALL} {BRIGHT}{WHITE}{:d}{RESET_ALL}, {DIM}{CYAN}files:{RESET_ALL} {BRIGHT}{WHITE}{:d}{RESET_ALL}'.format(scanned, removed, len(xref.files), **colors))
+        for name_hash in sorted(function_hashes or ()):
+            print_xrefs(xref, name_hash, colors=colors)
+        print()
+
+    # [--stats]  phase times and counters of all print/disasm/asm files
+    if stats_format is not None:
+        write_stats_report(stats_records, stats_format, args.stats_file)
+
+    return 1 if errors else 0
@@ -86,7 +86,8 @@ def _invcalc32(num:int) -> int:
 #region ## CRC TABLES ##
 
 CRC32_TABLE:list  = tuple(_calc32(n) for n in range(256))
-CRC32_INDEX:list  = tuple(_invcalc32(n) for n in range(256))
+# inverse of _invcalc32 for all most significant bytes (unique in CRC32_TABLE), without searching the table per byte
+CRC32_INDEX:list  = tuple(i for _,i in sorted((c >> 24, i) for i,c in enumerate(CRC32_TABLE)))
 CRC64_TABLE:list  = tuple(_calc64(n) for n in range(256))
 # 1024-byte Majiro script XOR decryption key (standard CRC-32 table output in little-endian)
 CRYPT32_KEY:bytes = pack('<256I', *CRC32_TABLE)
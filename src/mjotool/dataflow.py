@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""Majiro stack depth and type dataflow analysis (driven by Opcode.transition)
+"""
+
+__version__ = '0.1.0'
+__date__    = '2021-05-10'
+__author__  = 'Robert Jordan'
+
+__all__ = ['StackTransition', 'StackIssue', 'FunctionStack', 'StackAnalyzer', 'transition_table']
+
+#######################################################################################
+
+## TRANSITION NOTATION ##
+#
+# "POPS.PUSHES", listed from the bottom of the stack to the top:
+#  i f s      int, float, string          (b is a boolean result, typed as int)
+#  I F S      int/float/string arrays
+#  n p *      numeric (i|f), primitive (i|f|s), any
+#  #t  ~#t    type from the instruction's var flags, element type of that array type
+#  [X#d]      X repeated for the var flags' dimension count
+#  [X#a]      X repeated for the instruction's argument count
+#  [#t]       one value for each type in the instruction's type list
+#  [#s]       effect depends on the string operand (assumed to be none)
+#  [*]        pops everything remaining on the stack
+#  digit      (pushes only) number of values below the pops that are kept on the stack
+#             i.e. "p.1" pops a case value, and requires the switch value to remain
+#
+# type codes for the stack are stored as str, one character per value
+
+import re
+from collections import Counter, deque, namedtuple
+from typing import Dict, Iterable, Iterator, List, NoReturn, Optional, Set, Tuple  # for hinting in declarations
+
+from .flags import MjoType
+from .opcodes import Opcode
+from .script import Instruction, MjoScript, BasicBlock, Function
+from .analysis import ControlFlowGraph
+
+
+#region ## TYPE CODES ##
+
+TYPE_CODES:Dict[MjoType,str] = {
+    MjoType.INT:          'i',
+    MjoType.FLOAT:        'f',
+    MjoType.STRING:       's',
+    MjoType.INT_ARRAY:    'I',
+    MjoType.FLOAT_ARRAY:  'F',
+    MjoType.STRING_ARRAY: 'S',
+}
+CODE_TYPES:Dict[str,MjoType] = dict((v,k) for k,v in TYPE_CODES.items())
+
+ELEMENT_CODES:Dict[str,str] = {'I': 'i', 'F': 'f', 'S': 's'}
+
+# actual stack value codes accepted for each expected code
+COMPATIBLE_CODES:Dict[str,str] = {
+    'i': 'i*',
+    'f': 'f*',
+    's': 's*',
+    'I': 'I*',
+    'F': 'F*',
+    'S': 'S*',
+    'n': 'if*',
+    'p': 'ifs*',
+    '*': 'ifsIFS*',
+}
+
+# stack values popped by `ctrl` string operands (others are assumed to have no effect)
+#  "x": expands the top value into message text
+CONTROL_POPS:Dict[str,str] = {
+    'x': '*',
+}
+
+#endregion
+
+#region ## TRANSITION TABLE ##
+
+# [X#r] repeat | [*] pop all | ~#t / #t var type | single code | keep digit
+RE_TRANSITION_ITEM = re.compile(r"\[(?P<rcode>[^\]#]*)#(?P<repeat>[a-z])\]|(?P<all>\[\*\])|(?P<vartype>~?#t)|(?P<code>[A-Za-z*])|(?P<keep>[0-9])")
+
+class StackTransition:
+    """Precompiled stack transition for an opcode
+    """
+    __slots__ = ('opcode', 'pops', 'pushes', 'keep', 'pop_all', 'static_pops', 'static_pushes')
+    def __init__(self, opcode:Opcode, pops:tuple, pushes:tuple, keep:int=0, pop_all:bool=False):
+        self.opcode:Opcode = opcode
+        # items are (code, repeat), where repeat is None or one of: 'd', 'a', 't', 's'
+        self.pops:tuple = pops
+        self.pushes:tuple = pushes
+        self.keep:int = keep
+        self.pop_all:bool = pop_all
+        # fast path for transitions that don't depend on operands
+        self.static_pops:Optional[str] = self._static(pops)
+        self.static_pushes:Optional[str] = self._static(pushes)
+
+    @classmethod
+    def _static(cls, items:tuple) -> Optional[str]:
+        if any(repeat is not None or code[-1] == 't' for code,repeat in items):
+            return None
+        return ''.join(('i' if code == 'b' else code) for code,_ in items)
+
+    @classmethod
+    def _parse_items(cls, text:str) -> Tuple[tuple, int, bool]:
+        items:list = []
+        keep:int = 0
+        pop_all:bool = False
+        pos:int = 0
+        while pos < len(text):
+            m = RE_TRANSITION_ITEM.match(text, pos)
+            if not m:
+                raise ValueError(f'Invalid stack transition {text!r} at position {pos}')
+            if m['repeat']:
+                items.append((m['rcode'], m['repeat']))
+            elif m['all']:
+                pop_all = True
+            elif m['vartype']:
+                items.append((m['vartype'], None))
+            elif m['code']:
+                items.append((m['code'], None))
+            else: #elif m['keep']:
+                keep += int(m['keep'])
+            pos = m.end()
+        return (tuple(items), keep, pop_all)
+
+    @classmethod
+    def compile(cls, opcode:Opcode) -> 'StackTransition':
+        transition:str = opcode.transition
+        if not transition:
+            return cls(opcode, (), ())  # nop
+        if '.' not in transition:
+            raise ValueError(f'Invalid stack transition {transition!r} for opcode {opcode.mnemonic!s}')
+        left, right = transition.split('.', 1)
+        pops, _, pop_all = cls._parse_items(left)
+        pushes, keep, _ = cls._parse_items(right)
+        return cls(opcode, pops, pushes, keep, pop_all)
+
+    @classmethod
+    def _resolve(cls, items:tuple, instruction:Instruction) -> str:
+        codes:list = []
+        for code,repeat in items:
+            if code == '#t':
+                code = TYPE_CODES.get(instruction.flags.type, '*')
+            elif code == '~#t':
+                code = TYPE_CODES.get(instruction.flags.type, '*')
+                code = ELEMENT_CODES.get(code, code)
+            elif code == 'b':
+                code = 'i'
+            if repeat is None:
+                codes.append(code)
+            elif repeat == 'd':
+                codes.append(code * int(instruction.flags.dimension))
+            elif repeat == 'a':
+                codes.append(code * instruction.argument_count)
+            elif repeat == 't':
+                codes.extend(TYPE_CODES.get(t, '*') for t in instruction.type_list)
+            elif repeat == 's':  # effect depends on string
+                codes.append(CONTROL_POPS.get(instruction.string, ''))
+        return ''.join(codes)
+
+    def resolve(self, instruction:Instruction) -> Tuple[str, str]:
+        """Return the (pops, pushes) type codes for an instruction, bottom to top
+        """
+        pops = self.static_pops
+        if pops is None:
+            pops = self._resolve(self.pops, instruction)
+        pushes = self.static_pushes
+        if pushes is None:
+            pushes = self._resolve(self.pushes, instruction)
+        return (pops, pushes)
+
+_TRANSITIONS:Dict[int, StackTransition] = None
+
+def transition_table() -> Dict[int, StackTransition]:
+    """Return the precompiled stack transition table by opcode value (compiled on first use)
+    """
+    global _TRANSITIONS
+    if _TRANSITIONS is None:
+        _TRANSITIONS = dict((o.value, StackTransition.compile(o)) for o in Opcode.LIST)
+    return _TRANSITIONS
+
+#endregion
+
+#region ## ANALYSIS RESULTS ##
+
+# kind: 'underflow', 'imbalance', or 'type'
+StackIssue = namedtuple('StackIssue', ('offset', 'kind', 'message'))
+
+class FunctionStack:
+    """Stack depth and types before every instruction in a function
+
+    lists are indexed by (instruction index - function.first_instruction_index),
+    unreachable instructions have a depth of -1 and types of None.
+    """
+    def __init__(self, function:Function):
+        self.function:Function = function
+        count:int = function.instruction_count
+        self.depths:List[int] = [-1] * count
+        self.types:List[Optional[str]] = [None] * count
+        self.issues:List[StackIssue] = []
+        self.inferred:Dict[int,str] = {}  # call/syscall instruction offset -> inferred return type code
+        # blocks are revisited until their entry states stop changing, issues and inferences are recorded once
+        self._issue_keys:Set[Tuple[int,str]] = set()  # (offset, kind)
+        self._inferred_uses:Set[Tuple[int,int]] = set()  # (call origin index, use offset)
+    def add_issue(self, offset:int, kind:str, message:str) -> bool:
+        """Record an issue unless one of the same kind was already found at the offset, returns True if added
+        """
+        key = (offset, kind)
+        if key in self._issue_keys:
+            return False
+        self._issue_keys.add(key)
+        self.issues.append(StackIssue(offset, kind, message))
+        return True
+    def depth_at(self, index:int) -> int:
+        return self.depths[index - self.function.first_instruction_index]
+    def types_at(self, index:int) -> Optional[str]:
+        return self.types[index - self.function.first_instruction_index]
+    @property
+    def is_balanced(self) -> bool:
+        return not any(issue.kind != 'type' for issue in self.issues)
+
+#endregion
+
+#region ## STACK ANALYZER ##
+
+class StackAnalyzer:
+    """Worklist abstract interpreter for stack depth and operand types
+
+    a single analyzer can be reused over many scripts to aggregate
+    inferred call/syscall return types across a whole game.
+    """
+    def __init__(self):
+        self.table:Dict[int, StackTransition] = transition_table()
+        # ('call'|'syscall', hash) -> Counter of return type codes inferred from usage
+        self.return_types:Dict[Tuple[str,int], Counter] = {}
+
+    def inferred_return_type(self, name_hash:int, syscall:bool=False) -> Optional[MjoType]:
+        """Return the most common return type inferred for a call or syscall hash
+        """
+        counter = self.return_types.get(('syscall' if syscall else 'call', name_hash), None)
+        if not counter:
+            return None
+        return CODE_TYPES.get(counter.most_common(1)[0][0], None)
+
+    def analyze_script(self, script:MjoScript) -> List[FunctionStack]:
+        cfg:ControlFlowGraph = ControlFlowGraph.build_from_script(script)
+        return [self.analyze_function(fn) for fn in cfg.functions]
+
+    def analyze_scripts(self, scripts:Iterable[MjoScript]) -> Iterator[Tuple[MjoScript, List[FunctionStack]]]:
+        """Batch analysis over many scripts, sharing the transition table and inferred return types
+        """
+        for script in scripts:
+            yield (script, self.analyze_script(script))
+
+    def analyze_function(self, function:Function) -> FunctionStack:
+        result:FunctionStack = FunctionStack(function)
+        instructions:List[Instruction] = function.script.instructions
+        first:int = function.first_instruction_index
+        blocks:List[BasicBlock] = function.basic_blocks
+
+        # stack state is (codes:str, origins:tuple), origins are the call
+        #  instruction index for unknown '*' return values, or -1
+        entry_states:List[Optional[Tuple[str,tuple]]] = [None] * len(blocks)
+        entry_states[function.entry_block.index] = ('', ())
+        worklist:deque = deque([function.entry_block.index])
+        queued:set = {function.entry_block.index}
+
+        while worklist:
+            index = worklist.popleft()
+            queued.discard(index)
+            block:BasicBlock = blocks[index]
+            codes, origins = entry_states[index]
+            returned:bool = False
+            for i in range(block.first_instruction_index, block.last_instruction_index + 1):
+                result.depths[i - first] = len(codes)
+                result.types[i - first] = codes
+                codes, origins = self.step(instructions[i], i, codes, origins, result)
+                if instructions[i].is_return:
+                    returned = True  # path ends here, anything after ret in the block is unreachable
+                    break
+
+            if returned:
+                continue
+            for succ in block.successors:
+                state = entry_states[succ.index]
+                if state is None:
+                    entry_states[succ.index] = (codes, origins)
+                elif len(state[0]) != len(codes):
+                    result.add_issue(succ.start_offset, 'imbalance',
+                        f'stack depth {len(codes)} from {block.name} does not match {len(state[0])} at {succ.name}')
+                    continue
+                else:
+                    merged = self.merge(state, (codes, origins))
+                    if merged == state:
+                        continue
+                    entry_states[succ.index] = merged
+                if succ.index not in queued:
+                    queued.add(succ.index)
+                    worklist.append(succ.index)
+        return result
+
+    @classmethod
+    def merge(cls, a:Tuple[str,tuple], b:Tuple[str,tuple]) -> Tuple[str,tuple]:
+        if a == b:
+            return a
+        codes = ''.join((x if x == y else '*') for x,y in zip(a[0], b[0]))
+        origins = tuple((x if x == y else -1) for x,y in zip(a[1], b[1]))
+        return (codes, origins)
+
+    def step(self, instruction:Instruction, index:int, codes:str, origins:tuple, result:FunctionStack) -> Tuple[str,tuple]:
+        """Apply an instruction's stack transition, returns the new (codes, origins) state
+        """
+        transition:StackTransition = self.table[instruction.opcode.value]
+        if transition.pop_all:
+            return ('', ())
+        pops, pushes = transition.resolve(instruction)
+
+        npop:int = len(pops)
+        depth:int = len(codes)
+        # keep values (the switch value of *.case branches) are peeked without popping,
+        #  they aren't required to be on the stack
+        if depth < npop:
+            result.add_issue(instruction.offset, 'underflow',
+                f'{instruction.opcode.mnemonic} requires {npop} values, stack depth is {depth}')
+            missing = npop - depth
+            codes = '*' * missing + codes
+            origins = (-1,) * missing + origins
+            depth = len(codes)
+
+        if npop:
+            actual = codes[depth - npop:]
+            for j,(expected,code) in enumerate(zip(pops, actual)):
+                if code in COMPATIBLE_CODES.get(expected, '*'):
+                    if code == '*' and expected in CODE_TYPES:
+                        origin = origins[depth - npop + j]
+                        if origin != -1:
+                            self.infer(instruction.offset, origin, expected, result)
+                else:
+                    result.add_issue(instruction.offset, 'type',
+                        f'{instruction.opcode.mnemonic} expected {expected!r}, found {code!r}')
+            codes = codes[:depth - npop]
+            origins = origins[:depth - npop]
+
+        if pushes:
+            if pushes == '*' and (instruction.is_call or instruction.is_syscall):
+                origins = origins + (index,)
+            else:
+                origins = origins + (-1,) * len(pushes)
+            codes = codes + pushes
+        return (codes, origins)
+
+    def infer(self, offset:int, origin:int, code:str, result:FunctionStack) -> NoReturn:
+        use = (origin, offset)
+        if use in result._inferred_uses:
+            return  # counted once per use, not once per block visit
+        result._inferred_uses.add(use)
+        instruction:Instruction = result.function.script.instructions[origin]
+        key = ('syscall' if instruction.is_syscall else 'call', instruction.hash)
+        self.return_types.setdefault(key, Counter())[code] += 1
+        result.inferred[instruction.offset] = code
+
+#endregion
+
+
+del Dict, Iterable, Iterator, List, NoReturn, Optional, Set, Tuple  # cleanup declaration-only imports
@@ -13,17 +13,33 @@ __all__ = ['LOCAL_VARS', 'LOCAL_VARS_LOOKUP', 'THREAD_VARS', 'THREAD_VARS_LOOKUP
 
 ## runtime imports:
 # from ..crypt import hash32  # used in find_group()
+# from . import _hashes       # loaded on first access of a table, see __getattr__()
 
-from itertools import chain
-from typing import Dict, Optional
+from typing import Optional  # for hinting in declarations
 
-from ._hashes import *
 
+def _load_tables() -> dict:
+    """Import the auto-generated tables (and build combined tables) into this module's globals
+    """
+    from itertools import chain
+    from . import _hashes
+    tables = dict((name, getattr(_hashes, name)) for name in _hashes.__all__)
+    # combine all variable type hashes into one dictionary for easy lookup,
+    #  since this isn't handled by the auto-generated file
+    tables['VARIABLES'] = dict(chain(tables['LOCAL_VARS'].items(), tables['THREAD_VARS'].items(), tables['SAVEFILE_VARS'].items(), tables['PERSISTENT_VARS'].items()))
+    tables['VARIABLES_LOOKUP'] = dict((v,k) for k,v in tables['VARIABLES'].items())
+    globals().update(tables)  # later lookups don't go through __getattr__
+    return tables
+
+def __getattr__(name:str):
+    # tables are loaded on first lookup (PEP 562), the generated module is large and not needed by every command
+    if name in __all__:
+        return _load_tables()[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def __dir__() -> list:
+    return sorted(set(globals()) | set(__all__))
 
-# combine all variable type hashes into one dictionary for easy lookup,
-#  since this isn't handled by the auto-generated file
-VARIABLES:Dict[int,str] = dict(chain(LOCAL_VARS.items(), THREAD_VARS.items(), SAVEFILE_VARS.items(), PERSISTENT_VARS.items()))
-VARIABLES_LOOKUP:Dict[str,int] = dict((v,k) for k,v in VARIABLES.items())
 
 # function name used calculate hashes in GROUPS lookup dictionary
 GROUP_HASHNAME:str = '$main'
@@ -33,6 +49,8 @@ def find_group(hashvalue:int, name:str=GROUP_HASHNAME) -> Optional[str]:
 
     search for a group name that matches the hash value when combined into `name@GROUP`.
     """
+    if 'GROUPS' not in globals():
+        _load_tables()
     if name is GROUP_HASHNAME: # this is built into _hashes.GROUPS dict
         return GROUPS.get(hashvalue, None)
 
@@ -44,4 +62,4 @@ def find_group(hashvalue:int, name:str=GROUP_HASHNAME) -> Optional[str]:
     return None
 
 
-del chain, Dict, Optional  # cleanup declaration-only imports
+del Optional  # cleanup declaration-only imports
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""Majiro incremental directory build manifest
+"""
+
+__version__ = '0.1.0'
+__date__    = '2021-05-10'
+__author__  = 'Robert Jordan'
+
+__all__ = ['BuildManifest', 'file_digest', 'fingerprint', 'DISASM_MANIFEST', 'ASM_MANIFEST']
+
+#######################################################################################
+
+## MANIFEST FILE FORMAT ##
+#
+# JSON: {"version": 1, "entries": {NAME: ENTRY, ...}}
+#
+# NAME: input file name relative to the input directory
+# ENTRY:
+#  "input":   SHA-1 hex digest of the input file
+#  "options": fingerprint of the tool version and all options affecting the outputs
+#  "depends": {ABSPATH: SHA-1, ...}  extra inputs discovered while building (i.e. resfile read by the assembler)
+#  "outputs": {ABSPATH: SHA-1, ...}  all files written for the input (i.e. .mjil and resfile .csv)
+#
+# an entry is current when its input, options, depends, and outputs all still match,
+#  entries for inputs that no longer exist have their outputs removed.
+
+import hashlib, json, os
+from typing import Dict, Iterable, NoReturn, Optional  # for hinting in declarations
+
+from . import __version__ as _tool_version
+
+
+DISASM_MANIFEST:str = '.mjotool-disasm.json'  # written to the --disasm output directory
+ASM_MANIFEST:str    = '.mjotool-asm.json'     # written to the --asm output directory
+
+READ_CHUNK_SIZE:int = 1024 * 1024
+
+
+def file_digest(path:str) -> Optional[str]:
+    """Return the SHA-1 hex digest of a file's contents, or None if the file does not exist
+    """
+    h = hashlib.sha1()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+                h.update(chunk)
+    except FileNotFoundError:
+        return None
+    return h.hexdigest()
+
+def fingerprint(*values) -> str:
+    """Return a stable SHA-1 hex digest of JSON-serializable values (and the tool version)
+    """
+    data = json.dumps([_tool_version, *values], sort_keys=True, separators=(',', ':'), default=repr)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+class BuildManifest:
+    """Record of input, option, and output digests for skipping unchanged files in directory builds
+    """
+    VERSION:int = 1
+
+    def __init__(self, filename:str):
+        self.filename:str = filename
+        self.entries:Dict[str, dict] = {}
+
+    #region ## LOAD / SAVE ##
+
+    @classmethod
+    def load(cls, filename:str) -> 'BuildManifest':
+        """Load a manifest file, returns an empty manifest if the file does not exist, or is from another version
+        """
+        manifest = cls(filename)
+        if os.path.isfile(filename):
+            with open(filename, 'rt', encoding='utf-8') as reader:
+                data = json.load(reader)
+            if data.get('version', None) == cls.VERSION:
+                manifest.entries = data['entries']
+        return manifest
+
+    def save(self) -> NoReturn:
+        temppath = '{}.{:d}.tmp'.format(self.filename, os.getpid())
+        with open(temppath, 'wt', encoding='utf-8') as writer:
+            json.dump({'version': self.VERSION, 'entries': self.entries}, writer, separators=(',', ':'))
+        os.replace(temppath, self.filename)
+
+    #endregion
+
+    #region ## ENTRIES ##
+
+    def is_current(self, name:str, digest:str, options:str) -> bool:
+        """Return True if the input was built with the same contents and options, and no tracked files changed since
+        """
+        entry = self.entries.get(name, None)
+        if entry is None or entry['input'] != digest or entry['options'] != options:
+            return False
+        for path, recorded in entry['depends'].items():
+            if file_digest(path) != recorded:
+                return False
+        for path, recorded in entry['outputs'].items():
+            if file_digest(path) != recorded:
+                return False
+        return True
+
+    def record(self, name:str, digest:str, options:str, outputs:Iterable[str], depends:Iterable[str]=()) -> NoReturn:
+        """Record a successful build of an input, output and dependency files are hashed now
+        """
+        self.entries[name] = {
+            'input':   digest,
+            'options': options,
+            'depends': {os.path.abspath(p): file_digest(p) for p in depends},
+            'outputs': {os.path.abspath(p): file_digest(p) for p in outputs},
+        }
+
+    def discard(self, name:str) -> NoReturn:
+        """Forget an input (after a failed build), so it's rebuilt next time
+        """
+        self.entries.pop(name, None)
+
+    def remove_stale(self, names:Iterable[str]) -> int:
+        """Remove entries (and their outputs) for inputs not in names, returns the number of outputs deleted
+        """
+        names = set(names)
+        stale = {n: self.entries.pop(n) for n in [n for n in self.entries if n not in names]}
+        # outputs can be shared (i.e. a resfile directive without '*')
+        kept = set(p for entry in self.entries.values() for p in entry['outputs'])
+        deleted:int = 0
+        for entry in stale.values():
+            for path in entry['outputs']:
+                if path in kept:
+                    continue
+                try:
+                    os.remove(path)
+                    deleted += 1
+                except FileNotFoundError:
+                    pass
+        return deleted
+
+    #endregion
+
+
+del Dict, Iterable, NoReturn, Optional  # cleanup declaration-only imports
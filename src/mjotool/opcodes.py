@@ -120,7 +120,7 @@ def define_opcode(value:int, mnemonic:str, op:str, encoding:str, transition:str,
 def define_binary_operator(base_value:int, mnemonic:str, op:str, allowed_types:MjoTypeMask, is_comparison:bool, *aliases:str) -> NoReturn:
     for i, t_mask in enumerate(_TYPE_MASKS):
         if allowed_types & t_mask:
-            comparison = _COMPARISON_TRANSITIONS[is_comparison]
+            comparison = _COMPARISON_TRANSITIONS[i][is_comparison]
             postfix = _POSTFIXES[i]
             if allowed_types == MjoTypeMask.INT:
                 define_opcode(base_value, mnemonic, op, "", comparison, *alias_intonly(postfix, mnemonic, *aliases))
@@ -131,7 +131,7 @@ def define_binary_operator(base_value:int, mnemonic:str, op:str, allowed_types:M
 def define_assignment_operator(base_value:int, mnemonic:str, op:str, allowed_types:MjoTypeMask, is_pop:bool, *aliases:str) -> NoReturn:
     for i, t_mask in enumerate(_TYPE_MASKS):
         if allowed_types & t_mask:
-            pop = _POP_TRANSITIONS[is_pop]
+            pop = _POP_TRANSITIONS[i][is_pop]
             postfix = _POSTFIXES[i]
             if allowed_types == MjoTypeMask.INT:
                 define_opcode(base_value, mnemonic, op, "fho", pop, *alias_intonly(postfix, mnemonic, *aliases))
@@ -142,7 +142,7 @@ def define_assignment_operator(base_value:int, mnemonic:str, op:str, allowed_typ
 def define_array_assignment_operator(base_value:int, mnemonic:str, op:str, allowed_types:MjoTypeMask, is_pop:bool, *aliases:str) -> NoReturn:
     for i, t_mask in enumerate(_TYPE_MASKS): #TODO: this is a waste, only the first 3 types should be enumerated
         if allowed_types & t_mask:
-            pop = _POPARRAY_TRANSITIONS[is_pop]
+            pop = _POPARRAY_TRANSITIONS[i][is_pop]
             postfix = _POSTFIXES[i]
             if allowed_types == MjoTypeMask.INT:
                 define_opcode(base_value, mnemonic, op, "fho", pop, *alias_intonly(postfix, mnemonic, *aliases))
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""Majiro instruction record export (JSON Lines) for analytics
+"""
+
+__version__ = '0.1.0'
+__date__    = '2021-05-10'
+__author__  = 'Robert Jordan'
+
+__all__ = ['iter_instruction_records', 'iter_script_records', 'iter_jsonl_lines', 'write_jsonl']
+
+#######################################################################################
+
+## RECORD FORMAT ##
+#
+# one JSON object per instruction:
+#  "file":          script file name (relative path for directory inputs)
+#  "function":      containing function hash
+#  "function_name": known function name (or null)
+#  "block":         basic block label (entry, block_XXXXX, exit_XXXXX, destructor_XXXXX)
+#  "block_index":   basic block index in the function
+#  "offset":        bytecode offset
+#  "opcode":        opcode mnemonic
+#  "opcode_value":  opcode value
+#  "operands":      decoded operands by name (only those in the opcode encoding)
+#                    flags are decomposed into scope, type, dimension, modifier, invert
+#  "hash_name":     known name of the hash operand / ldc.i literal (or null)
+#  "hash_kind":     'syscall', 'call', 'var', 'int' (or null for opcodes without hashes)
+
+import json, os
+from typing import Iterable, Iterator, Optional, TextIO  # for hinting in declarations
+
+from .script import ILFormat, Instruction, MjoScript
+from .analysis import ControlFlowGraph
+from .writer import write_lines
+
+
+# reused by all records (compact, non-ASCII strings are written as-is)
+_ENCODER:json.JSONEncoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+# full known hash names (no group stripping)
+_OPTIONS:ILFormat = None
+
+
+def record_options() -> ILFormat:
+    """Return the format options used to resolve known hash names (shares the resolver cache)
+    """
+    global _OPTIONS
+    if _OPTIONS is None:
+        options = ILFormat()
+        options.known_hashes = True
+        options.implicit_local_groups = False
+        _OPTIONS = options
+    return _OPTIONS
+
+def _decode_operands(instruction:Instruction) -> dict:
+    operands:dict = {}
+    for operand in instruction.opcode.encoding:
+        if operand == 't':
+            operands['type_list'] = [t.name.lower() for t in instruction.type_list]
+        elif operand == 's':
+            operands['string'] = instruction.string
+        elif operand == 'f':
+            flags = instruction.flags
+            operands['flags'] = int(flags)
+            operands['scope'] = flags.scope.name.lower()
+            operands['type'] = flags.type.name.lower()
+            operands['dimension'] = int(flags.dimension)
+            operands['modifier'] = flags.modifier.name.lower()
+            operands['invert'] = flags.invert.name.lower()
+        elif operand == 'h': operands['hash'] = instruction.hash
+        elif operand == 'o': operands['var_offset'] = instruction.var_offset
+        elif operand == 'i': operands['int_value'] = instruction.int_value
+        elif operand == 'r': operands['float_value'] = instruction.float_value
+        elif operand == 'a': operands['argument_count'] = instruction.argument_count
+        elif operand == 'j': operands['jump_offset'] = instruction.jump_offset
+        elif operand == 'l': operands['line_number'] = instruction.line_number
+        elif operand == 'c': operands['switch_cases'] = list(instruction.switch_cases)
+    return operands
+
+def iter_script_records(filename:str, script:MjoScript, cfg:ControlFlowGraph, *, options:Optional[ILFormat]=None) -> Iterator[dict]:
+    """Yield one record per instruction of an analyzed script, in function and block order
+    """
+    if options is None:
+        options = record_options()
+    resolver = options.resolver
+    instructions = script.instructions
+    for function in cfg.functions:
+        function_name = resolver.resolve(function.name_hash, 'call').name
+        for basic_block in function.basic_blocks:
+            block_name = basic_block.name
+            for i in range(basic_block.first_instruction_index, basic_block.last_instruction_index + 1):
+                instruction = instructions[i]
+                kind = instruction.hash_category
+                hash_name = None
+                if kind is not None:
+                    value = (instruction.int_value & 0xffffffff) if kind == 'int' else instruction.hash
+                    hash_name = resolver.resolve(value, kind).name
+                yield {
+                    'file': filename,
+                    'function': function.name_hash,
+                    'function_name': function_name,
+                    'block': block_name,
+                    'block_index': basic_block.index,
+                    'offset': instruction.offset,
+                    'opcode': instruction.opcode.mnemonic,
+                    'opcode_value': instruction.opcode.value,
+                    'operands': _decode_operands(instruction),
+                    'hash_name': hash_name,
+                    'hash_kind': kind,
+                }
+
+def iter_instruction_records(path:str, *, filename:str=None, cache:'ScriptCache'=None, options:Optional[ILFormat]=None) -> Iterator[dict]:
+    """Read a .mjo (or .mjb) script and yield one record per instruction
+
+    filename is the "file" field (defaults to the base name of path),
+    functions are analyzed lazily as records are consumed.
+    """
+    from .binary import read_binary, BINARY_EXT
+    if os.path.splitext(path)[1].lower() == BINARY_EXT:
+        script, cfg = read_binary(path)
+    elif cache is not None:
+        script, cfg = cache.load(path)
+    else:
+        with open(path, 'rb') as f:
+            script = MjoScript.disassemble_script(f)
+        cfg = ControlFlowGraph.build_from_script(script)
+    return iter_script_records(os.path.basename(path) if filename is None else filename, script, cfg, options=options)
+
+def iter_jsonl_lines(records:Iterable[dict]) -> Iterator[str]:
+    """Encode records as JSON Lines (without line endings)
+    """
+    encode = _ENCODER.encode
+    for record in records:
+        yield encode(record)
+
+def write_jsonl(writer:TextIO, records:Iterable[dict]) -> int:
+    """Write records as JSON Lines in joined chunks, returns the number of records written
+    """
+    return write_lines(writer, iter_jsonl_lines(records))
+
+
+del Iterable, Iterator, Optional, TextIO  # cleanup declaration-only imports
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""Majiro resource file (.csv resfile) loader, shared by all assembled scripts
+"""
+
+__version__ = '0.1.0'
+__date__    = '2021-05-10'
+__author__  = 'Robert Jordan'
+
+__all__ = ['ResourceTable', 'MappedResourceTable', 'ResourceLoader', 'ResourceDuplicate', 'RESOURCE_LOADER', 'MMAP_THRESHOLD']
+
+#######################################################################################
+
+## RESOURCE FILE FORMAT ##
+#
+# CSV (utf-8): first row is the column names ['Key','Value'], then one row per resource:
+#  KEY,VALUE
+#
+# tables are parsed once per process and cached by (path, mtime),
+#  files of MMAP_THRESHOLD bytes or more only index key -> record range, values are decoded on lookup.
+# duplicate keys don't stop loading (the last row wins), they're collected once per file for reporting.
+
+import csv, io, mmap, os
+from collections import namedtuple
+from typing import Dict, Iterator, List, NoReturn, Optional, Tuple  # for hinting in declarations
+
+from ._util import unescape
+
+
+# file size for an mmap-backed index, instead of a dict of all values
+MMAP_THRESHOLD:int = 16 * 1024 * 1024
+
+# line: line number of the duplicate row, first_line: line number of the previous row with the same key
+ResourceDuplicate = namedtuple('ResourceDuplicate', ('path', 'key', 'line', 'first_line'))
+
+
+def _iter_rows(reader:Iterator[list], path:str, *, strict:bool, escaped:bool) -> Iterator[Tuple[str, str]]:
+    """Yield (key, value) for all resource rows of a csv reader (checking the column names row)
+    """
+    first = True
+    for row in reader:
+        if not row: #TODO: is this possible?
+            continue
+        if first:
+            first = False
+            if strict and tuple(r.lower() for r in row) != ('key', 'value'):
+                raise Exception(f'Invalid resource file {os.path.basename(path)!r}. Expected first row to have column names [\'Key\',\'Value\'], not {row!r}')
+            continue
+        yield _row_value(row, strict=strict, escaped=escaped)
+
+def _row_value(row:list, *, strict:bool, escaped:bool) -> Tuple[str, str]:
+    if not strict and len(row) == 1:
+        return (row[0], '')
+    key, value = row
+    if escaped:
+        value = unescape(value, not strict)
+    return (key, value)
+
+
+class ResourceTable:
+    """Resource key/value lookup for one resource file
+    """
+    def __init__(self, path:str, values:Dict[str, str]=None):
+        self.path:str = path
+        self.values:Dict[str, str] = {} if values is None else values
+        self.duplicates:List[ResourceDuplicate] = []
+
+    def get(self, key:str, default:Optional[str]=None) -> Optional[str]:
+        return self.values.get(key, default)
+    def __contains__(self, key:str) -> bool:
+        return key in self.values
+    def __len__(self) -> int:
+        return len(self.values)
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.values)
+    def close(self) -> NoReturn:
+        pass
+
+    @classmethod
+    def read(cls, path:str, *, delimiter:str=',', strict:bool=True, escaped:bool=False) -> 'ResourceTable':
+        table = cls(path)
+        values = table.values
+        lines:Dict[str, int] = {}
+        with open(path, 'rt', encoding='utf-8') as f:
+            reader = csv.reader(f, delimiter=delimiter or ',')
+            for key,value in _iter_rows(reader, path, strict=strict, escaped=escaped):
+                if key in lines:
+                    table.duplicates.append(ResourceDuplicate(path, key, reader.line_num, lines[key]))
+                lines[key] = reader.line_num
+                values[key] = value
+        return table
+
+
+class MappedResourceTable(ResourceTable):
+    """Resource lookup for large resource files, only record ranges are kept in memory (values are parsed on lookup)
+    """
+    def __init__(self, path:str, file:io.BufferedReader, data:mmap.mmap, *, delimiter:str=',', strict:bool=True, escaped:bool=False):
+        super().__init__(path)
+        self.file:io.BufferedReader = file
+        self.data:mmap.mmap = data
+        self.delimiter:str = delimiter or ','
+        self.strict:bool = strict
+        self.escaped:bool = escaped
+        # key -> (start, end) byte range of the row
+        self.index:Dict[str, Tuple[int, int]] = {}
+
+    def get(self, key:str, default:Optional[str]=None) -> Optional[str]:
+        span = self.index.get(key, None)
+        if span is None:
+            return default
+        text = self.data[span[0]:span[1]].decode('utf-8').replace('\r\n', '\n')
+        row = next(csv.reader(io.StringIO(text), delimiter=self.delimiter))
+        return _row_value(row, strict=self.strict, escaped=self.escaped)[1]
+    def __contains__(self, key:str) -> bool:
+        return key in self.index
+    def __len__(self) -> int:
+        return len(self.index)
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index)
+    def close(self) -> NoReturn:
+        self.data.close()
+        self.file.close()
+
+    @classmethod
+    def read(cls, path:str, *, delimiter:str=',', strict:bool=True, escaped:bool=False) -> 'MappedResourceTable':
+        file = open(path, 'rb')
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            file.close()
+            raise
+        table = cls(path, file, data, delimiter=delimiter, strict=strict, escaped=escaped)
+        index = table.index
+        lines:Dict[str, int] = {}
+        # the csv reader pulls only the lines of one row at a time, so data.tell() is the end of the last row read
+        def iter_lines():
+            for line in iter(data.readline, b''):
+                yield line.decode('utf-8').replace('\r\n', '\n')
+        reader = csv.reader(iter_lines(), delimiter=delimiter or ',')
+        start = 0
+        first = True
+        for row in reader:
+            end = data.tell()
+            if not row:
+                pass
+            elif first:
+                first = False
+                if strict and tuple(r.lower() for r in row) != ('key', 'value'):
+                    table.close()
+                    raise Exception(f'Invalid resource file {os.path.basename(path)!r}. Expected first row to have column names [\'Key\',\'Value\'], not {row!r}')
+            else:
+                key = row[0]
+                if not strict and len(row) == 1:
+                    pass
+                elif len(row) != 2:
+                    table.close()
+                    raise Exception(f'Invalid resource file {os.path.basename(path)!r}. Expected 2 columns on line {reader.line_num}, not {len(row)}')
+                if key in lines:
+                    table.duplicates.append(ResourceDuplicate(path, key, reader.line_num, lines[key]))
+                lines[key] = reader.line_num
+                index[key] = (start, end)
+            start = end
+        return table
+
+
+class ResourceLoader:
+    """Cache of parsed resource files by (path, mtime), with duplicate key diagnostics collected for reporting
+    """
+    def __init__(self, *, mmap_threshold:int=MMAP_THRESHOLD):
+        self.mmap_threshold:int = mmap_threshold
+        # (abspath, delimiter, strict, escaped) -> (mtime_ns, size, table)
+        self.tables:Dict[tuple, Tuple[int, int, ResourceTable]] = {}
+        self.duplicates:List[ResourceDuplicate] = []  # not yet reported
+
+    def load(self, path:str, *, delimiter:str=',', strict:bool=True, escaped:bool=False) -> ResourceTable:
+        """Return the resource table for a file, only parsing it if not cached or modified since
+        """
+        abspath = os.path.abspath(path)
+        st = os.stat(abspath)
+        key = (abspath, delimiter or ',', strict, escaped)
+        cached = self.tables.get(key, None)
+        if cached is not None:
+            if cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+                return cached[2]
+            cached[2].close()
+        if st.st_size >= self.mmap_threshold:
+            table = MappedResourceTable.read(abspath, delimiter=delimiter, strict=strict, escaped=escaped)
+        else:
+            table = ResourceTable.read(abspath, delimiter=delimiter, strict=strict, escaped=escaped)
+        self.tables[key] = (st.st_mtime_ns, st.st_size, table)
+        self.duplicates.extend(table.duplicates)
+        return table
+
+    def pop_duplicates(self) -> List[ResourceDuplicate]:
+        """Return the duplicate keys found since the last call (each file's duplicates are only returned once per parse)
+        """
+        duplicates, self.duplicates = self.duplicates, []
+        return duplicates
+
+    def clear(self) -> NoReturn:
+        for _,_,table in self.tables.values():
+            table.close()
+        self.tables.clear()
+        self.duplicates.clear()
+
+
+# shared by all assemblers in a process
+RESOURCE_LOADER:ResourceLoader = ResourceLoader()
+
+
+del Dict, Iterator, List, NoReturn, Optional, Tuple  # cleanup declaration-only imports
@@ -14,16 +14,19 @@ __all__ = ['Instruction', 'MjoScript', 'BasicBlock', 'Function']
 
 #######################################################################################
 
-import io, math, re  # math used for isnan()
+import bisect, io, math, re  # math used for isnan()
 from abc import abstractproperty
 from collections import namedtuple
-from typing import Iterator, List, NoReturn, Optional, Tuple  # for hinting in declarations
+from functools import lru_cache
+from struct import pack, pack_into
+from typing import Callable, Dict, Iterator, List, NoReturn, Optional, Pattern, Tuple, Union  # for hinting in declarations
 
-from ._util import StructIO, DummyColors, Colors, signed_i, unsigned_I
+from ._util import StructIO, DummyColors, Colors, signed_i, unsigned_I, escape_literal
 from .flags import MjoType, MjoScope, MjoInvert, MjoModifier, MjoDimension, MjoFlags
 from .opcodes import Opcode
 from . import crypt
 from . import known_hashes
+from . import stats
 
 ## FORMAT OPTIONS ##
 
@@ -49,6 +52,7 @@ class ILFormat:
         self.explicit_inline_resource:bool = False  # %{hashname}  [requires: resfile_directive="anything"]
         self.implicit_local_groups:bool = False  # always exclude empty group name from known local names
         self.annotate_hex:bool     = True  # enables/disables ; $XXXXXXXX annotations when using inline hashes
+        self.hash_cache_size:int   = 4096  # max entries cached by the known hash resolver (0 disables caching)
 
         # aliasing and operands:
         self.modifier_aliases:bool = False  # (variable flags) inc.x, dec.x, x.inc, x.dec
@@ -66,17 +70,49 @@ class ILFormat:
         self.opcode_padding:int    = 13    # number of EXTRA spaces to pad opcodes with (from the start of the opcode)
                                            # one mandatory space is always added AFTER this for operands
 
+    def __setattr__(self, name:str, value) -> NoReturn:
+        object.__setattr__(self, name, value)
+        if name == 'address_len':
+            object.__setattr__(self, '_address_fmt', '{{:0{0}x}}'.format(max(2, int(value))).format)
+        elif name[0] != '_' and name != 'group_directive':
+            # compiled instruction formats and resolved hash names depend on all options
+            #  except address_len and group_directive (which is part of the resolver cache key)
+            object.__setattr__(self, '_templates', {})
+            object.__setattr__(self, '_resolver', None)
+
+    # compiled formats, resolver, and bound address format are rebuilt after copy/pickle,
+    #  copies never share caches, and options can be sent to worker processes
+    def __getstate__(self) -> dict:
+        state = dict(self.__dict__)
+        for name in ('_templates', '_resolver', '_address_fmt'):
+            state.pop(name, None)
+        return state
+    def __setstate__(self, state:dict) -> NoReturn:
+        self.__dict__.update(state)
+        object.__setattr__(self, '_templates', {})
+        object.__setattr__(self, '_resolver', None)
+        self.address_len = self.address_len  # rebuild _address_fmt
+
+    @property
+    def resolver(self) -> 'HashResolver':
+        """Known hash name resolver for this formatting session (created on first use)
+        """
+        resolver = self._resolver
+        if resolver is None:
+            resolver = HashResolver(self, self.hash_cache_size)
+            object.__setattr__(self, '_resolver', resolver)
+        return resolver
+
     def set_address_len(self, bytecode_size:int) -> NoReturn:
         self.address_len = max(2, len(f'{bytecode_size:x}'))
 
     def address_fmt(self, offset) -> str:
-        return '{{:0{0}x}}'.format(max(2, int(self.address_len))).format(offset)
+        return self._address_fmt(offset)
 
     def needs_explicit_hash(self, known_hash:str) -> bool:
-        import re
         # return True if setting is enabled, or unsupported identifier characters exist
         #source: <https://stackoverflow.com/a/1325265/7517185>
-        return self.explicit_inline_hash or bool(re.search(r'[^_%@#$0-9A-Za-z]', known_hash))
+        return self.explicit_inline_hash or bool(RE_EXPLICIT_HASH_CHARS.search(known_hash))
         
     
     @classmethod
@@ -89,6 +125,77 @@ class ILFormat:
 
 ILFormat.DEFAULT = ILFormat()
 
+# characters that require the explicit inline hash syntax ${name}
+RE_EXPLICIT_HASH_CHARS:Pattern = re.compile(r'[^_%@#$0-9A-Za-z]')
+
+
+## KNOWN HASH RESOLVER ##
+
+# name: known name after group stripping (or None), is_syscall: name is from SYSCALLS,
+# inline: formatted inline hash operand $name / ${name} (or None when name is None)
+ResolvedHash = namedtuple('ResolvedHash', ('name', 'is_syscall', 'inline'))
+
+class HashResolver:
+    """Known hash name lookup, group stripping, and inline hash formatting for an ILFormat
+
+    results are memoized in a bounded LRU cache by (hash, category, group directive),
+    category is one of: 'syscall', 'call', 'var', 'int' (ldc.i literals).
+    """
+    def __init__(self, options:ILFormat, cache_size:int=4096):
+        self.options:ILFormat = options
+        if cache_size:
+            self._resolve = lru_cache(maxsize=cache_size)(self._resolve)
+
+    def resolve(self, value:int, category:str) -> ResolvedHash:
+        return self._resolve(value, category, self.options.group_directive)
+
+    def cache_info(self) -> Optional[Tuple[int, int]]:
+        """Return the (hits, misses) of the memoized results, or None without a cache
+        """
+        cache_info = getattr(self._resolve, 'cache_info', None)
+        return tuple(cache_info()[:2]) if cache_info is not None else None
+
+    def lookup(self, value:int, category:str) -> Tuple[Optional[str], bool]:
+        """Return the known (name, is_syscall) before group stripping
+        """
+        if category == 'syscall':
+            return (known_hashes.SYSCALLS.get(value, None), True)
+        elif category == 'call':
+            return (known_hashes.FUNCTIONS.get(value, None), False)
+        elif category == 'var':
+            # TODO: this could be optimized to use the type flags
+            #       and search in the scope-independent dicts
+            return (known_hashes.VARIABLES.get(value, None), False)
+        elif category == 'int':
+            name = known_hashes.FUNCTIONS.get(value, None)
+            # TODO: Uncomment if it's observed that int literals
+            #       will use hashes for types other than usercalls
+            if name is None:
+                name = known_hashes.VARIABLES.get(value, None)
+            if name is None:
+                return (known_hashes.SYSCALLS.get(value, None), True)
+            return (name, False)
+        return (None, False)  # not an opcode that relates to hashes
+
+    def _resolve(self, value:int, category:str, group_directive:Optional[str]) -> ResolvedHash:
+        options:ILFormat = self.options
+        name, syscall = self.lookup(value, category)
+        name = Instruction.check_hash_group(name, syscall, options=options)
+        if name is None:
+            return ResolvedHash(None, syscall, None)
+        colors:dict = options.colors
+        if syscall:
+            hash_color = '{BRIGHT}{YELLOW}'.format(**colors)
+            name2 = name.lstrip('$') # requirement for syscall hash lookup syntax
+        else:
+            hash_color = ('{BRIGHT}{BLUE}' if (category == 'call' or (category == 'int' and name[0] == '$')) else '{BRIGHT}{RED}').format(**colors)
+            name2 = name
+        if options.needs_explicit_hash(name2):
+            inline = '{BRIGHT}{CYAN}${{{RESET_ALL}{}{}{RESET_ALL}{BRIGHT}{CYAN}}}{RESET_ALL}'.format(hash_color, name2, **colors)
+        else:
+            inline = '{BRIGHT}{CYAN}${RESET_ALL}{}{}{RESET_ALL}'.format(hash_color, name2, **colors)
+        return ResolvedHash(name, syscall, inline)
+
 
 class Instruction:
     """Bytecode instruction of opcode, offset, operands, and optionally analysis data
@@ -145,19 +252,10 @@ class Instruction:
         
     @classmethod
     def format_string(cls, string:str, *, options:ILFormat=ILFormat.DEFAULT) -> str:
-        import re
         colors:dict = options.colors
-        # unescape single quotes and escape double-quotes
-        # string = repr(string)[1:-1].replace('\\\'', '\'').replace('\"', '\\\"')
-        string = repr(string)[1:-1]
-        # this pattern ensures ignoring any leading escaped backslashes
-        # unescape single-quotes
-        string = re.sub(r'''(?<!\\)((?:\\\\)*)(?:\\('))''', r'\1\2', string)
-        # escape double-quotes
-        string = re.sub(r'''(?<!\\)((?:\\\\)*)(?:("))''', r'\1\\\2', string)
-        if options.color:
-            # brighten escapes
-            string = re.sub(r'''\\(x[0-9A-Fa-f]{2}|u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|[0-7]{1,3}|[\\\\'\\"abfnrtv])''', r'{BRIGHT}\0{DIM}'.format(**colors), string)
+        # unescape single quotes and escape double-quotes (one translate pass, see escape_literal)
+        # brighten escapes: NUL is what the previous re.sub(..., r'{BRIGHT}\0{DIM}') template emitted, keep output stable
+        string = escape_literal(string, '{BRIGHT}\x00{DIM}'.format(**colors) if options.color else None)
         return '{DIM}{GREEN}"{}"{RESET_ALL}'.format(string, **colors)
 
     @classmethod
@@ -181,216 +279,220 @@ class Instruction:
                 pass
         return name
 
-    def check_known_hash(self, *, options:ILFormat=ILFormat.DEFAULT) -> Optional[Tuple[str, bool]]: # (name, is_syscall)
-        name, syscall = (None, False)  # not an opcode that relates to hashes
+    @property
+    def hash_category(self) -> Optional[str]:
+        """Known hash category for HashResolver: 'syscall', 'call', 'var', 'int', or None
+        """
         if self.is_syscall:
-            name = known_hashes.SYSCALLS.get(self.hash, None)
-            syscall = True
+            return 'syscall'
         elif self.is_call:
-            name = known_hashes.FUNCTIONS.get(self.hash, None)
+            return 'call'
         elif self.is_load or self.is_store:
-            # TODO: this could be optimized to use the type flags
-            #       and search in the scope-independent dicts
-            name = known_hashes.VARIABLES.get(self.hash, None)
+            return 'var'
         elif self.opcode.mnemonic == "ldc.i": # 0x800
-            name = known_hashes.FUNCTIONS.get(unsigned_I(self.int_value), None)
-            # TODO: Uncomment if it's observed that int literals
-            #       will use hashes for types other than usercalls
-            if name is None:
-                name = known_hashes.VARIABLES.get(unsigned_I(self.int_value), None)
-            if name is None:
-                name = known_hashes.SYSCALLS.get(unsigned_I(self.int_value), None)
-                syscall = True
+            return 'int'
+        return None
 
-        return (self.check_hash_group(name, syscall, options=options), syscall)
+    def check_known_hash(self, *, options:ILFormat=ILFormat.DEFAULT) -> Optional[Tuple[str, bool]]: # (name, is_syscall)
+        category = self.hash_category
+        if category is None:
+            return (None, False)  # not an opcode that relates to hashes
+        resolved = options.resolver.resolve(unsigned_I(self.int_value) if category == 'int' else self.hash, category)
+        return (resolved.name, resolved.is_syscall)
 
     def print_instruction(self, *, options:ILFormat=ILFormat.DEFAULT, resource_key:str=None, **kwargs) -> NoReturn:
         print(self.format_instruction(options=options, resource_key=resource_key), **kwargs)
     def format_instruction(self, *, options:ILFormat=ILFormat.DEFAULT, resource_key:str=None) -> str:
-        colors:dict = options.colors
-        sb:str = ''
-
-        if options.address_labels:
-            address = options.address_fmt(self.offset)
-            sb += '{BRIGHT}{BLACK}{0}:{RESET_ALL} '.format(address, **colors)
-        if self.opcode.mnemonic == "line":  # 0x83a
-            sb += '{BRIGHT}{BLACK}{0.opcode.mnemonic}{RESET_ALL}'.format(self, **colors)
-        else:
-            sb += '{BRIGHT}{WHITE}{0.opcode.mnemonic}{RESET_ALL}'.format(self, **colors)
-
-        if not self.opcode.encoding:
-            return sb  # no operands, nothing to add
-
-        # padding after opcode (min 1 space, which is not included in padding option count)
-        sb += ' ' + (' ' * max(0, options.opcode_padding - len(self.opcode.mnemonic)))
-
-        known_hash_name, known_hash_is_syscall = None, False
-        if options.known_hashes:
-            known_hash_name, known_hash_is_syscall = self.check_known_hash(options=options)
-
-        operands = []
-        for operand in self.opcode.encoding:
-            op = None  # if assigned, append to operands at bottom of loop
-
+        template = options._templates.get(self.opcode.value, None)
+        if template is None:
+            template = options._templates[self.opcode.value] = self.compile_format(self.opcode, options=options)
+        return template(self, resource_key)
+    @classmethod
+    def compile_format(cls, opcode:Opcode, *, options:ILFormat=ILFormat.DEFAULT) -> Callable[['Instruction', Optional[str]], str]:
+        """Compile a formatter for all instructions of an opcode with fixed format options
+
+        returns format(instruction, resource_key) -> str
+        """
+        C:dict = options.colors
+        RESET:str = C['RESET_ALL']
+        mnemonic:str = opcode.mnemonic
+        encoding:str = opcode.encoding
+
+        address_labels:bool = options.address_labels
+        address_pre:str = '{BRIGHT}{BLACK}'.format(**C)
+        address_post:str = ':{RESET_ALL} '.format(**C)
+        head:str = ('{BRIGHT}{BLACK}' if mnemonic == "line" else '{BRIGHT}{WHITE}').format(**C) + mnemonic + RESET  # 0x83a
+        if encoding:
+            # padding after opcode (min 1 space, which is not included in padding option count)
+            head += ' ' + (' ' * max(0, options.opcode_padding - len(mnemonic)))
+
+        # hash category of the opcode
+        is_syscall:bool = mnemonic in ("syscall", "syscallp")  # 0x834, 0x835
+        is_call:bool    = mnemonic in ("call", "callp")  # 0x80f, 0x810
+        is_var:bool     = mnemonic in ("ld", "ldelem") or mnemonic.startswith("st")
+        is_ldc_i:bool   = mnemonic == "ldc.i"  # 0x800
+        category:Optional[str] = 'syscall' if is_syscall else ('call' if is_call else ('var' if is_var else ('int' if is_ldc_i else None)))
+        check_hashes:bool = options.known_hashes and category is not None
+        resolve = options.resolver.resolve
+        UNKNOWN:ResolvedHash = ResolvedHash(None, False, None)
+
+        CYAN:str = '{BRIGHT}{CYAN}'.format(**C)
+        MAGENTA:str = '{BRIGHT}{MAGENTA}'.format(**C)
+
+        # operand formatters: fmt(instruction, resolved_hash, resource_key) -> Optional[str]
+        formatters:list = []
+        for operand in encoding:
             if operand == 't':
                 # type list
-                types = ', '.join('{BRIGHT}{CYAN}{}{RESET_ALL}'.format(t.getname(options.typelist_aliases), **colors) for t in self.type_list)
-                op = '[{}]'.format(types)
+                type_names:dict = {}
+                alias:bool = options.typelist_aliases
+                def fmt(instr, resolved, reskey, type_names=type_names, alias=alias):
+                    names = []
+                    for t in instr.type_list:
+                        tname = type_names.get(t, None)
+                        if tname is None:
+                            tname = type_names[t] = CYAN + str(t.getname(alias)) + RESET
+                        names.append(tname)
+                    return '[' + ', '.join(names) + ']'
             elif operand == 's':
                 # string data
-                if resource_key is None:
-                    op = self.format_string(self.string, options=options)
-                elif options.explicit_inline_resource:
-                    op = '{BRIGHT}{CYAN}%{{{RESET_ALL}{}{BRIGHT}{CYAN}}}{RESET_ALL}'.format(resource_key, **colors)
+                if options.explicit_inline_resource:
+                    res_pre, res_post = CYAN + '%{' + RESET, CYAN + '}' + RESET
                 else:
-                    op = '{BRIGHT}{CYAN}%{RESET_ALL}{}'.format(resource_key, **colors)
+                    res_pre, res_post = CYAN + '%' + RESET, ''
+                def fmt(instr, resolved, reskey, res_pre=res_pre, res_post=res_post):
+                    if reskey is None:
+                        return cls.format_string(instr.string, options=options)
+                    return res_pre + reskey + res_post
             elif operand == 'f':
-                # flags
-                flags = self.flags
-                keywords:list = []
-                keywords.append(flags.scope.getname(options.scope_aliases))
-                keywords.append(flags.type.getname(options.vartype_aliases))
-                if flags.dimension or options.explicit_dim0:  #NOTE: dim0 is legal, just not required or recommended
-                    keywords.append(flags.dimension.getname(options.explicit_dim0))
-                if flags.invert:
-                    keywords.append(flags.invert.getname(options.invert_aliases))
-                if flags.modifier:
-                    keywords.append(flags.modifier.getname(options.modifier_aliases))
-
-                # push joined flag keywords as one operand, since technically it is only one
-                op = '{BRIGHT}{CYAN}{}{RESET_ALL}'.format(' '.join(keywords), **colors)
+                # flags (joined keywords as one operand, since technically it is only one)
+                flag_names:dict = {}
+                def fmt(instr, resolved, reskey, flag_names=flag_names):
+                    op = flag_names.get(instr.flags, None)
+                    if op is None:
+                        flags = instr.flags
+                        keywords:list = []
+                        keywords.append(flags.scope.getname(options.scope_aliases))
+                        keywords.append(flags.type.getname(options.vartype_aliases))
+                        if flags.dimension or options.explicit_dim0:  #NOTE: dim0 is legal, just not required or recommended
+                            keywords.append(flags.dimension.getname(options.explicit_dim0))
+                        if flags.invert:
+                            keywords.append(flags.invert.getname(options.invert_aliases))
+                        if flags.modifier:
+                            keywords.append(flags.modifier.getname(options.modifier_aliases))
+                        op = flag_names[instr.flags] = CYAN + ' '.join(keywords) + RESET
+                    return op
             elif operand == 'h':
                 # hash value
-                if self.is_syscall:
-                    hash_color = '{BRIGHT}{YELLOW}'.format(**colors)
-                elif self.is_call:
-                    hash_color = '{BRIGHT}{BLUE}'.format(**colors)
-                else: #elif self.is_load or self.is_store:
-                    hash_color = '{BRIGHT}{RED}'.format(**colors)
-                if known_hash_name and options.inline_hash and (options.syscall_inline_hash or not self.is_syscall):
-                    known_hash_name2 = known_hash_name
-                    if self.is_syscall:
-                        known_hash_name2 = known_hash_name.lstrip('$') # requirement for syscall hash lookup syntax
-                    if options.needs_explicit_hash(known_hash_name2):
-                        op = '{BRIGHT}{CYAN}${{{RESET_ALL}{}{}{RESET_ALL}{BRIGHT}{CYAN}}}{RESET_ALL}'.format(hash_color, known_hash_name2, **colors)
-                    else:
-                        op = '{BRIGHT}{CYAN}${RESET_ALL}{}{}{RESET_ALL}'.format(hash_color, known_hash_name2, **colors)
-                else:
-                    op = '${:08x}{RESET_ALL}'.format(self.hash, **colors)
+                use_inline:bool = options.inline_hash and (options.syscall_inline_hash or not is_syscall)
+                def fmt(instr, resolved, reskey, use_inline=use_inline):
+                    if resolved.name and use_inline:
+                        return resolved.inline
+                    return '${:08x}'.format(instr.hash) + RESET
             elif operand == 'o':
                 # variable offset
                 #NEW: exclude -1 offsets for non-local variables, because that operand
                 #     isn't used. still output erroneous var offsets (aka anything other than -1)
-                if options.explicit_varoffset or self.var_offset != -1 or self.flags.scope is MjoScope.LOCAL:
-                    op = '{:d}'.format(self.var_offset)
+                explicit_varoffset:bool = options.explicit_varoffset
+                def fmt(instr, resolved, reskey):
+                    if explicit_varoffset or instr.var_offset != -1 or instr.flags.scope is MjoScope.LOCAL:
+                        return '{:d}'.format(instr.var_offset)
+                    return None
             elif operand == '0':
                 # 4 byte address placeholder
-                pass
+                continue
             elif operand == 'i':
                 # integer constant
                 # integer literals will sometimes use hashes for usercall function pointers
-                # this entire if statement tree is terrifying...
-                if known_hash_name is not None:
-                    if known_hash_is_syscall:
-                        hash_color = '{BRIGHT}{YELLOW}'.format(**colors)
-                    elif known_hash_name[0] == '$':
-                        hash_color = '{BRIGHT}{BLUE}'.format(**colors)
-                    else: #elif self.is_load or self.is_store:
-                        hash_color = '{BRIGHT}{RED}'.format(**colors)
-
-                    if options.inline_hash and options.int_inline_hash and (options.syscall_inline_hash or not known_hash_is_syscall):
-                        known_hash_name2 = known_hash_name
-                        if known_hash_is_syscall:
-                            known_hash_name2 = known_hash_name.lstrip('$') # requirement for syscall hash lookup syntax
-                        if options.needs_explicit_hash(known_hash_name2):
-                            op = '{BRIGHT}{CYAN}${{{RESET_ALL}{}{}{RESET_ALL}{BRIGHT}{CYAN}}}{RESET_ALL}'.format(hash_color, known_hash_name2, **colors)
-                        else:
-                            op = '{BRIGHT}{CYAN}${RESET_ALL}{}{}{RESET_ALL}'.format(hash_color, known_hash_name2, **colors)
-                    else:
-                        # print as hex for simplicity (this can also be printed with $XXXXXXXX notation)
-                        op = '0x{:08x}'.format(unsigned_I(self.int_value))
-                else:
-                    op = '{:d}'.format(signed_i(self.int_value))
+                use_inline:bool = options.inline_hash and options.int_inline_hash
+                syscall_inline:bool = options.syscall_inline_hash
+                def fmt(instr, resolved, reskey, use_inline=use_inline):
+                    if resolved.name is None:
+                        return '{:d}'.format(signed_i(instr.int_value))
+                    if use_inline and (syscall_inline or not resolved.is_syscall):
+                        return resolved.inline
+                    # print as hex for simplicity (this can also be printed with $XXXXXXXX notation)
+                    return '0x{:08x}'.format(unsigned_I(instr.int_value))
             elif operand == 'r':
                 # float constant
-                if self.float_value == float('inf'):
-                    op = '+Inf'
-                elif self.float_value == float('-inf'):
-                    op = '-Inf'
-                elif math.isnan(self.float_value):
-                    op = 'NaN'
-                else:
-                    op = '{:g}'.format(self.float_value)  # fixed or exponential
-                    try:
-                        int(op, 10)  # test if no decimal or exponent
+                def fmt(instr, resolved, reskey):
+                    value = instr.float_value
+                    if value == float('inf'):
+                        return '+Inf'
+                    elif value == float('-inf'):
+                        return '-Inf'
+                    elif math.isnan(value):
+                        return 'NaN'
+                    op = '{:g}'.format(value)  # fixed or exponential
+                    if op.lstrip('-').isdigit():  # test if no decimal or exponent
                         op += '.0'  # append '.0' for all floats that parse to integers
-                    except:
-                        pass  # fine just the way it is
+                    return op
             elif operand == 'a':
                 # argument count
-                op = '({:d})'.format(self.argument_count)
+                def fmt(instr, resolved, reskey):
+                    return '({:d})'.format(instr.argument_count)
             elif operand == 'j':
                 # jump offset
-                if self.jump_target is not None:
-                    op = '{BRIGHT}{MAGENTA}@{}{RESET_ALL}'.format(self.jump_target.name, **colors)
-                else:
-                    op = '{BRIGHT}{MAGENTA}@~{:+04x}{RESET_ALL}'.format(self.jump_offset, **colors)
+                def fmt(instr, resolved, reskey):
+                    if instr.jump_target is not None:
+                        return MAGENTA + '@' + instr.jump_target.name + RESET
+                    return MAGENTA + '@~{:+04x}'.format(instr.jump_offset) + RESET
             elif operand == 'l':
                 # line number
-                op = '{BRIGHT}{BLACK}#{:d}{RESET_ALL}'.format(self.line_number, **colors)
+                line_pre:str = '{BRIGHT}{BLACK}#'.format(**C)
+                def fmt(instr, resolved, reskey, line_pre=line_pre):
+                    return line_pre + '{:d}'.format(instr.line_number) + RESET
             elif operand == 'c':
                 # switch case table
-                if self.switch_targets: # is not None:
-                    op = ', '.join('{BRIGHT}{MAGENTA}@{}{RESET_ALL}'.format(t.name, **colors) for t in self.switch_targets) # pylint: disable=not-an-iterable
-                else:
-                    op = ', '.join(', '.join('{BRIGHT}{MAGENTA}@~{:+04x}{RESET_ALL}'.format(o, **colors) for o in self.switch_cases))
+                def fmt(instr, resolved, reskey):
+                    if instr.switch_targets:
+                        return ', '.join(MAGENTA + '@' + t.name + RESET for t in instr.switch_targets)
+                    # (joins the characters of the offsets, kept for identical output)
+                    return ', '.join(', '.join(MAGENTA + '@~{:+04x}'.format(o) + RESET for o in instr.switch_cases))
             else:
                 raise Exception('Unrecognized encoding specifier: {!r}'.format(operand))
-            
-            # append operand (if defined)
-            if op is not None:
-                operands.append(op)
-        
-        if operands: # append space-separated operands
-            sb += ' '.join(operands)
-
-        if known_hash_name is None or not options.annotations:
-            pass  # no hash name comments
-        elif self.is_syscall: # 0x834, 0x835
-            if not options.inline_hash or not options.syscall_inline_hash:
-                # sb = sb.ljust(ops_offset + 16 + len(colors["BRIGHT"]) + len(colors["YELLOW"]) + len(colors["RESET_ALL"]))
-                sb += '  {BRIGHT}{BLACK}; {DIM}{YELLOW}{}{RESET_ALL}'.format(known_hash_name, **colors)
-            elif options.annotate_hex:
-                sb += '  {BRIGHT}{BLACK}; {DIM}{YELLOW}${:08x}{RESET_ALL}'.format(self.hash, **colors)
-        elif self.is_call: # 0x80f, 0x810
-            if not options.inline_hash:
-                # sb = sb.ljust(ops_offset + 16 + len(colors["BRIGHT"]) + len(colors["BLUE"]) + len(colors["RESET_ALL"]))
-                sb += '  {BRIGHT}{BLACK}; {DIM}{BLUE}{}{RESET_ALL}'.format(known_hash_name, **colors)
-            elif options.annotate_hex:
-                sb += '  {BRIGHT}{BLACK}; {DIM}{BLUE}${:08x}{RESET_ALL}'.format(self.hash, **colors)
-        elif self.is_load or self.is_store:
-            if not options.inline_hash:
-                sb += '  {BRIGHT}{BLACK}; {DIM}{RED}{}{RESET_ALL}'.format(known_hash_name, **colors)
-            elif options.annotate_hex:
-                sb += '  {BRIGHT}{BLACK}; {DIM}{RED}${:08x}{RESET_ALL}'.format(self.hash, **colors)
-        elif self.opcode.mnemonic == "ldc.i": # 0x800
-            # check for loading function hashes (which are often passed to )
-            if known_hash_is_syscall:
-                hash_color = '{DIM}{YELLOW}'.format(**colors)
-            elif known_hash_name[0] == '$':
-                hash_color = '{DIM}{BLUE}'.format(**colors)
-            else: #elif self.is_load or self.is_store:
-                hash_color = '{DIM}{RED}'.format(**colors)
-
-            ## testing reversal of the conditional branching behemoth below:
-            # def test(a,b,c,d): return (not a or not b or (c and not d)) == (a and b and (not c or d))
-            # [tuple(o) for o in combos if test(*o)]
-            if not options.inline_hash or not options.int_inline_hash or (known_hash_is_syscall and not options.syscall_inline_hash):
-                #sb = sb.ljust(ops_offset + 16)
-                sb += '  {BRIGHT}{BLACK}; {RESET_ALL}{}{}{RESET_ALL}'.format(hash_color, known_hash_name, **colors)
-            elif options.annotate_hex:
-                sb += '  {BRIGHT}{BLACK}; {RESET_ALL}{}${:08x}{RESET_ALL}'.format(hash_color, unsigned_I(self.int_value), **colors)
-        return sb
+            formatters.append(fmt)
+
+        # hash name comments
+        annotate:Callable[['Instruction', ResolvedHash], str] = None
+        if check_hashes and options.annotations:
+            comment:str = '  {BRIGHT}{BLACK}; '.format(**C)
+            if is_syscall or is_call or is_var:
+                name_color = ('{DIM}{YELLOW}' if is_syscall else ('{DIM}{BLUE}' if is_call else '{DIM}{RED}')).format(**C)
+                if not options.inline_hash or (is_syscall and not options.syscall_inline_hash):
+                    annotate = lambda instr, resolved: comment + name_color + resolved.name + RESET
+                elif options.annotate_hex:
+                    annotate = lambda instr, resolved: comment + name_color + '${:08x}'.format(instr.hash) + RESET
+            elif is_ldc_i:
+                # check for loading function hashes (which are often passed to )
+                dim_colors:tuple = ('{DIM}{YELLOW}'.format(**C), '{DIM}{BLUE}'.format(**C), '{DIM}{RED}'.format(**C))
+                comment += RESET
+                no_inline:bool = not options.inline_hash or not options.int_inline_hash
+                annotate_hex:bool = options.annotate_hex
+                def annotate(instr, resolved):
+                    name, syscall = resolved.name, resolved.is_syscall
+                    hash_color = dim_colors[0] if syscall else (dim_colors[1] if name[0] == '$' else dim_colors[2])
+                    if no_inline or (syscall and not options.syscall_inline_hash):
+                        return comment + hash_color + name + RESET
+                    elif annotate_hex:
+                        return comment + hash_color + '${:08x}'.format(unsigned_I(instr.int_value)) + RESET
+                    return ''
+
+        def format_instruction(instr:'Instruction', resource_key:str=None) -> str:
+            sb:str = (address_pre + options.address_fmt(instr.offset) + address_post + head) if address_labels else head
+            if not formatters:
+                return sb
+            if check_hashes:
+                resolved = resolve(unsigned_I(instr.int_value) if is_ldc_i else instr.hash, category)
+            else:
+                resolved = UNKNOWN
+            operands = [op for op in (fmt(instr, resolved, resource_key) for fmt in formatters) if op is not None]
+            if operands: # append space-separated operands
+                sb += ' '.join(operands)
+            if annotate is not None and resolved.name is not None:
+                sb += annotate(instr, resolved)
+            return sb
+        return format_instruction
 
     @classmethod
     def read_instruction(cls, reader:StructIO, offset:int) -> 'Instruction':
@@ -447,58 +549,67 @@ class Instruction:
         return instruction
     
     def write_instruction(self, writer:StructIO) -> NoReturn:
-        offset = writer.tell()
+        data = self.encode()
+        assert(self.size == len(data)), f'{self.offset:05x}: {self.opcode.mnemonic}'
+        writer.write(data)
+
+    def encode(self) -> bytes:
+        """Return the bytecode of this instruction
+        """
         opcode = self.opcode
-        writer.pack('<H', opcode.value)
+        parts:list = [pack('<H', opcode.value)]
         for operand in opcode.encoding:
             if operand == 't':
                 # type list
-                writer.pack('<H', len(self.type_list))  # count
-                writer.pack(f'<{len(self.type_list)}B', *[t.value for t in self.type_list])  # types
+                parts.append(pack('<H', len(self.type_list)))  # count
+                parts.append(pack(f'<{len(self.type_list)}B', *[t.value for t in self.type_list]))  # types
             elif operand == 's':
                 # string data
-                writer.pack('<H', len(self.string.encode("cp932"))+1)  # size + null terminator
-                writer.pack(f'<{len(self.string.encode("cp932"))+1}s', self.string.encode("cp932"))  # string + null terminator
+                parts.append(pack('<H', len(self.string.encode("cp932"))+1))  # size + null terminator
+                parts.append(pack(f'<{len(self.string.encode("cp932"))+1}s', self.string.encode("cp932")))  # string + null terminator
             elif operand == 'f':
                 # flags
-                writer.pack('<H', int(self.flags))  #currently flags is a type that subclasses int, but do this anyway
+                parts.append(pack('<H', int(self.flags)))  #currently flags is a type that subclasses int, but do this anyway
             elif operand == 'h':
                 # hash value
                 # this shouldn't happen... buuuuut, be safe and force unsigned
-                writer.pack('<I', unsigned_I(self.hash))  # hash value
+                parts.append(pack('<I', unsigned_I(self.hash)))  # hash value
             elif operand == 'o':
                 # variable offset
-                writer.pack('<h', self.var_offset)
+                parts.append(pack('<h', self.var_offset))
             elif operand == '0':
                 # 4 byte address placeholder
-                writer.pack('<I', 0)  # 4 byte address placeholder  (always 0)
+                parts.append(pack('<I', 0))  # 4 byte address placeholder  (always 0)
             elif operand == 'i':
                 # integer constant
-                writer.pack('<i', signed_i(self.int_value))  # integer constant
+                parts.append(pack('<i', signed_i(self.int_value)))  # integer constant
             elif operand == 'r':
                 # float constant
-                writer.pack('<f', self.float_value)  # float constant
+                parts.append(pack('<f', self.float_value))  # float constant
             elif operand == 'a':
                 # argument count
-                writer.pack('<H', self.argument_count)  # argument count
+                parts.append(pack('<H', self.argument_count))  # argument count
             elif operand == 'j':
                 # jump offset
-                writer.pack('<i', self.jump_offset)  # jump offset
+                parts.append(pack('<i', self.jump_offset))  # jump offset
             elif operand == 'l':
                 # line number
-                writer.pack('<H', self.line_number)  # line number
+                parts.append(pack('<H', self.line_number))  # line number
             elif operand == 'c':
                 # switch case table
-                writer.pack('<H', len(self.switch_cases))  # count
-                writer.pack(f'<{len(self.switch_cases)}i', *self.switch_cases)  # cases
+                parts.append(pack('<H', len(self.switch_cases)))  # count
+                parts.append(pack(f'<{len(self.switch_cases)}i', *self.switch_cases))  # cases
             else:
                 raise Exception('Unrecognized encoding specifier: {!r}'.format(operand))
-        assert(self.size == (writer.tell() - offset)), f'{self.offset:05x}: {opcode.mnemonic}'
+        return b''.join(parts)
 
 
 # function entry type declared in table in MjoScript header before bytecode
 FunctionEntry = namedtuple('FunctionEntry', ('name_hash', 'offset'))
 
+# bytecode copied per read() when written from a file
+BYTECODE_CHUNK_SIZE:int = 1024 * 1024
+
 
 class MjoScript:
     """Majiro .mjo script type and disassembler
@@ -514,6 +625,12 @@ class MjoScript:
         self.bytecode_size:int = bytecode_size
         self.functions:List[FunctionEntry] = functions
         self.instructions:List[Instruction] = instructions
+        self.revision:int = 0  # incremented by mark_modified(), used to invalidate cached analysis
+
+    def mark_modified(self) -> NoReturn:
+        """Signal that instructions or functions have changed, invalidating any cached analysis
+        """
+        self.revision += 1
 
     def get_resource_key(self, instruction:Instruction, *, options:ILFormat=ILFormat.DEFAULT) -> str:
         if options.resfile_directive and instruction.opcode.mnemonic == "text": # 0x840
@@ -531,6 +648,17 @@ class MjoScript:
         return None
         # index = self.instruction_index_from_offset(instruction.offset)
         # number = len([1 for i in range(index) if self.instructions[i].opcode.mnemonic == "text"]) # 0x840
+    def get_resource_keys(self, *, options:ILFormat=ILFormat.DEFAULT) -> Dict[int, str]:
+        """Return resource keys for all text instructions by offset, in one pass (empty without a resfile directive)
+        """
+        keys:Dict[int, str] = {}
+        if options.resfile_directive:
+            number = 0
+            for instr in self.instructions:
+                if instr.opcode.mnemonic == "text": # 0x840
+                    number += 1
+                    keys[instr.offset] = f'L{number}' # number will be 1-indexed
+        return keys
     @property
     def is_readmark(self) -> bool:
         # preprocessor "#use_readflg on" setting, we need to export this with IL
@@ -547,8 +675,99 @@ class MjoScript:
             if instr.offset == offset:
                 return i
         return -1
-    
-    def assemble_script(self, writer:io.BufferedWriter) -> NoReturn:
+
+    def patch_strings(self, patches:Dict[Union[int,str], str], bytecode:Optional[bytes]=None) -> Optional[bytearray]:
+        """Replace string operands by instruction offset or resource key (L1, L2, ... text instructions),
+        and relocate everything after them (instructions, jumps, switch cases, functions, main_offset)
+
+        bytecode is the original decrypted bytecode (see disassemble_script_bytecode), when passed the patched
+        bytecode is returned, with only the patched strings and relocated jump/switch operands re-encoded.
+        """
+        instructions = self.instructions
+        index_of:Dict[Union[int,str], int] = {instr.offset: i for i,instr in enumerate(instructions)}
+        if any(isinstance(key, str) for key in patches):
+            number = 0
+            for i,instr in enumerate(instructions):
+                if instr.opcode.mnemonic == "text": # 0x840
+                    number += 1
+                    index_of[f'L{number}'] = i # number will be 1-indexed
+
+        # old offset -> (instruction, old size)
+        patched:Dict[int, Tuple[Instruction, int]] = {}
+        for key,string in patches.items():
+            i = index_of.get(key, None)
+            if i is None:
+                raise Exception(f'No instruction found for string patch {key!r}')
+            instr = instructions[i]
+            if 's' not in instr.opcode.encoding:
+                raise Exception(f'Cannot patch string operand of {instr.opcode.mnemonic} instruction at 0x{instr.offset:05x}')
+            old_size = patched[instr.offset][1] if instr.offset in patched else instr.size
+            size = old_size + len(string.encode('cp932')) - len(instr.string.encode('cp932'))
+            instr.string = string
+            instr.size = size
+            patched[instr.offset] = (instr, old_size)
+
+        # size delta of all patches before an old offset (prefix sums)
+        patch_offsets:List[int] = sorted(patched)
+        shifts:List[int] = [0]
+        for offset in patch_offsets:
+            instr, old_size = patched[offset]
+            shifts.append(shifts[-1] + instr.size - old_size)
+        def relocate(offset:int) -> int:
+            return offset + shifts[bisect.bisect_left(patch_offsets, offset)]
+
+        # unchanged ranges are copied, patched instructions re-encoded
+        new_bytecode:Optional[bytearray] = None
+        if bytecode is not None:
+            parts:List[bytes] = []
+            last = 0
+            for offset in patch_offsets:
+                instr, old_size = patched[offset]
+                parts.append(bytecode[last:offset])
+                parts.append(instr.encode())
+                last = offset + old_size
+            parts.append(bytecode[last:])
+            new_bytecode = bytearray(b''.join(parts))
+
+        # one pass relocating instructions and their relative jump/switch operands
+        shift = 0
+        for instr in (instructions if any(shifts) else ()):  # nothing to relocate when no sizes changed
+            offset = instr.offset
+            new_offset = offset + shift
+            if offset in patched:
+                shift += instr.size - patched[offset][1]
+            encoding = instr.opcode.encoding
+            if encoding == 'j':
+                target = offset + instr.size + instr.jump_offset
+                jump_offset = relocate(target) - (new_offset + instr.size)
+                if jump_offset != instr.jump_offset:
+                    instr.jump_offset = jump_offset
+                    if new_bytecode is not None:
+                        pack_into('<i', new_bytecode, new_offset + instr.size - 4, jump_offset)
+            elif encoding == 'c':
+                cases = instr.switch_cases
+                for i,case in enumerate(cases):
+                    base = 2 + 2 + (i * 4) + 4  # opcode, case count, cases (relative to end of case)
+                    case_offset = relocate(offset + base + case) - (new_offset + base)
+                    if case_offset != case:
+                        cases[i] = case_offset
+                        if new_bytecode is not None:
+                            pack_into('<i', new_bytecode, new_offset + base - 4, case_offset)
+            instr.offset = new_offset
+
+        self.functions = [FunctionEntry(fn.name_hash, relocate(fn.offset)) for fn in self.functions]
+        if self.main_offset is not None:
+            self.main_offset = relocate(self.main_offset)
+        if self.bytecode_size is not None:
+            self.bytecode_size += shifts[-1]
+        self.mark_modified()
+        return new_bytecode
+
+    def assemble_script(self, writer:io.BufferedWriter, bytecode:Union[bytes, io.BufferedReader, None]=None) -> NoReturn:
+        """Write the .mjo file, bytecode is the already assembled bytecode (i.e. MjILAssembler.bytecode), or None to encode the instructions
+
+        bytecode can also be a binary file positioned at the start of the bytecode (i.e. MjILAssembler.bytecode_writer), copied in chunks.
+        """
         if not isinstance(writer, StructIO):
             writer = StructIO(writer)
 
@@ -566,12 +785,23 @@ class MjoScript:
         # bytecode:
         writer.pack('<I', self.bytecode_size)
 
-        # initialize full-length of bytecode ahead of time (is this actually efficient in Python?)
-        ms:io.BytesIO = io.BytesIO(bytes(self.bytecode_size))
-        self.assemble_bytecode(StructIO(ms))
-        ms.flush()
-
-        bytecode:bytes = ms.getvalue()
+        if hasattr(bytecode, 'read'):
+            written_size = 0
+            for chunk in iter(lambda: bytecode.read(BYTECODE_CHUNK_SIZE), b''):
+                if is_encrypted:
+                    chunk = crypt.crypt32(chunk, written_size)  # encrypt bytecode
+                written_size += writer.write(chunk)
+            if written_size != self.bytecode_size:
+                raise Exception(f'assembled bytecode size {written_size} does not match script bytecode size {self.bytecode_size}')
+            return
+        if bytecode is None:
+            # initialize full-length of bytecode ahead of time (is this actually efficient in Python?)
+            ms:io.BytesIO = io.BytesIO(bytes(self.bytecode_size))
+            self.assemble_bytecode(StructIO(ms))
+            ms.flush()
+            bytecode = ms.getvalue()
+        elif len(bytecode) != self.bytecode_size:
+            raise Exception(f'assembled bytecode size {len(bytecode)} does not match script bytecode size {self.bytecode_size}')
         if is_encrypted:
             bytecode = crypt.crypt32(bytecode)  # encrypt bytecode
         written_size = writer.write(bytecode)
@@ -579,6 +809,12 @@ class MjoScript:
 
     @classmethod
     def disassemble_script(cls, reader:io.BufferedReader) -> 'MjoScript':
+        return cls.disassemble_script_bytecode(reader)[0]
+
+    @classmethod
+    def disassemble_script_bytecode(cls, reader:io.BufferedReader) -> Tuple['MjoScript', bytes]:
+        """Return the script and its decrypted bytecode (i.e. for patch_strings)
+        """
         if not isinstance(reader, StructIO):
             reader = StructIO(reader)
 
@@ -596,13 +832,18 @@ class MjoScript:
         bytecode_size:int = reader.unpackone('<I')
 
         bytecode_offset:int = reader.tell()
-        bytecode:bytes = reader.read(bytecode_size)
+        with stats.phase('read'):
+            bytecode:bytes = reader.read(bytecode_size)
         if is_encrypted:
-            bytecode = crypt.crypt32(bytecode)  # decrypt bytecode
+            with stats.phase('decrypt'):
+                bytecode = crypt.crypt32(bytecode)  # decrypt bytecode
+            stats.add('bytes_decrypted', len(bytecode))
         ms:io.BytesIO = io.BytesIO(bytecode)
-        instructions:List[Instruction] = cls.disassemble_bytecode(StructIO(ms))
+        with stats.phase('decode'):
+            instructions:List[Instruction] = cls.disassemble_bytecode(StructIO(ms))
+        stats.add('instructions_decoded', len(instructions))
 
-        return MjoScript(signature, main_offset, line_count, bytecode_offset, bytecode_size, functions, instructions)
+        return (MjoScript(signature, main_offset, line_count, bytecode_offset, bytecode_size, functions, instructions), bytecode)
 
     def assemble_bytecode(self, writer:StructIO) -> NoReturn:
         if not isinstance(writer, StructIO):
@@ -682,6 +923,7 @@ class BasicBlock(_Block):
     def __init__(self, function:'Function'):
         super().__init__()
         self.function = function
+        self.index:int = -1  # index in function.basic_blocks (assigned by analysis)
         self.is_entry_block:bool = False
         self.is_exit_block:bool = False
         self.is_dtor_block:bool = False  # destructor {} syntax with op.847 (bsel.5)
@@ -723,6 +965,8 @@ class Function(_BlockContainer):
     """Function block, containing nested instruction blocks
     """
     def __init__(self, script:MjoScript, name_hash:int):
+        # deferred analysis callback, assigned by ControlFlowGraph for lazy functions
+        self._pending_analysis:Optional[Callable[['Function'], NoReturn]] = None
         super().__init__()
         self._script:MjoScript = script
         self.name_hash:int = name_hash
@@ -736,6 +980,50 @@ class Function(_BlockContainer):
     def is_entrypoint(self) -> bool:
         return self.start_offset == self.script.main_offset
 
+    #region # lazy analysis properties:
+    @property
+    def is_analyzed(self) -> bool:
+        return self._pending_analysis is None
+    def analyze(self) -> NoReturn:
+        """Build basic blocks for this function if analysis was deferred
+        """
+        analyze, self._pending_analysis = self._pending_analysis, None
+        if analyze is not None:
+            try:
+                analyze(self)
+            except:
+                self._pending_analysis = analyze  # leave function in deferred state
+                raise
+    @property
+    def basic_blocks(self) -> List[BasicBlock]:
+        self.analyze()
+        return self._basic_blocks
+    @basic_blocks.setter
+    def basic_blocks(self, basic_blocks:List[BasicBlock]) -> NoReturn:
+        self._basic_blocks = basic_blocks
+    @property
+    def entry_block(self) -> BasicBlock:
+        self.analyze()
+        return self._entry_block
+    @entry_block.setter
+    def entry_block(self, entry_block:BasicBlock) -> NoReturn:
+        self._entry_block = entry_block
+    @property
+    def exit_blocks(self) -> List[BasicBlock]:
+        self.analyze()
+        return self._exit_blocks
+    @exit_blocks.setter
+    def exit_blocks(self, exit_blocks:List[BasicBlock]) -> NoReturn:
+        self._exit_blocks = exit_blocks
+    @property
+    def parameter_types(self) -> List[MjoType]:
+        self.analyze()
+        return self._parameter_types
+    @parameter_types.setter
+    def parameter_types(self, parameter_types:List[MjoType]) -> NoReturn:
+        self._parameter_types = parameter_types
+    #endregion
+
     def print_function(self, *, options:ILFormat=ILFormat.DEFAULT, **kwargs) -> NoReturn:
         print(self.format_function(options=options), **kwargs)
     def format_function(self, *, options:ILFormat=ILFormat.DEFAULT) -> str:
@@ -746,10 +1034,7 @@ class Function(_BlockContainer):
 
         known_hash:str = None
         if options.known_hashes:
-            known_hash = known_hashes.FUNCTIONS.get(self.name_hash, None)
-        if known_hash is not None:
-            #TODO: move check hash function somewhere more fitting
-            known_hash = Instruction.check_hash_group(known_hash, False, options=options)
+            known_hash = options.resolver.resolve(self.name_hash, 'call').name
         if known_hash is not None and options.inline_hash:
             if options.needs_explicit_hash(known_hash):
                 s += '{BRIGHT}{CYAN}${{{BRIGHT}{BLUE}{}{BRIGHT}{CYAN}}}{BRIGHT}{BLUE}'.format(known_hash, **colors)
@@ -782,4 +1067,4 @@ class Function(_BlockContainer):
         return '}' if options.braces else ''
 
 
-del abstractproperty, namedtuple, Iterator, NoReturn, Optional, Tuple  # cleanup declaration-only imports
+del abstractproperty, namedtuple, Callable, Dict, Iterator, NoReturn, Optional, Pattern, Tuple, Union  # cleanup declaration-only imports
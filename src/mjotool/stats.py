@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""Majiro per-file phase timers and counters (--stats / --profile)
+"""
+
+__version__ = '0.1.0'
+__date__    = '2021-05-10'
+__author__  = 'Robert Jordan'
+
+__all__ = ['Stats', 'StatsConfig', 'phase', 'add', 'measure', 'aggregate', 'format_stats', 'format_size', 'PHASES', 'COUNTERS']
+
+#######################################################################################
+
+## INSTRUMENTATION ##
+#
+# library code marks phases with `with stats.phase(name):` and counts with `stats.add(name, n)`,
+#  both do nothing unless a file is being measured (stats.active is None otherwise),
+#  and are only used once per file or function (never per instruction or line).
+#
+# phase times are exclusive: time spent in a nested phase (i.e. lazy 'cfg' analysis during 'format')
+#  is only counted for the nested phase, so the phase times of a file add up to its total time.
+#
+# with a profile directory, every phase also has its own cProfile.Profile (only enabled for that phase's
+#  exclusive time), written to DIR/PHASE.PID.prof after each file (load with pstats.Stats).
+#
+# with memprofile, tracemalloc traces all allocations: traced memory is recorded after every phase,
+#  and a snapshot is taken after top-level phases (only when larger than the file's previous snapshot),
+#  the largest snapshot gives the top allocation sites of the file. memory growth is the file's traced
+#  peak minus the traced memory before the file, this is what memory_budget is checked against.
+
+import os, sys, time
+from collections import namedtuple
+from typing import Dict, Iterable, Iterator, List, NoReturn, Optional  # for hinting in declarations
+
+
+# report order (unknown names are reported after these)
+PHASES:tuple = ('read', 'cache', 'decrypt', 'decode', 'cfg', 'format', 'parse', 'encode', 'write')
+COUNTERS:tuple = ('bytes_read', 'bytes_decrypted', 'instructions_decoded', 'blocks_built', 'lines_formatted',
+                  'hash_cache_hits', 'hash_cache_misses', 'script_cache_hits', 'script_cache_misses',
+                  'lines_parsed', 'functions_assembled', 'function_cache_hits', 'function_cache_misses', 'bytes_written')
+
+try:
+    import resource  # peak RSS (not available on Windows)
+except ImportError:
+    resource = None
+
+# profile_dir: write cProfile output per phase to this directory (None to only time phases)
+# memprofile: trace memory with tracemalloc, memory_budget: maximum memory growth of a file in bytes (None for no limit)
+# memory_top: number of top allocation sites reported per file
+StatsConfig = namedtuple('StatsConfig', ('profile_dir', 'memprofile', 'memory_budget', 'memory_top'), defaults=(None, False, None, 10))
+
+
+class _NullPhase:
+    """Reusable no-op context manager returned by phase() while nothing is measured
+    """
+    __slots__ = ()
+    def __enter__(self): return None
+    def __exit__(self, *exc): return False
+
+_NULL_PHASE:_NullPhase = _NullPhase()
+
+# cProfile.Profile per phase name (shared by all files measured in this process)
+_profilers:dict = {}
+
+
+class Stats:
+    """Phase times (exclusive seconds) and counters of one file
+    """
+    def __init__(self, name:str, config:StatsConfig=StatsConfig()):
+        self.name:str = name
+        self.config:StatsConfig = config
+        self.phases:Dict[str, float] = {}
+        self.counters:Dict[str, int] = {}
+        self.total:float = 0.0
+        self._stack:list = []  # [phase name, start time] of open phases
+        # memprofile only: traced bytes after each phase (largest), traced bytes before the file, largest snapshot
+        self.memory:Optional[dict] = None
+        self._memory_start:int = 0
+        self._snapshot = None  # tracemalloc.Snapshot (tracemalloc is only imported for memprofile)
+        self._snapshot_size:int = -1
+
+    def add(self, counter:str, count:int=1) -> NoReturn:
+        self.counters[counter] = self.counters.get(counter, 0) + count
+
+    def _profiler(self, name:str):
+        profiler = _profilers.get(name, None)
+        if profiler is None:
+            import cProfile
+            profiler = _profilers[name] = cProfile.Profile()
+        return profiler
+
+    def begin(self, name:str) -> NoReturn:
+        now = time.perf_counter()
+        if self._stack:  # pause the parent phase
+            parent = self._stack[-1]
+            self.phases[parent[0]] = self.phases.get(parent[0], 0.0) + (now - parent[1])
+            if self.config.profile_dir is not None:
+                self._profiler(parent[0]).disable()
+        self._stack.append([name, now])
+        if self.config.profile_dir is not None:
+            self._profiler(name).enable()
+
+    def end(self) -> NoReturn:
+        now = time.perf_counter()
+        name, start = self._stack.pop()
+        self.phases[name] = self.phases.get(name, 0.0) + (now - start)
+        if self.config.profile_dir is not None:
+            self._profiler(name).disable()
+        if self.memory is not None:
+            self._trace_memory(name)
+            now = time.perf_counter()  # don't count snapshots in the parent phase
+        if self._stack:  # resume the parent phase
+            self._stack[-1][1] = now
+            if self.config.profile_dir is not None:
+                self._profiler(self._stack[-1][0]).enable()
+
+    def _trace_memory(self, name:str) -> NoReturn:
+        import tracemalloc
+        current = tracemalloc.get_traced_memory()[0]
+        phases = self.memory['phases']
+        phases[name] = max(phases.get(name, 0), current)
+        if not self._stack and current > self._snapshot_size:  # top-level phase
+            self._snapshot = tracemalloc.take_snapshot()
+            self._snapshot_size = current
+
+    def begin_memory(self) -> NoReturn:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if hasattr(tracemalloc, 'reset_peak'):  # Python 3.9+
+            tracemalloc.reset_peak()
+        self._memory_start = tracemalloc.get_traced_memory()[0]
+        self.memory = {'start': self._memory_start, 'peak': 0, 'growth': 0, 'rss': None, 'phases': {}, 'top': []}
+
+    def end_memory(self) -> NoReturn:
+        import tracemalloc
+        memory = self.memory
+        memory['peak'] = tracemalloc.get_traced_memory()[1]
+        memory['growth'] = max(0, memory['peak'] - self._memory_start)
+        memory['rss'] = peak_rss()
+        if self._snapshot is not None:
+            snapshot = self._snapshot.filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                tracemalloc.Filter(False, '<unknown>'),
+            ))
+            memory['top'] = [('{}:{:d}'.format(s.traceback[0].filename, s.traceback[0].lineno), s.size, s.count)
+                             for s in snapshot.statistics('lineno')[:self.config.memory_top]]
+            self._snapshot = None
+
+    def budget_error(self) -> Optional[str]:
+        """Return an error message if the file's memory growth exceeded the configured budget
+        """
+        budget = self.config.memory_budget
+        if self.memory is None or budget is None or self.memory['growth'] <= budget:
+            return None
+        return 'memory budget exceeded: {} > {}'.format(format_size(self.memory['growth']), format_size(budget))
+
+    def as_dict(self) -> dict:
+        record = {'file': self.name, 'total': self.total, 'phases': dict(self.phases), 'counters': dict(self.counters)}
+        if self.memory is not None:
+            record['memory'] = dict(self.memory)
+        return record
+
+
+class _Phase:
+    __slots__ = ('stats', 'name')
+    def __init__(self, stats:Stats, name:str):
+        self.stats, self.name = stats, name
+    def __enter__(self):
+        self.stats.begin(self.name)
+    def __exit__(self, *exc):
+        self.stats.end()
+        return False
+
+
+def peak_rss() -> Optional[int]:
+    """Return the peak resident set size of this process in bytes (None if unsupported)
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024  # bytes on macOS, KiB elsewhere
+
+
+# file currently being measured (None when --stats is disabled, or outside of measure())
+active:Optional[Stats] = None
+
+def phase(name:str):
+    """Return a context manager timing a phase of the measured file (no-op when nothing is measured)
+    """
+    return _NULL_PHASE if active is None else _Phase(active, name)
+
+def add(counter:str, count:int=1) -> NoReturn:
+    """Add to a counter of the measured file (no-op when nothing is measured)
+    """
+    if active is not None:
+        active.add(counter, count)
+
+class measure:
+    """Context manager measuring one file, yields its Stats (or None when config is None)
+
+    with stats.measure(path, config) as record: ...
+    """
+    def __init__(self, name:str, config:Optional[StatsConfig]):
+        self.stats:Optional[Stats] = Stats(name, config) if config is not None else None
+        self.start:float = 0.0
+        self.previous:Optional[Stats] = None
+    def __enter__(self) -> Optional[Stats]:
+        global active
+        if self.stats is not None:
+            self.previous, active = active, self.stats
+            if self.stats.config.memprofile:
+                self.stats.begin_memory()
+            self.start = time.perf_counter()
+        return self.stats
+    def __exit__(self, *exc):
+        global active
+        stats = self.stats
+        if stats is not None:
+            while stats._stack:  # phases left open by an exception
+                stats.end()
+            stats.total = time.perf_counter() - self.start
+            active = self.previous
+            if stats.memory is not None:
+                stats.end_memory()
+            if stats.config.profile_dir is not None:
+                os.makedirs(stats.config.profile_dir, exist_ok=True)
+                for name,profiler in _profilers.items():
+                    profiler.dump_stats(os.path.join(stats.config.profile_dir, f'{name}.{os.getpid():d}.prof'))
+        return False
+
+
+## REPORTING ##
+
+def format_size(size:int) -> str:
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(size) < 1024:
+            return '{:.1f}{}'.format(size, unit) if unit != 'B' else '{:d}B'.format(size)
+        size /= 1024
+    return '{:.1f}GiB'.format(size)
+
+def aggregate(records:Iterable[dict]) -> dict:
+    """Return the sum of per-file stats records (as_dict), memory is the maximum over all files
+    """
+    total = {'file': None, 'files': 0, 'total': 0.0, 'phases': {}, 'counters': {}}
+    for record in records:
+        total['files'] += 1
+        total['total'] += record['total']
+        for key in ('phases', 'counters'):
+            for name,value in record[key].items():
+                total[key][name] = total[key].get(name, 0) + value
+        memory = record.get('memory', None)
+        if memory is not None:
+            tmemory = total.setdefault('memory', {'peak': 0, 'growth': 0, 'rss': None, 'phases': {}, 'file': None})
+            if memory['growth'] >= tmemory['growth']:
+                tmemory['growth'], tmemory['file'] = memory['growth'], record['file']
+            tmemory['peak'] = max(tmemory['peak'], memory['peak'])
+            if memory['rss'] is not None:
+                tmemory['rss'] = max(tmemory['rss'] or 0, memory['rss'])
+            for name,value in memory['phases'].items():
+                tmemory['phases'][name] = max(tmemory['phases'].get(name, 0), value)
+    return total
+
+def _ordered(names:Iterable[str], order:tuple) -> List[str]:
+    names = set(names)
+    return [n for n in order if n in names] + sorted(n for n in names if n not in order)
+
+def format_stats(records:List[dict], *, per_file:bool=True) -> Iterator[str]:
+    """Yield text report lines: one block per file (when per_file), then the aggregate
+    """
+    def block(title:str, record:dict):
+        total = record['total']
+        yield '{} ({:.1f}ms)'.format(title, total * 1000)
+        for name in _ordered(record['phases'], PHASES):
+            seconds = record['phases'][name]
+            yield '  {:<22} {:>10.1f}ms {:>6.1f}%'.format(name, seconds * 1000, (seconds / total * 100) if total else 0)
+        for name in _ordered(record['counters'], COUNTERS):
+            yield '  {:<22} {:>12d}'.format(name, record['counters'][name])
+        memory = record.get('memory', None)
+        if memory is not None:
+            yield '  {:<22} {:>12}'.format('memory_peak', format_size(memory['peak']))
+            yield '  {:<22} {:>12}'.format('memory_growth', format_size(memory['growth'])) + \
+                  ('  ({})'.format(memory['file']) if memory.get('file', None) is not None else '')
+            if memory['rss'] is not None:
+                yield '  {:<22} {:>12}'.format('peak_rss', format_size(memory['rss']))
+            for name in _ordered(memory['phases'], PHASES):
+                yield '  {:<22} {:>12}'.format('memory_after_' + name, format_size(memory['phases'][name]))
+            for site,size,count in memory.get('top', ()):
+                yield '    {:>10} {:>8d}  {}'.format(format_size(size), count, site)
+    if per_file:
+        for record in records:
+            yield from block(record['file'], record)
+    total = aggregate(records)
+    yield from block('total: {:d} files'.format(total['files']), total)
+
+
+del Dict, Iterable, Iterator, List, NoReturn, Optional  # cleanup declaration-only imports
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""Majiro batch input discovery (streaming recursive directory walker)
+"""
+
+__version__ = '0.1.0'
+__date__    = '2021-05-10'
+__author__  = 'Robert Jordan'
+
+__all__ = ['FileEntry', 'walk_files', 'SYMLINK_POLICIES']
+
+#######################################################################################
+
+import os
+from collections import namedtuple
+from fnmatch import fnmatch
+from typing import Iterable, Iterator, Optional, Set, Tuple  # for hinting in declarations
+
+
+# path: joined with the walked directory, relpath: relative to the walked directory (always '/' separators)
+FileEntry = namedtuple('FileEntry', ('path', 'relpath'))
+
+# symlink policies:
+#  'skip'   : ignore all symbolic links
+#  'files'  : follow links to files, ignore links to directories (default)
+#  'follow' : follow all links (directories already walked are skipped, to avoid cycles)
+SYMLINK_POLICIES:tuple = ('skip', 'files', 'follow')
+
+
+def match_any(relpath:str, patterns:Iterable[str]) -> bool:
+    """Return True if the relative path, or its base name, matches any glob pattern
+    """
+    name = relpath.rsplit('/', 1)[-1]
+    return any(fnmatch(relpath, p) or fnmatch(name, p) for p in patterns)
+
+def walk_files(directory:str, exts:Optional[Iterable[str]]=None, *, recurse:bool=False, include:Iterable[str]=(), exclude:Iterable[str]=(), symlinks:str='files') -> Iterator[FileEntry]:
+    """Yield all files in a directory (and subdirectories when recurse), in sorted order
+
+    entries are yielded while walking, so batches can start before the walk finishes.
+    exts:    lowercase extensions (with '.') to accept (case-insensitive), None for all files
+    include: glob patterns a file must match (relpath or name), empty to accept all
+    exclude: glob patterns of files and directories to skip (relpath or name)
+    """
+    if symlinks not in SYMLINK_POLICIES:
+        raise Exception('Unknown symlink policy {!r}, expected one of {!r}'.format(symlinks, SYMLINK_POLICIES))
+    exts = frozenset(e.lower() for e in exts) if exts is not None else None
+    include, exclude = tuple(include or ()), tuple(exclude or ())
+    visited:Set[Tuple[int,int]] = set()  # (st_dev, st_ino) of walked directories
+
+    def walk(dirpath:str, reldir:str):
+        st = os.stat(dirpath)
+        if (st.st_dev, st.st_ino) in visited:
+            return
+        visited.add((st.st_dev, st.st_ino))
+        with os.scandir(dirpath) as it:
+            entries = sorted(it, key=lambda e: e.name)
+        subdirs:list = []
+        for entry in entries:
+            relpath = (reldir + '/' + entry.name) if reldir else entry.name
+            if symlinks == 'skip' and entry.is_symlink():
+                continue
+            if entry.is_dir(follow_symlinks=(symlinks == 'follow')):
+                if recurse and not (exclude and match_any(relpath, exclude)):
+                    subdirs.append((entry.path, relpath))
+            elif entry.is_file():
+                if exts is not None and os.path.splitext(entry.name)[1].lower() not in exts:
+                    continue
+                if include and not match_any(relpath, include):
+                    continue
+                if exclude and match_any(relpath, exclude):
+                    continue
+                yield FileEntry(entry.path, relpath)
+        for subpath, subrel in subdirs:
+            yield from walk(subpath, subrel)
+
+    yield from walk(directory, '')
+
+
+del Iterable, Iterator, Optional, Set, Tuple  # cleanup declaration-only imports
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""Majiro streaming IL line emitter and buffered writer
+"""
+
+__version__ = '0.1.0'
+__date__    = '2021-05-10'
+__author__  = 'Robert Jordan'
+
+__all__ = ['iter_script_lines', 'write_lines', 'open_il_writer', 'WRITE_BUFFER_SIZE']
+
+#######################################################################################
+
+import io
+from typing import Callable, Iterable, Iterator, List, NoReturn, Optional, TextIO  # for hinting in declarations
+
+from .script import ILFormat, Instruction, MjoScript, Function
+from .analysis import ControlFlowGraph
+
+
+WRITE_BUFFER_SIZE:int = 1024 * 1024  # 1 MiB encoder buffer for .mjil output
+CHUNK_LINES:int = 512  # lines joined per write() call
+
+
+def iter_script_lines(filename:str, script:MjoScript, cfg:ControlFlowGraph, *, options:ILFormat=ILFormat.DEFAULT, functions:Optional[List[Function]]=None, on_resource:Callable[[str, Instruction], NoReturn]=None) -> Iterator[str]:
+    """Yield the IL lines (without line endings) of an analyzed script, one at a time
+
+    functions defaults to all functions in cfg,
+    on_resource(key, instruction) is called for every instruction moved to the resource file.
+    """
+    colors:dict = options.colors
+    # resource keys are numbered over the whole script, regardless of selected functions
+    resource_keys:dict = script.get_resource_keys(options=options)
+
+    # include extra indentation formatting for an easier time reading, and for language grammar VSCode extension
+    yield '{BRIGHT}{WHITE}/// {}{RESET_ALL}'.format(filename, **colors)
+    yield script.format_readmark(options=options)
+
+    for function in (cfg.functions if functions is None else functions):
+        yield ''
+        yield function.format_function(options=options)
+        basic_blocks = function.basic_blocks
+        for i,basic_block in enumerate(basic_blocks):
+            yield ' ' + basic_block.format_basic_block(options=options)
+            for instruction in basic_block.instructions:
+                reskey = resource_keys.get(instruction.offset, None) if resource_keys else None
+                if reskey is not None and on_resource is not None:
+                    on_resource(reskey, instruction)
+                yield '  ' + instruction.format_instruction(options=options, resource_key=reskey)
+            if i + 1 < len(basic_blocks):
+                yield ' '
+        yield function.format_function_close(options=options)
+
+def write_lines(writer:TextIO, lines:Iterable[str], *, chunk_lines:int=CHUNK_LINES) -> int:
+    """Write lines to a text stream in joined chunks, returns the number of lines written
+    """
+    count:int = 0
+    chunk:list = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= chunk_lines:
+            chunk.append('')  # trailing line ending
+            writer.write('\n'.join(chunk))
+            count += len(chunk) - 1
+            chunk.clear()
+    if chunk:
+        chunk.append('')
+        writer.write('\n'.join(chunk))
+        count += len(chunk) - 1
+    return count
+
+def open_il_writer(filename:str) -> TextIO:
+    """Open an .mjil file for writing through a large buffered UTF-8 encoder
+    """
+    return io.open(filename, 'wt', encoding='utf-8', buffering=WRITE_BUFFER_SIZE)
+
+
+del Callable, Iterable, Iterator, List, NoReturn, Optional, TextIO  # cleanup declaration-only imports
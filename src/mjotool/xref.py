@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+"""Majiro corpus-wide call graph, cross-reference, and hash occurrence indexes
+"""
+
+__version__ = '0.1.0'
+__date__    = '2021-05-10'
+__author__  = 'Robert Jordan'
+
+__all__ = ['XRef', 'XRefIndex', 'HashOccurrence', 'HashIndex']
+
+#######################################################################################
+
+## INDEX FILE FORMAT ##
+#
+# JSON: {"version": 1, "files": {RELPATH: FILE_RECORD, ...}}
+#
+# FILE_RECORD:
+#  "mtime":     st_mtime_ns of the scanned file
+#  "size":      st_size of the scanned file
+#  "functions": [[name_hash, offset], ...]
+#  "refs":      [[mnemonic, target_hash, caller_hash, offset, argument_count], ...]  (XRefIndex)
+#  "hashes":    [[kind, hash, function_hash, offset], ...]  (HashIndex)
+#
+# XRefIndex: ldc.i refs are stored for every int literal, and only treated as function
+#  pointers when the value matches a function defined in the corpus, or a known function hash.
+#
+# HashIndex: kind is one of 'syscall', 'call', 'var', or 'int' (int literals matching a known hash).
+
+import json, os
+from abc import ABCMeta, abstractmethod
+from bisect import bisect_right
+from collections import namedtuple
+from typing import Callable, Dict, Iterator, List, NoReturn, Optional, Set, Tuple  # for hinting in declarations
+
+from .script import MjoScript
+from .walk import walk_files
+from . import known_hashes
+
+
+XRef = namedtuple('XRef', ('kind', 'target', 'filename', 'caller', 'offset', 'argument_count'))
+HashOccurrence = namedtuple('HashOccurrence', ('kind', 'hash', 'filename', 'function', 'offset'))
+
+# mnemonics recorded as direct function references
+CALL_MNEMONICS:frozenset = frozenset(('call', 'callp', 'syscall', 'syscallp'))
+
+
+class _ScriptIndex(metaclass=ABCMeta):
+    """Base class for on-disk indexes of per-file .mjo script records
+
+    records are invalidated by the file's mtime and size.
+    """
+    VERSION:int = 1
+
+    def __init__(self):
+        self.files:Dict[str, dict] = {}
+
+    #region ## LOAD / SAVE ##
+
+    @classmethod
+    def load(cls, filename:str) -> '_ScriptIndex':
+        """Load an index file, returns an empty index if the file does not exist, or is from another version
+        """
+        index = cls()
+        if os.path.isfile(filename):
+            with open(filename, 'rt', encoding='utf-8') as reader:
+                data = json.load(reader)
+            if data.get('version', None) == cls.VERSION:
+                index.files = data['files']
+        return index
+
+    def save(self, filename:str) -> NoReturn:
+        with open(filename, 'wt', encoding='utf-8') as writer:
+            json.dump({'version': self.VERSION, 'files': self.files}, writer, separators=(',', ':'))
+
+    #endregion
+
+    #region ## BUILD ##
+
+    @classmethod
+    @abstractmethod
+    def scan_script(cls, script:MjoScript) -> dict:
+        """Return the file record (without stat fields) for a script
+        """
+
+    def invalidate(self) -> NoReturn:
+        """Clear lookup tables, rebuilt on the next query
+        """
+        pass
+
+    def refresh(self, path:str, key:str=None) -> Optional[MjoScript]:
+        """Re-scan a file if it's not indexed or stale, returns the decoded script if the file was scanned
+        """
+        if key is None:
+            key = path
+        st = os.stat(path)
+        record = self.files.get(key, None)
+        if record is not None and record['mtime'] == st.st_mtime_ns and record['size'] == st.st_size:
+            return None
+        with open(path, 'rb') as f:
+            script = MjoScript.disassemble_script(f)
+        record = self.scan_script(script)
+        record['mtime'] = st.st_mtime_ns
+        record['size'] = st.st_size
+        self.files[key] = record
+        self.invalidate()
+        return script
+
+    def update(self, directory:str, *, recurse:bool=False, **walk_options) -> Tuple[int, int]:
+        """Incrementally update the index from a directory of .mjo files
+
+        only files with a changed mtime or size are re-scanned, returns (scanned, removed)
+        walk_options: include, exclude and symlinks arguments of walk_files()
+        """
+        seen:set = set()
+        scanned:int = 0
+        for path, relpath in self._iter_files(directory, recurse, **walk_options):
+            seen.add(relpath)
+            if self.refresh(path, relpath) is not None:
+                scanned += 1
+        removed = [relpath for relpath in self.files if relpath not in seen]
+        for relpath in removed:
+            del self.files[relpath]
+        if removed:
+            self.invalidate()
+        return (scanned, len(removed))
+
+    @classmethod
+    def _iter_files(cls, directory:str, recurse:bool, **walk_options) -> Iterator[Tuple[str,str]]:
+        return walk_files(directory, ('.mjo',), recurse=recurse, **walk_options)
+
+    @classmethod
+    def _function_locator(cls, script:MjoScript) -> Callable[[int], Optional[int]]:
+        """Return a lookup from bytecode offset to the containing function hash
+        """
+        functions = sorted(script.functions, key=lambda f: f.offset)
+        starts = [f.offset for f in functions]
+        def locate(offset:int):
+            i = bisect_right(starts, offset) - 1
+            return functions[i].name_hash if i >= 0 else None
+        return locate
+
+    #endregion
+
+
+class XRefIndex(_ScriptIndex):
+    """Cross-reference index of calls and function pointers over a directory of .mjo scripts
+    """
+    def __init__(self):
+        super().__init__()
+        self._callers:Dict[int, List[XRef]] = None
+        self._callees:Dict[int, List[XRef]] = None
+        self._definitions:Dict[int, List[Tuple[str,int]]] = None
+
+    @classmethod
+    def scan_script(cls, script:MjoScript) -> dict:
+        locate = cls._function_locator(script)
+        refs:list = []
+        for instr in script.instructions:
+            mnemonic = instr.opcode.mnemonic
+            if mnemonic in CALL_MNEMONICS:
+                target, argc = instr.hash, instr.argument_count
+            elif mnemonic == 'ldc.i':
+                target, argc = instr.int_value & 0xffffffff, 0
+            else:
+                continue
+            refs.append([mnemonic, target, locate(instr.offset), instr.offset, argc])
+        return {
+            'functions': [[f.name_hash, f.offset] for f in script.functions],
+            'refs': refs,
+        }
+
+    #region ## QUERIES ##
+
+    def invalidate(self) -> NoReturn:
+        self._callers = self._callees = self._definitions = None
+
+    def _build_lookups(self) -> NoReturn:
+        callers:Dict[int, List[XRef]] = {}
+        callees:Dict[int, List[XRef]] = {}
+        definitions:Dict[int, List[Tuple[str,int]]] = {}
+        for relpath, record in self.files.items():
+            for name_hash, offset in record['functions']:
+                definitions.setdefault(name_hash, []).append((relpath, offset))
+        for relpath, record in self.files.items():
+            for mnemonic, target, caller, offset, argc in record['refs']:
+                if mnemonic == 'ldc.i' and target not in definitions and target not in known_hashes.FUNCTIONS:
+                    continue  # plain int literal
+                xref = XRef(mnemonic, target, relpath, caller, offset, argc)
+                callers.setdefault(target, []).append(xref)
+                if caller is not None:
+                    callees.setdefault(caller, []).append(xref)
+        self._callers, self._callees, self._definitions = callers, callees, definitions
+
+    def callers_of(self, name_hash:int) -> List[XRef]:
+        """Return all references to a function or syscall hash
+        """
+        if self._callers is None:
+            self._build_lookups()
+        return self._callers.get(name_hash, [])
+
+    def callees_of(self, name_hash:int) -> List[XRef]:
+        """Return all references made from within a function hash
+        """
+        if self._callees is None:
+            self._build_lookups()
+        return self._callees.get(name_hash, [])
+
+    def definitions_of(self, name_hash:int) -> List[Tuple[str,int]]:
+        """Return the (filename, offset) of all scripts defining a function hash
+        """
+        if self._definitions is None:
+            self._build_lookups()
+        return self._definitions.get(name_hash, [])
+
+    #endregion
+
+
+class HashIndex(_ScriptIndex):
+    """Inverted index of every hash operand occurrence in .mjo scripts
+    """
+    def __init__(self):
+        super().__init__()
+        self._occurrences:Dict[int, List[HashOccurrence]] = None
+
+    @classmethod
+    def scan_script(cls, script:MjoScript) -> dict:
+        locate = cls._function_locator(script)
+        hashes:list = []
+        for instr in script.instructions:
+            if instr.is_syscall:
+                kind, value = 'syscall', instr.hash
+            elif instr.is_call:
+                kind, value = 'call', instr.hash
+            elif instr.is_load or instr.is_store:
+                kind, value = 'var', instr.hash
+            elif instr.opcode.mnemonic == 'ldc.i':
+                value = instr.int_value & 0xffffffff
+                if not cls.is_known_hash(value):
+                    continue
+                kind = 'int'
+            else:
+                continue
+            hashes.append([kind, value, locate(instr.offset), instr.offset])
+        return {'hashes': hashes}
+
+    @classmethod
+    def is_known_hash(cls, value:int) -> bool:
+        return (value in known_hashes.FUNCTIONS or value in known_hashes.SYSCALLS or
+                value in known_hashes.VARIABLES or value in known_hashes.GROUPS)
+
+    def invalidate(self) -> NoReturn:
+        self._occurrences = None
+
+    def _build_lookups(self) -> NoReturn:
+        occurrences:Dict[int, List[HashOccurrence]] = {}
+        for filename, record in self.files.items():
+            for kind, value, function, offset in record['hashes']:
+                occurrences.setdefault(value, []).append(HashOccurrence(kind, value, filename, function, offset))
+        self._occurrences = occurrences
+
+    def occurrences(self, value:int, kinds:Optional[Set[str]]=None) -> List[HashOccurrence]:
+        """Return all occurrences of a hash in the index, optionally filtered by kind
+        """
+        if self._occurrences is None:
+            self._build_lookups()
+        found = self._occurrences.get(value, [])
+        if kinds is not None:
+            found = [o for o in found if o.kind in kinds]
+        return found
+
+    def occurrences_in(self, path:str, values:Set[int], kinds:Optional[Set[str]]=None) -> List[HashOccurrence]:
+        """Return the occurrences of any hash in a single file (re-scanned first if stale), sorted by offset
+        """
+        self.refresh(path)
+        return sorted((HashOccurrence(kind, value, path, function, offset)
+                for kind, value, function, offset in self.files[path]['hashes']
+                if value in values and (kinds is None or kind in kinds)),
+            key=lambda o: o.offset)
+
+
+del ABCMeta, abstractmethod, Callable, Dict, Iterator, List, NoReturn, Optional, Set, Tuple  # cleanup declaration-only imports